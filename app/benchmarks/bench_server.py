@@ -0,0 +1,196 @@
+"""Requests per second of a single uvicorn process against launcher.py
+
+Starts each server setup on a local port with the app's .env, then drives it
+with keep-alive connections from several client processes. From the app
+directory, with the database in .env reachable:
+
+    python -m benchmarks.bench_server --path /users/vendors --duration 15
+
+The single process setup is the previous `uvicorn main:app` command. The
+client processes share the machine with the server, so pin them apart
+(taskset) or run on a separate host with --host when measuring many cores.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _read_response(reader: asyncio.StreamReader) -> tuple[int, bool]:
+    """Status code and whether the server keeps the connection open"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    chunked = False
+    keep_alive = status_line.startswith(b"HTTP/1.1")
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        value = value.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding":
+            chunked = value == "chunked"
+        elif name == "connection":
+            keep_alive = value == "keep-alive" or (keep_alive and value != "close")
+    if chunked:
+        while size := int((await reader.readline()).split(b";")[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    elif length:
+        await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def _connection(host, port, request, deadline, latencies, statuses):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        started = time.perf_counter()
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await _read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            statuses["error"] = statuses.get("error", 0) + 1
+            writer.close()
+            writer = None
+            continue
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+def _client_process(host, port, path, connections, duration):
+    request = (
+        f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+        "Accept-Encoding: identity\r\n\r\n"
+    ).encode()
+    latencies = []
+    statuses = {}
+
+    async def run():
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(
+            *(
+                _connection(host, port, request, deadline, latencies, statuses)
+                for _ in range(connections)
+            )
+        )
+
+    asyncio.run(run())
+    return latencies, statuses
+
+
+def drive(host, port, path, connections, processes, duration):
+    per_process = max(1, connections // processes)
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(
+            pool.map(
+                _client_process,
+                *zip(*[(host, port, path, per_process, duration)] * processes),
+            )
+        )
+    latencies = sorted(value for result, _ in results for value in result)
+    statuses = {}
+    for _, result in results:
+        for status, count in result.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return latencies, statuses
+
+
+def wait_until_ready(host, port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on {host}:{port} did not start")
+
+
+def server_commands(host, port, workers):
+    launcher = [sys.executable, "launcher.py", "--host", host, "--port", str(port)]
+    if workers:
+        launcher += ["--workers", str(workers)]
+    return {
+        "single uvicorn": [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            host,
+            "--port",
+            str(port),
+            "--no-access-log",
+        ],
+        "launcher": launcher,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default="/users/vendors")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--client-processes", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    # The benchmark measures throughput, not the logging pipeline
+    env = {**os.environ, "ACCESS_LOG": "false", "LOG_LEVEL": "WARNING"}
+    print(f"{'setup':<16} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+    for name, command in server_commands(args.host, args.port, args.workers).items():
+        server = subprocess.Popen(command, cwd=APP_DIR, env=env)
+        try:
+            wait_until_ready(args.host, args.port)
+            drive(
+                args.host,
+                args.port,
+                args.path,
+                args.connections,
+                args.client_processes,
+                args.warmup,
+            )
+            latencies, statuses = drive(
+                args.host,
+                args.port,
+                args.path,
+                args.connections,
+                args.client_processes,
+                args.duration,
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+        throughput = len(latencies) / args.duration
+        p50 = statistics.median(latencies) * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+        print(f"{name:<16} {throughput:>9.0f} {p50:>8.2f} {p99:>8.2f}  {statuses}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Validation throughput on a single hot food item for different shard counts
+
+Runs the real validate_collection_code service against a disposable MongoDB.
+From the app directory:
+
+    python -m benchmarks.bench_sharded_counter --uri mongodb://localhost:27017
+
+Each round creates one food with enough stock, reserves one collection code
+per validation and then validates them all with `--concurrency` concurrent
+callers. Round 0 is the unsharded document.
+"""
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+from bson import ObjectId
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+
+from models import __models__
+from models.auth_model.auth_model import Principal
+from models.food_model.food_model import Food, FoodCountShard, CollectionCode
+from models.user_model.user_model import UserType
+from services.foods.food_counter_services import enable_count_shards
+from services.foods.food_services import validate_collection_code
+
+import argparse
+import asyncio
+import time
+
+
+async def prepare_food(vendor: Principal, shards: int, operations: int) -> Food:
+    food = Food(
+        food_type=f"bench-{shards}",
+        count=operations,
+        vendor_id=vendor.id,
+    )
+    await food.insert()
+    if shards:
+        await enable_count_shards(food, shards)
+        food = await Food.get(food.id)
+
+    expiration = datetime.now() + timedelta(hours=1)
+    codes = [
+        CollectionCode(code=100000 + index, expiration=expiration).model_dump()
+        for index in range(operations)
+    ]
+    if shards:
+        # Spread the codes evenly, as random reservations would on average
+        await FoodCountShard.get_motor_collection().bulk_write(
+            [
+                UpdateOne(
+                    {"food_id": food.id, "shard": shard},
+                    {"$push": {"collection_codes": {"$each": codes[shard::shards]}}},
+                )
+                for shard in range(shards)
+            ]
+        )
+    else:
+        await Food.get_motor_collection().update_one(
+            {"_id": food.id}, {"$push": {"collection_codes": {"$each": codes}}}
+        )
+    return food
+
+
+async def run_round(vendor: Principal, shards: int, operations: int, concurrency: int):
+    food = await prepare_food(vendor, shards, operations)
+    queue = asyncio.Queue()
+    for index in range(operations):
+        queue.put_nowait(100000 + index)
+
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        while not queue.empty():
+            code = queue.get_nowait()
+            try:
+                await validate_collection_code(food.food_type, code, vendor)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    await Food.get_motor_collection().delete_one({"_id": food.id})
+    await FoodCountShard.get_motor_collection().delete_many({"food_id": food.id})
+    return operations / elapsed, failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="shareodtu_benchmark")
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--shards", default="0,1,4,16")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(args.uri)
+    await init_beanie(database=client[args.db], document_models=__models__)
+    vendor = Principal(
+        id=ObjectId(),
+        email="bench@example.com",
+        user_type=UserType.VENDOR,
+    )
+
+    print(f"{'shards':>6} {'validations/s':>14} {'failures':>9}")
+    for shards in [int(value) for value in args.shards.split(",")]:
+        throughput, failures = await run_round(
+            vendor, shards, args.operations, args.concurrency
+        )
+        print(f"{shards:>6} {throughput:>14.0f} {failures:>9}")
+
+    await client.drop_database(args.db)
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
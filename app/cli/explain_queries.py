@@ -0,0 +1,214 @@
+"""Explain every query shape used by the services and flag slow plans
+
+Run from the app directory against a local database that has the indexes:
+
+    python -m cli.explain_queries [--uri mongodb://localhost:27017] [--db shareodtu]
+
+Plans that scan a whole collection (COLLSCAN) or sort in memory (SORT) are
+flagged, and the command exits with status 1 when any plan is flagged.
+"""
+
+from beanie import init_beanie
+from bson import ObjectId
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from models import __models__
+from models.user_model.user_model import User, VendorProfile
+from models.auth_model.auth_model import AuthChallenge
+from models.food_model.food_model import Food, FoodTombstone, FoodCountShard
+from models.email_model.email_model import OutboxEmail
+from models.idempotency_model.idempotency_model import IdempotencyRecord
+from models.version_model.version_model import ResourceVersion
+from models.lease_model.lease_model import WorkerLease
+
+import argparse
+import asyncio
+import sys
+
+
+_ID = ObjectId()
+
+# (name, model, filter, sort) for every find shape issued by services/
+QUERY_SHAPES = [
+    ("user by email", User, {"email": "johndoe@example.com"}, None),
+    ("user by id", User, {"_id": _ID}, None),
+    ("vendors", User, {"user_type": "vendor"}, None),
+    ("users by update time", User, {}, [("updated_at", -1)]),
+    ("vendor profile", VendorProfile, {"user_id": _ID}, None),
+    ("vendor profiles", VendorProfile, {"user_id": {"$in": [_ID]}}, None),
+    ("auth challenge", AuthChallenge, {"user_id": _ID}, None),
+    (
+        "food by vendor and type",
+        Food,
+        {"food_type": "Pizza", "vendor_id": _ID},
+        None,
+    ),
+    ("foods of a vendor", Food, {"vendor_id": _ID}, None),
+    (
+        "vendor food listing page",
+        Food,
+        {
+            "vendor_id": _ID,
+            "$or": [{"count": {"$lt": 10}}, {"count": 10, "_id": {"$gt": _ID}}],
+        },
+        [("count", -1), ("_id", 1)],
+    ),
+    (
+        "food changes",
+        Food,
+        {"change_seq": {"$gt": 0}, "vendor_id": _ID},
+        [("change_seq", 1)],
+    ),
+    (
+        "food changes, all vendors",
+        Food,
+        {"change_seq": {"$gt": 0}},
+        [("change_seq", 1)],
+    ),
+    (
+        "food tombstones",
+        FoodTombstone,
+        {"change_seq": {"$gt": 0}, "vendor_id": _ID},
+        [("change_seq", 1)],
+    ),
+    (
+        "unfinished shard moves",
+        Food,
+        {"shard_move.split": {"$exists": True}},
+        None,
+    ),
+    ("count shard", FoodCountShard, {"food_id": _ID, "shard": 0}, None),
+    (
+        "count shard holding a code",
+        FoodCountShard,
+        {"food_id": _ID, "collection_codes.code": 123456},
+        None,
+    ),
+    ("dirty count shards", FoodCountShard, {"dirty": True}, None),
+    (
+        "expired collection codes",
+        FoodCountShard,
+        {"collection_codes.expiration": {"$lt": datetime.now()}},
+        None,
+    ),
+    ("worker lease", WorkerLease, {"name": "count_shard_compaction"}, None),
+    (
+        "due outbox emails",
+        OutboxEmail,
+        {
+            "$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": datetime.now()}},
+                {"status": "sending", "locked_until": {"$lte": datetime.now()}},
+            ]
+        },
+        [("next_attempt_at", 1)],
+    ),
+    ("claimed outbox emails", OutboxEmail, {"claim_id": "claim"}, None),
+    ("idempotency key", IdempotencyRecord, {"key": "POST /foods/collect:key"}, None),
+    ("resource version", ResourceVersion, {"key": "global"}, None),
+]
+
+# (name, model, pipeline) for the aggregations
+AGGREGATE_SHAPES = [
+    (
+        "vendor stock total",
+        Food,
+        [
+            {"$match": {"vendor_id": _ID}},
+            {"$group": {"_id": None, "total": {"$sum": "$count"}}},
+        ],
+    ),
+    (
+        "sharded stock total",
+        FoodCountShard,
+        [
+            {"$match": {"food_id": _ID}},
+            {"$group": {"_id": None, "total": {"$sum": "$count"}}},
+        ],
+    ),
+]
+
+FLAGGED_STAGES = {"COLLSCAN", "SORT"}
+# Shapes that read a whole collection on purpose, reported but not counted
+EXPECTED_SCANS = {"users by update time"}
+
+
+def plan_stages(plan) -> set[str]:
+    """Every stage name in an explain plan, classic or slot based"""
+    stages = set()
+    if isinstance(plan, dict):
+        for key, value in plan.items():
+            if key == "stage" and isinstance(value, str):
+                stages.add(value)
+            else:
+                stages |= plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= plan_stages(item)
+    return stages
+
+
+def _winning_plan(explain: dict) -> dict:
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"]["winningPlan"]
+    # Aggregations report the plan of their $cursor stage
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            return stage["$cursor"]["queryPlanner"]["winningPlan"]
+    return explain
+
+
+async def explain_all(database) -> int:
+    flagged = 0
+    results = []
+    for name, model, query, sort in QUERY_SHAPES:
+        cursor = database[model.get_collection_name()].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        results.append((name, await cursor.explain()))
+    for name, model, pipeline in AGGREGATE_SHAPES:
+        explain = await database.command(
+            "explain",
+            {
+                "aggregate": model.get_collection_name(),
+                "pipeline": pipeline,
+                "cursor": {},
+            },
+            verbosity="queryPlanner",
+        )
+        results.append((name, explain))
+
+    for name, explain in results:
+        stages = plan_stages(_winning_plan(explain))
+        problems = sorted(stages & FLAGGED_STAGES)
+        if not problems:
+            status = "ok"
+        elif name in EXPECTED_SCANS:
+            status = "expected " + ", ".join(problems)
+        else:
+            status = "FLAG " + ", ".join(problems)
+            flagged += 1
+        print(f"{status:<20} {name}: {' > '.join(sorted(stages))}")
+    return flagged
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="shareodtu")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(args.uri)
+    database = client.get_database(args.db)
+    # Creates the declared indexes so the plans match production
+    await init_beanie(database=database, document_models=__models__)
+    flagged = await explain_all(database)
+    client.close()
+    total = len(QUERY_SHAPES) + len(AGGREGATE_SHAPES)
+    print(f"{flagged} of {total} query shapes flagged")
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
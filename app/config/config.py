@@ -4,6 +4,14 @@ from config.singleton import singleton
 from pydantic_settings import BaseSettings
 from beanie import init_beanie
 from models import __models__
+from services.monitoring.query_monitor import SlowQueryListener
+from services.monitoring.request_context import MongoTimingListener
+from services.monitoring.mongo_health import MongoHealthListener
+
+import logging
+
+
+logger = logging.getLogger(__name__)
 
 # Choose the environment file to load settings from
 env_file = os.environ.get("ENV_FILE", ".env")
@@ -13,11 +21,103 @@ env_file = os.environ.get("ENV_FILE", ".env")
 class Settings(BaseSettings):
     MONGO_URI: str
     MONGO_DB_NAME: str
+    # Index creation can be skipped in production once indexes exist
+    BEANIE_SKIP_INDEXES: bool = False
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    # How long a revoked token may keep working on another worker
+    TOKEN_STATE_CACHE_SECONDS: float = 30
     MAIL_USERNAME: str
     MAIL_PASSWORD: str
+    # Database commands slower than this are logged, 0 turns the log off
+    SLOW_QUERY_MS: float = 100
+
+    # launcher.py, WEB_CONCURRENCY=0 sizes the workers from the CPUs and
+    # memory the container may use. Keep-alive outlasts the 60s idle
+    # timeout of common load balancers so the proxy closes first
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8080
+    WEB_CONCURRENCY: int = 0
+    WORKER_MEMORY_MB: int = 256
+    KEEPALIVE_SECONDS: int = 65
+    BACKLOG: int = 2048
+    GRACEFUL_TIMEOUT_SECONDS: int = 30
+    WORKER_TIMEOUT_SECONDS: int = 60
+
+    # JSON logs go to stdout, ACCESS_LOG adds one line per request
+    LOG_LEVEL: str = "INFO"
+    ACCESS_LOG: bool = True
+
+    # Requests served at once by a worker, the reserved slots are kept for
+    # collection code validation and login. Requests queued past a budget
+    # or the timeout are refused with a 503
+    CONCURRENCY_LIMIT: int = 64
+    CONCURRENCY_RESERVED: int = 8
+    CONCURRENCY_QUEUE_BUDGET: int = 128
+    CONCURRENCY_LOW_QUEUE_BUDGET: int = 16
+    CONCURRENCY_QUEUE_TIMEOUT_SECONDS: float = 5
+    SHED_RETRY_AFTER_SECONDS: int = 2
+    EXPORT_CONCURRENCY: int = 2
+    IMPORT_CONCURRENCY: int = 1
+
+    # Database deadlines. Once admitted, a request gets
+    # MONGO_REQUEST_TIMEOUT_SECONDS for all of its queries, sent to the server
+    # as maxTimeMS. Exports, imports, uploads and background work are bounded
+    # per socket operation instead
+    MONGO_REQUEST_TIMEOUT_SECONDS: float = 5
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    MONGO_CONNECT_TIMEOUT_MS: int = 5000
+    MONGO_SOCKET_TIMEOUT_MS: int = 30000
+
+    # Responses of requests sent with an Idempotency-Key are replayed this long
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60
+    # A retry may take over a request still marked in progress after this
+    IDEMPOTENCY_LEASE_SECONDS: int = 30
+
+    # How often each worker picks up listing versions bumped by other workers
+    VERSION_SYNC_SECONDS: float = 1
+
+    # The food change feed holds back sequences reserved more recently than
+    # this, it has to outlast the slowest write (MONGO_REQUEST_TIMEOUT_SECONDS)
+    FOOD_CHANGES_SAFETY_LAG_SECONDS: float = 10
+
+    # How often sharded food counters are summed back into Food.count
+    COUNT_SHARD_COMPACTION_SECONDS: float = 2
+
+    # Event loop lag is sampled this often, and a loop that does not come
+    # back within the threshold gets its stack logged
+    LOOP_LAG_INTERVAL_SECONDS: float = 0.1
+    LOOP_BLOCK_THRESHOLD_SECONDS: float = 0.25
+
+    # Share of requests profiled when pyinstrument is installed, admins can
+    # also ask for a profile with the X-Profile header
+    PROFILE_SAMPLE_RATE: float = 0
+    PROFILE_INTERVAL_SECONDS: float = 0.001
+
+    # Vendor registration images are refused above this size
+    VENDOR_IMAGE_MAX_BYTES: int = 5 * 1024 * 1024
+
+    # Threads hashing passwords in parallel during bulk imports
+    PASSWORD_HASH_WORKERS: int = 4
+
+    # Response compression, levels favour CPU time over the last few percent
+    COMPRESSION_MIN_SIZE: int = 1024
+    GZIP_LEVEL: int = 5
+    BROTLI_QUALITY: int = 4
+
+    MAIL_SMTP_HOST: str = "smtp.gmail.com"
+    MAIL_SMTP_PORT: int = 587
+    SMTP_CONNECT_TIMEOUT_SECONDS: float = 10
+    SMTP_SEND_TIMEOUT_SECONDS: float = 20
+
+    # Email outbox delivery
+    EMAIL_OUTBOX_BATCH_SIZE: int = 20
+    EMAIL_OUTBOX_POLL_SECONDS: float = 5
+    EMAIL_OUTBOX_LEASE_SECONDS: int = 120
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 8
+    EMAIL_OUTBOX_BACKOFF_SECONDS: float = 30
+    EMAIL_OUTBOX_MAX_BACKOFF_SECONDS: float = 3600
 
     class Config:
         env_file = ".env"
@@ -26,18 +126,29 @@ class Settings(BaseSettings):
 
 async def connect_to_database():
     """Initiate database connection on startup"""
-    client = AsyncIOMotorClient(Settings().MONGO_URI, tlsCAFile=certifi.where())
+    # Database time and command count of each request go to the access log
+    event_listeners = [MongoTimingListener(), MongoHealthListener()]
+    if Settings().SLOW_QUERY_MS > 0:
+        event_listeners.append(SlowQueryListener(Settings().SLOW_QUERY_MS))
+    client = AsyncIOMotorClient(
+        Settings().MONGO_URI,
+        tlsCAFile=certifi.where(),
+        event_listeners=event_listeners,
+        serverSelectionTimeoutMS=Settings().MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=Settings().MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=Settings().MONGO_SOCKET_TIMEOUT_MS,
+    )
 
     await init_beanie(
         database=client.get_database(Settings().MONGO_DB_NAME),
         document_models=__models__,
+        skip_indexes=Settings().BEANIE_SKIP_INDEXES,
     )
     # Send a ping to confirm a successful connection
     try:
-        client.admin.command("ping")
-        print(f"Successfully connected to {Settings().MONGO_DB_NAME}")
-    except Exception as e:
-        print("Unable to connect to the database.")
-        print(e)
+        await client.admin.command("ping")
+        logger.info(f"Successfully connected to {Settings().MONGO_DB_NAME}")
+    except Exception:
+        logger.exception("Unable to connect to the database.")
 
     return client
@@ -0,0 +1,74 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+
+from config.config import Settings, connect_to_database
+from config.logging_config import stop_logging
+from services.shared.shared_services import warm_up_password_hashing
+from services.auth.auth_services import warm_up_jwt
+from services.versions.version_services import (
+    start_version_sync,
+    stop_version_sync,
+)
+from services.foods.food_counter_services import (
+    start_count_shard_compaction,
+    stop_count_shard_compaction,
+)
+from services.monitoring.loop_monitor import (
+    start_loop_monitor,
+    stop_loop_monitor,
+)
+from services.email.email_services import (
+    start_email_outbox_worker,
+    stop_email_outbox_worker,
+)
+
+import inspect
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """Collects how long each startup phase took"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+
+    async def run(self, name: str, step):
+        phase_started = time.perf_counter()
+        result = step()
+        if inspect.isawaitable(result):
+            result = await result
+        self.phases.append((name, time.perf_counter() - phase_started))
+        return result
+
+    def __str__(self):
+        total = time.perf_counter() - self.started
+        phases = ", ".join(f"{name} {duration:.3f}s" for name, duration in self.phases)
+        return f"Startup completed in {total:.3f}s ({phases})"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    report = StartupReport()
+    await report.run("settings", Settings)
+    app.state.mongo_client = await report.run("database", connect_to_database)
+    await report.run("bcrypt", warm_up_password_hashing)
+    await report.run("jwt", warm_up_jwt)
+    await report.run("listing_versions", start_version_sync)
+    await report.run("email_outbox", start_email_outbox_worker)
+    await report.run("count_shards", start_count_shard_compaction)
+    await report.run("loop_monitor", start_loop_monitor)
+    logger.info(str(report))
+
+    yield
+
+    await stop_loop_monitor()
+    await stop_count_shard_compaction()
+    await stop_email_outbox_worker()
+    await stop_version_sync()
+    app.state.mongo_client.close()
+    stop_logging()
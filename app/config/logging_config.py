@@ -0,0 +1,98 @@
+from services.monitoring.request_context import get_request_context
+from config.config import Settings
+
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+
+
+_listener: QueueListener | None = None
+_fork_handler_registered = False
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, tagged with the current request id"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _RequestQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The stock prepare formats the whole record, traceback included, on
+        # the caller's thread. Only the request id and the message arguments
+        # are resolved here, exc_info is left for the writer thread.
+        record = copy.copy(record)
+        context = get_request_context()
+        if context is not None:
+            record.request_id = context.request_id
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging():
+    """Route every log record through a queue to a stdout writer thread
+
+    Handlers on the loop only enqueue, the formatting and the blocking write
+    to stdout happen on the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    if not _fork_handler_registered:
+        _register_fork_handler()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.handlers = [_RequestQueueHandler(log_queue)]
+    root.setLevel(Settings().LOG_LEVEL)
+    # Requests are logged by the access log middleware
+    logging.getLogger("uvicorn.access").disabled = True
+    for name in ("uvicorn", "uvicorn.error"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+
+
+def _register_fork_handler():
+    global _fork_handler_registered
+    _fork_handler_registered = True
+
+    def restart_in_child():
+        # The writer thread is not copied into forked workers, they start
+        # their own with a fresh queue
+        global _listener
+        if _listener is not None:
+            _listener = None
+            setup_logging()
+
+    os.register_at_fork(after_in_child=restart_in_child)
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -2,9 +2,19 @@
 from routers.users.users_base import router as UserRouters
 from routers.auth.auth_base import router as AuthRouters
 from routers.foods.foods_base import router as FoodRouters
+from routers.exports.exports_base import router as ExportRouters
+from routers.imports.imports_base import router as ImportRouters
+from routers.profiles.profiles_base import router as ProfileRouters
+from routers.metrics.metrics_base import router as MetricsRouters
+from routers.health.health_base import router as HealthRouters
 
 routers = [
     UserRouters,
     AuthRouters,
     FoodRouters,
+    ExportRouters,
+    ImportRouters,
+    ProfileRouters,
+    MetricsRouters,
+    HealthRouters,
 ]
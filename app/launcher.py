@@ -0,0 +1,171 @@
+"""Production server: the app is loaded once, then forked into workers
+
+Run from the app directory:
+
+    python launcher.py [--host 0.0.0.0] [--port 8080] [--workers N]
+
+Gunicorn supervises uvicorn workers, which use uvloop and httptools when
+they are installed. Without gunicorn (Windows) uvicorn runs the workers.
+"""
+
+from config.config import Settings
+from config.logging_config import setup_logging
+
+import argparse
+import logging
+import math
+import os
+import uvicorn
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn does not run on Windows, uvicorn forks there
+    BaseApplication = None
+
+try:
+    import uvicorn_worker
+except ImportError:  # uvicorn < 0.30 still ships the worker
+    uvicorn_worker = None
+
+
+logger = logging.getLogger("launcher")
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> float | None:
+    """CPUs allowed by the container's CFS quota, None when unlimited"""
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    # cgroup v1
+    quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit() -> int | None:
+    """Bytes of memory allowed to the container, None when unlimited"""
+    for path in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        value = _read(path)
+        if value and value != "max":
+            # cgroup v1 reports a huge number when there is no limit
+            if int(value) < 1 << 60:
+                return int(value)
+            return None
+    return None
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def worker_count(settings) -> int:
+    """One worker per usable CPU, as many as the memory limit allows
+
+    Async workers keep their core busy on their own, more workers than CPUs
+    only adds context switches.
+    """
+    if settings.WEB_CONCURRENCY > 0:
+        return settings.WEB_CONCURRENCY
+    workers = available_cpus()
+    memory = cgroup_memory_limit()
+    if memory is not None:
+        workers = min(workers, memory // (settings.WORKER_MEMORY_MB * 1024 * 1024))
+    return max(1, workers)
+
+
+def _worker_class() -> str:
+    if uvicorn_worker is not None:
+        return "uvicorn_worker.UvicornWorker"
+    return "uvicorn.workers.UvicornWorker"
+
+
+def run_gunicorn(host: str, port: int, workers: int, settings):
+    class Launcher(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": _worker_class(),
+                # Import the app, connect nothing, then fork: workers share
+                # the loaded modules and start faster
+                "preload_app": True,
+                "keepalive": settings.KEEPALIVE_SECONDS,
+                "backlog": settings.BACKLOG,
+                "graceful_timeout": settings.GRACEFUL_TIMEOUT_SECONDS,
+                "timeout": settings.WORKER_TIMEOUT_SECONDS,
+                # The app writes its own access log
+                "accesslog": None,
+                # Heartbeat files on tmpfs rather than the container's disk
+                "worker_tmp_dir": "/dev/shm" if os.path.isdir("/dev/shm") else None,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+
+            return app
+
+    Launcher().run()
+
+
+def run_uvicorn(host: str, port: int, workers: int, settings):
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        timeout_keep_alive=settings.KEEPALIVE_SECONDS,
+        backlog=settings.BACKLOG,
+        access_log=False,
+    )
+
+
+def main():
+    setup_logging()
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    workers = args.workers or worker_count(settings)
+    logger.info(
+        f"Starting {workers} workers on {args.host}:{args.port} "
+        f"({available_cpus()} CPUs available)"
+    )
+    if BaseApplication is None:
+        run_uvicorn(args.host, args.port, workers, settings)
+    else:
+        run_gunicorn(args.host, args.port, workers, settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,25 @@ from fastapi.middleware.cors import CORSMiddleware
 
 
 from config.routers_config import routers
-from config.config import connect_to_database
+from config.lifespan import lifespan
+from config.logging_config import setup_logging
+from middlewares.compression_middleware import CompressionMiddleware
+from middlewares.query_origin_middleware import QueryOriginMiddleware
+from middlewares.profiling_middleware import ProfilingMiddleware
+from middlewares.load_shedding_middleware import LoadSheddingMiddleware
+from middlewares.mongo_guard_middleware import (
+    MongoDeadlineMiddleware,
+    MongoGuardMiddleware,
+)
+from middlewares.access_log_middleware import AccessLogMiddleware
+
+
+setup_logging()
 
 
 app = FastAPI(
     title="ShareODTÜ API",
-    on_startup=[connect_to_database],
+    lifespan=lifespan,
 )
 
 origins = [
@@ -26,9 +39,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the frontend for paging and conditional requests
+    expose_headers=["X-Next-Cursor", "ETag"],
     allow_origin_regex="https://.*\.vercel.app",
 )
 
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(QueryOriginMiddleware)
+app.add_middleware(ProfilingMiddleware)
+# Inside the limiter, so the deadline starts once the request is admitted
+app.add_middleware(MongoDeadlineMiddleware)
+app.add_middleware(LoadSheddingMiddleware)
+# Refuses requests during a database outage before they take a slot
+app.add_middleware(MongoGuardMiddleware)
+# Outermost, so the logged latency covers every other middleware
+app.add_middleware(AccessLogMiddleware)
+
 
 # Include all routers
 for router in routers:
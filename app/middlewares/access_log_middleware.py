@@ -0,0 +1,66 @@
+from services.monitoring.request_context import begin_request_context
+from config.config import Settings
+
+from starlette.datastructures import Headers, MutableHeaders
+
+import logging
+import time
+import uuid
+
+
+logger = logging.getLogger("access")
+
+
+class AccessLogMiddleware:
+    """Give each request an id and log one JSON line when it finishes
+
+    The id is taken from the X-Request-ID header when the client sends one
+    and is echoed back on the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = Settings().ACCESS_LOG
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id") or uuid.uuid4().hex
+        context = begin_request_context(request_id[:64])
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = context.request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if self.enabled:
+                route = scope.get("route")
+                logger.info(
+                    "%s %s %s",
+                    scope["method"],
+                    scope["path"],
+                    status_code,
+                    extra={
+                        "fields": {
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "route": getattr(route, "path", None),
+                            "status": status_code,
+                            "latency_ms": round(
+                                (time.perf_counter() - started) * 1000, 2
+                            ),
+                            "user_id": context.user_id,
+                            "mongo_ms": round(context.mongo_micros / 1000, 2),
+                            "mongo_ops": context.mongo_ops,
+                        }
+                    },
+                )
@@ -0,0 +1,92 @@
+from services.shared.compression import (
+    StreamCompressor,
+    choose_encoding,
+    compress,
+    is_compressible,
+)
+from config.config import Settings
+
+from starlette.datastructures import Headers, MutableHeaders
+
+
+class CompressionMiddleware:
+    """Compress JSON and text responses with brotli or gzip
+
+    Small bodies are sent as they are, streamed bodies are compressed chunk by
+    chunk and responses that are already encoded are left untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.minimum_size = Settings().COMPRESSION_MIN_SIZE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def _flush_start(self):
+        if self.start_message is not None:
+            await self.send(self.start_message)
+            self.start_message = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk shows how large it is
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or not is_compressible(headers.get("content-type"))
+            )
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._flush_start()
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self._flush_start()
+                await self.send(message)
+                return
+
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            if not more_body:
+                body = compress(body, self.encoding)
+                headers["Content-Length"] = str(len(body))
+                await self._flush_start()
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            self.compressor = StreamCompressor(self.encoding)
+            await self._flush_start()
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.send(
+            {"type": "http.response.body", "body": chunk, "more_body": more_body}
+        )
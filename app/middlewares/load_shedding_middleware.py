@@ -0,0 +1,45 @@
+from services.shared.concurrency_limits import (
+    UNLIMITED_PATHS,
+    Overloaded,
+    classify,
+    get_concurrency_limits,
+    release,
+)
+from config.config import Settings
+
+from fastapi.responses import JSONResponse
+
+
+class LoadSheddingMiddleware:
+    """Limit concurrent requests, admitting the most urgent ones first
+
+    Collection code validation and login are served ahead of listings and
+    exports, and requests that would wait past their queue budget or the
+    queue timeout get a 503 with Retry-After instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.retry_after = str(Settings().SHED_RETRY_AFTER_SECONDS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNLIMITED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        priority, group = classify(scope["method"], scope["path"])
+        limits = get_concurrency_limits()
+        try:
+            held = await limits.acquire(priority, group)
+        except Overloaded:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry"},
+                status_code=503,
+                headers={"Retry-After": self.retry_after},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            release(held)
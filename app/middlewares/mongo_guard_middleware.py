@@ -0,0 +1,76 @@
+from services.monitoring.mongo_health import is_mongo_outage, mongo_breaker
+from services.shared.concurrency_limits import UNLIMITED_PATHS, classify
+from config.config import Settings
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+import pymongo
+import time
+
+
+# Route groups that stream whole collections and may run for minutes
+_UNBOUNDED_GROUPS = {"exports", "imports"}
+
+
+class MongoGuardMiddleware:
+    """Fail fast while the Mongo breaker is open
+
+    Outermost of the database middlewares, so requests are refused before
+    they queue for a slot or pile up on the connection pool.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and scope["path"] not in UNLIMITED_PATHS
+            and not mongo_breaker.allow()
+        ):
+            response = JSONResponse(
+                {"detail": "Database unavailable, please retry"},
+                status_code=503,
+                headers={"Retry-After": str(mongo_breaker.retry_after())},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+class MongoDeadlineMiddleware:
+    """Bound the database time of an admitted request
+
+    Runs inside the load shedding middleware, so time spent queued for a
+    slot does not count. Every query of the request shares one deadline,
+    which pymongo sends as maxTimeMS. Uploads are streamed to GridFS while
+    the body arrives, they are bounded per socket operation instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.timeout = Settings().MONGO_REQUEST_TIMEOUT_SECONDS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNLIMITED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        _, group = classify(scope["method"], scope["path"])
+        content_type = Headers(scope=scope).get("content-type", "")
+        if group in _UNBOUNDED_GROUPS or content_type.startswith("multipart/"):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            with pymongo.timeout(self.timeout):
+                await self.app(scope, receive, send)
+        except Exception as e:
+            # A deadline this request used up is not a database failure.
+            # Services usually turn errors into responses, the command and
+            # topology listeners see those outages.
+            if is_mongo_outage(e) and time.monotonic() - started < self.timeout:
+                mongo_breaker.record_failure(e)
+            raise
@@ -0,0 +1,67 @@
+from services.profiling.profile_services import (
+    profiling_available,
+    is_admin_token,
+    start_profiler,
+    save_profile,
+)
+from config.config import Settings
+
+from bson import ObjectId
+from starlette.datastructures import Headers, MutableHeaders
+
+import random
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware:
+    """Profile sampled requests, or admin requests sent with X-Profile: 1
+
+    The profile is stored as a speedscope file and its id is returned in the
+    X-Profile-Id header. Unprofiled requests only pay for a header lookup.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sample_rate = Settings().PROFILE_SAMPLE_RATE
+
+    async def _wanted(self, scope) -> bool:
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+        headers = Headers(scope=scope)
+        if headers.get("x-profile") not in ("1", "true"):
+            return False
+        return await is_admin_token(headers.get("authorization"))
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not profiling_available()
+            or not await self._wanted(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = ObjectId()
+        status_code = None
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Profile-Id"] = str(profile_id)
+            await send(message)
+
+        profiler = start_profiler()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            try:
+                await save_profile(
+                    profile_id, profiler, scope["method"], scope["path"], status_code
+                )
+            except Exception:
+                logger.exception("Failed to save request profile")
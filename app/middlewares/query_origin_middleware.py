@@ -0,0 +1,13 @@
+from services.monitoring.query_monitor import remember_query_origin
+
+
+class QueryOriginMiddleware:
+    """Mark the request task so that slow queries can name their service"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            remember_query_origin()
+        await self.app(scope, receive, send)
@@ -0,0 +1,42 @@
+from beanie import free_fall_migration
+from pymongo import UpdateOne
+
+from models.food_model.food_model import Food
+from models.version_model.version_model import ResourceVersion
+from services.foods.food_change_services import next_change_seq
+
+
+class Forward:
+    @free_fall_migration(document_models=[Food, ResourceVersion])
+    async def backfill_change_seq(self, session):
+        """Give foods created before the change feed a sequence number"""
+        collection = Food.get_motor_collection()
+        missing = {"change_seq": {"$exists": False}}
+        food_ids = [
+            food["_id"]
+            async for food in collection.find(missing, {"_id": 1}, session=session)
+        ]
+        if not food_ids:
+            return
+
+        first_seq = await next_change_seq(len(food_ids)) - len(food_ids) + 1
+        for start in range(0, len(food_ids), 500):
+            await collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": food_id, **missing},
+                        {"$set": {"change_seq": first_seq + start + index}},
+                    )
+                    for index, food_id in enumerate(food_ids[start : start + 500])
+                ],
+                ordered=False,
+                session=session,
+            )
+
+
+class Backward:
+    @free_fall_migration(document_models=[Food])
+    async def remove_change_seq(self, session):
+        await Food.get_motor_collection().update_many(
+            {}, {"$unset": {"change_seq": ""}}, session=session
+        )
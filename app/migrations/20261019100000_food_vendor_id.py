@@ -0,0 +1,75 @@
+from beanie import free_fall_migration
+from bson import DBRef
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from models.food_model.food_model import Food
+from models.user_model.user_model import User
+
+
+BATCH_SIZE = 500
+
+
+async def _drop_index(collection, keys, session):
+    try:
+        await collection.drop_index(keys, session=session)
+    except OperationFailure:
+        pass
+
+
+class Forward:
+    @free_fall_migration(document_models=[Food])
+    async def flatten_vendor_link(self, session):
+        """Replace the vendor DBRef with a plain vendor_id"""
+        collection = Food.get_motor_collection()
+        batch = []
+        async for food in collection.find(
+            {"vendor": {"$exists": True}}, {"vendor": 1}, session=session
+        ):
+            batch.append(
+                UpdateOne(
+                    {"_id": food["_id"]},
+                    {
+                        "$set": {"vendor_id": food["vendor"].id},
+                        "$unset": {"vendor": ""},
+                    },
+                )
+            )
+            if len(batch) == BATCH_SIZE:
+                await collection.bulk_write(batch, ordered=False, session=session)
+                batch = []
+        if batch:
+            await collection.bulk_write(batch, ordered=False, session=session)
+
+        await _drop_index(
+            collection,
+            [("vendor.$id", 1), ("count", -1), ("_id", 1)],
+            session,
+        )
+        await _drop_index(collection, [("vendor.$id", 1), ("change_seq", 1)], session)
+
+
+class Backward:
+    @free_fall_migration(document_models=[Food, User])
+    async def restore_vendor_link(self, session):
+        collection = Food.get_motor_collection()
+        batch = []
+        async for food in collection.find(
+            {"vendor_id": {"$exists": True}}, {"vendor_id": 1}, session=session
+        ):
+            batch.append(
+                UpdateOne(
+                    {"_id": food["_id"]},
+                    {
+                        "$set": {
+                            "vendor": DBRef(User.get_collection_name(), food["vendor_id"])
+                        },
+                        "$unset": {"vendor_id": ""},
+                    },
+                )
+            )
+            if len(batch) == BATCH_SIZE:
+                await collection.bulk_write(batch, ordered=False, session=session)
+                batch = []
+        if batch:
+            await collection.bulk_write(batch, ordered=False, session=session)
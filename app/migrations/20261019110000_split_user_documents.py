@@ -0,0 +1,102 @@
+from beanie import free_fall_migration
+from pymongo import UpdateOne
+
+from models.user_model.user_model import User, VendorProfile
+from models.auth_model.auth_model import AuthChallenge
+
+
+BATCH_SIZE = 500
+
+PROFILE_FIELDS = [
+    "vendor_address",
+    "facility_name",
+    "vendor_phone",
+    "vendor_identity_no",
+    "image",
+]
+CHALLENGE_FIELDS = [
+    "verification_code",
+    "verification_code_expiration",
+    "reset_password_code",
+    "reset_password_code_expiration",
+    "reset_token",
+    "reset_token_expiration",
+]
+
+
+def _moved_fields(document: dict, fields: list) -> dict:
+    return {
+        field: document[field] for field in fields if document.get(field) is not None
+    }
+
+
+async def _flush(collection, batch: list, session):
+    if batch:
+        await collection.bulk_write(batch, ordered=False, session=session)
+        batch.clear()
+
+
+class Forward:
+    @free_fall_migration(document_models=[User, VendorProfile, AuthChallenge])
+    async def split_user_documents(self, session):
+        """Move vendor profiles and pending codes out of the user documents"""
+        users = User.get_motor_collection()
+        profiles = VendorProfile.get_motor_collection()
+        challenges = AuthChallenge.get_motor_collection()
+        moved = PROFILE_FIELDS + CHALLENGE_FIELDS
+
+        profile_batch, challenge_batch, user_batch = [], [], []
+        async for user in users.find(
+            {"$or": [{field: {"$exists": True}} for field in moved]},
+            {field: 1 for field in moved},
+            session=session,
+        ):
+            profile = _moved_fields(user, PROFILE_FIELDS)
+            if profile:
+                profile_batch.append(
+                    UpdateOne({"user_id": user["_id"]}, {"$set": profile}, upsert=True)
+                )
+            challenge = _moved_fields(user, CHALLENGE_FIELDS)
+            if challenge:
+                challenge_batch.append(
+                    UpdateOne(
+                        {"user_id": user["_id"]}, {"$set": challenge}, upsert=True
+                    )
+                )
+            user_batch.append(
+                UpdateOne(
+                    {"_id": user["_id"]},
+                    {"$unset": {field: "" for field in moved}},
+                )
+            )
+            if len(user_batch) == BATCH_SIZE:
+                # Copies are written before the fields are removed from the user
+                await _flush(profiles, profile_batch, session)
+                await _flush(challenges, challenge_batch, session)
+                await _flush(users, user_batch, session)
+        await _flush(profiles, profile_batch, session)
+        await _flush(challenges, challenge_batch, session)
+        await _flush(users, user_batch, session)
+
+
+class Backward:
+    @free_fall_migration(document_models=[User, VendorProfile, AuthChallenge])
+    async def merge_user_documents(self, session):
+        users = User.get_motor_collection()
+        for model, fields in (
+            (VendorProfile, PROFILE_FIELDS),
+            (AuthChallenge, CHALLENGE_FIELDS),
+        ):
+            batch = []
+            async for document in model.get_motor_collection().find(
+                {}, session=session
+            ):
+                values = _moved_fields(document, fields)
+                if values:
+                    batch.append(
+                        UpdateOne({"_id": document["user_id"]}, {"$set": values})
+                    )
+                if len(batch) == BATCH_SIZE:
+                    await _flush(users, batch, session)
+            await _flush(users, batch, session)
+            await model.get_motor_collection().delete_many({}, session=session)
@@ -0,0 +1,64 @@
+from beanie import free_fall_migration
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from models.user_model.user_model import VendorProfile
+from services.images.image_services import IMAGE_BUCKET, sniff_image_type
+
+import base64
+import binascii
+
+
+def _bucket():
+    database = VendorProfile.get_motor_collection().database
+    return AsyncIOMotorGridFSBucket(database, bucket_name=IMAGE_BUCKET)
+
+
+class Forward:
+    @free_fall_migration(document_models=[VendorProfile])
+    async def move_images_to_gridfs(self, session):
+        """Store registration images as raw files instead of base64 in profiles"""
+        profiles = VendorProfile.get_motor_collection()
+        bucket = _bucket()
+        async for profile in profiles.find(
+            {"image": {"$exists": True}}, {"image": 1}, session=session
+        ):
+            image_id = None
+            if profile["image"]:
+                # Registrations stored the base64 text of the upload
+                try:
+                    data = base64.b64decode(profile["image"], validate=True)
+                except (binascii.Error, ValueError):
+                    data = bytes(profile["image"])
+                image_id = await bucket.upload_from_stream(
+                    "image",
+                    data,
+                    metadata={"contentType": sniff_image_type(data) or "image/jpeg"},
+                    session=session,
+                )
+            await profiles.update_one(
+                {"_id": profile["_id"]},
+                {"$set": {"image_id": image_id}, "$unset": {"image": ""}},
+                session=session,
+            )
+
+
+class Backward:
+    @free_fall_migration(document_models=[VendorProfile])
+    async def move_images_to_profiles(self, session):
+        profiles = VendorProfile.get_motor_collection()
+        bucket = _bucket()
+        async for profile in profiles.find(
+            {"image_id": {"$exists": True}}, {"image_id": 1}, session=session
+        ):
+            image = None
+            if profile["image_id"]:
+                download = await bucket.open_download_stream(
+                    profile["image_id"], session=session
+                )
+                image = base64.b64encode(await download.read())
+                await bucket.delete(profile["image_id"], session=session)
+            await profiles.update_one(
+                {"_id": profile["_id"]},
+                {"$set": {"image": image}, "$unset": {"image_id": ""}},
+                session=session,
+            )
@@ -1,8 +1,29 @@
-from models.user_model.user_model import User
-from models.food_model.food_model import Food
+from models.user_model.user_model import User, VendorProfile
+from models.auth_model.auth_model import AuthChallenge
+from models.food_model.food_model import Food, FoodTombstone, FoodCountShard
+from models.email_model.email_model import OutboxEmail
+from models.idempotency_model.idempotency_model import IdempotencyRecord
+from models.version_model.version_model import ResourceVersion
+from models.profile_model.profile_model import RequestProfile
+from models.lease_model.lease_model import WorkerLease
 
 __models__ = [
     # Main models
     User,
     Food,
+    # Cold user data kept out of the authentication path
+    VendorProfile,
+    AuthChallenge,
+    FoodTombstone,
+    FoodCountShard,
+    # Background delivery
+    OutboxEmail,
+    # Request deduplication
+    IdempotencyRecord,
+    # Listing versions for conditional requests
+    ResourceVersion,
+    # Sampled request profiles
+    RequestProfile,
+    # Periodic jobs run by a single worker
+    WorkerLease,
 ]
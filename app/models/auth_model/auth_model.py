@@ -1,4 +1,8 @@
 from pydantic import BaseModel, Field, EmailStr
+from beanie import Document, Indexed, PydanticObjectId
+from models.user_model.user_model import UserType
+from datetime import datetime
+from typing import Optional
 
 
 class Token(BaseModel):
@@ -10,6 +14,43 @@ class TokenData(BaseModel):
     email: EmailStr | None = None
 
 
+class Principal(BaseModel):
+    """Caller identity taken from the access token claims"""
+
+    id: PydanticObjectId = Field(..., example="66f1c0b2e4b0a1a2b3c4d5e6")
+    email: EmailStr = Field(..., example="johndoe@example.com")
+    user_type: UserType = Field(..., example=UserType.DEFAULT.value)
+    token_version: int = Field(0, example=0)
+
+
+class TokenState(BaseModel):
+    """Projection used to check whether a token has been revoked"""
+
+    token_version: int = Field(0, example=0)
+    disabled: bool = Field(False, example=False)
+
+
+class AuthChallenge(Document):
+    """Pending verification and password reset codes of a user"""
+
+    user_id: Indexed(PydanticObjectId, unique=True) = Field(
+        ..., example="66f1c0b2e4b0a1a2b3c4d5e6"
+    )
+    verification_code: Optional[int] = Field(None, example=123456)
+    verification_code_expiration: Optional[datetime] = Field(
+        None, example=datetime.now()
+    )
+    reset_password_code: Optional[int] = Field(None, example=123456)
+    reset_password_code_expiration: Optional[datetime] = Field(
+        None, example=datetime.now()
+    )
+    reset_token: Optional[str] = Field(None, example="reset_token")
+    reset_token_expiration: Optional[datetime] = Field(None, example=datetime.now())
+
+    class Settings:
+        name = "auth_challenges"
+
+
 class VerificationData(BaseModel):
     email: EmailStr | None = None
     code: int = Field(..., example=123456)
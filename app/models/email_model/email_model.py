@@ -0,0 +1,47 @@
+from enum import Enum
+from datetime import datetime
+from beanie import Document, Indexed
+from pydantic import Field, EmailStr
+from typing import Optional
+
+import pymongo
+
+
+class EmailStatus(str, Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+class OutboxEmail(Document):
+    recipient: EmailStr = Field(..., example="johndoe@example.com")
+    subject: str = Field(..., example="Verification Code")
+    body: str = Field(..., example="To verify your account, please enter the code: ")
+    # Unique per logical message, also used as the SMTP Message-ID so that a
+    # redelivery after a crash is recognised as the same message.
+    dedupe_key: Indexed(str, unique=True) = Field(..., example="verification:1234")
+    status: EmailStatus = Field(EmailStatus.PENDING, example=EmailStatus.PENDING)
+    attempts: int = Field(0, example=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.now)
+    claim_id: Optional[str] = Field(None, example="claim_id")
+    locked_until: Optional[datetime] = Field(None, example=datetime.now())
+    last_error: Optional[str] = Field(None, example="Connection refused")
+    created_at: datetime = Field(default_factory=datetime.now)
+    sent_at: Optional[datetime] = Field(None, example=datetime.now())
+
+    class Settings:
+        name = "email_outbox"
+        indexes = [
+            pymongo.IndexModel(
+                [
+                    ("status", pymongo.ASCENDING),
+                    ("next_attempt_at", pymongo.ASCENDING),
+                ]
+            ),
+            # Delivered messages are kept for a week for troubleshooting
+            pymongo.IndexModel(
+                [("sent_at", pymongo.ASCENDING)],
+                expireAfterSeconds=7 * 24 * 60 * 60,
+            ),
+        ]
@@ -1,21 +1,144 @@
 from datetime import datetime, timedelta
-from beanie import Document, Link
+from beanie import Document, PydanticObjectId
 from pydantic import Field, BaseModel
-from models.user_model.user_model import User
 from fastapi import Form, Body
 from typing import List, Optional, Dict
 
+import pymongo
+
 
 class CollectionCode(BaseModel):
     code: int
     expiration: datetime
 
 
+class ShardMove(BaseModel):
+    """Stock and codes on their way between a food and its count shards"""
+
+    # True while moving into new shards, False while folding them back
+    split: bool = Field(..., example=True)
+    # Split: the stock and codes handed to the shards
+    count: int = Field(0, example=10)
+    collection_codes: List[Optional[CollectionCode]] = Field(default_factory=list)
+    # Fold: shards already added back to the food
+    folded: List[PydanticObjectId] = Field(default_factory=list)
+
+
 class Food(Document):
     food_type: str = Field(..., example="Pizza")
     count: int = Field(0, example=10)
-    vendor: Link[User] = Field(..., example="User")
+    vendor_id: PydanticObjectId = Field(..., example="66f1c0b2e4b0a1a2b3c4d5e7")
     collection_codes: List[Optional[CollectionCode]] = Field(default_factory=list)
+    # Position in the global food change feed, see /foods/changes
+    change_seq: int = Field(0, example=42)
+    # When above zero the stock lives in FoodCountShard documents and `count`
+    # is a snapshot refreshed by the compaction worker
+    count_shards: int = Field(0, example=0)
+    # Set until a switch of count_shards has moved everything, a crash
+    # leaves it for the compaction worker to finish
+    shard_move: Optional[ShardMove] = None
+
+    class Settings:
+        # Read-modify-write updates are guarded by the revision id
+        use_revision = True
+        indexes = [
+            # A vendor has at most one food of each type. Partial, so foods
+            # still holding the vendor link before the vendor_id migration
+            # do not collide as null vendor ids
+            pymongo.IndexModel(
+                [
+                    ("vendor_id", pymongo.ASCENDING),
+                    ("food_type", pymongo.ASCENDING),
+                ],
+                unique=True,
+                partialFilterExpression={"vendor_id": {"$exists": True}},
+            ),
+            # Serves the per-vendor listing sorted by count, keyset paginated
+            pymongo.IndexModel(
+                [
+                    ("vendor_id", pymongo.ASCENDING),
+                    ("count", pymongo.DESCENDING),
+                    ("_id", pymongo.ASCENDING),
+                ]
+            ),
+            pymongo.IndexModel([("change_seq", pymongo.ASCENDING)]),
+            pymongo.IndexModel(
+                [
+                    ("vendor_id", pymongo.ASCENDING),
+                    ("change_seq", pymongo.ASCENDING),
+                ]
+            ),
+            pymongo.IndexModel(
+                [("shard_move.split", pymongo.ASCENDING)],
+                partialFilterExpression={"shard_move.split": {"$exists": True}},
+            ),
+        ]
+
+
+class FoodTombstone(Document):
+    """Marks a deleted food so delta sync clients can drop it"""
+
+    food_id: PydanticObjectId = Field(..., example="66f1c0b2e4b0a1a2b3c4d5e6")
+    vendor_id: PydanticObjectId = Field(..., example="66f1c0b2e4b0a1a2b3c4d5e7")
+    food_type: str = Field(..., example="Pizza")
+    change_seq: int = Field(..., example=42)
+    deleted_at: datetime = Field(default_factory=datetime.now)
+
+    class Settings:
+        name = "food_tombstones"
+        indexes = [
+            pymongo.IndexModel([("change_seq", pymongo.ASCENDING)]),
+            pymongo.IndexModel(
+                [
+                    ("vendor_id", pymongo.ASCENDING),
+                    ("change_seq", pymongo.ASCENDING),
+                ]
+            ),
+        ]
+
+
+class FoodCountShard(Document):
+    """One of the sub-counters of a hot food item"""
+
+    food_id: PydanticObjectId = Field(..., example="66f1c0b2e4b0a1a2b3c4d5e6")
+    shard: int = Field(..., example=0)
+    count: int = Field(0, example=10)
+    collection_codes: List[CollectionCode] = Field(default_factory=list)
+    # Set by every stock change, the compaction worker only sums these foods
+    dirty: bool = Field(False, example=False)
+    # False until a split has handed this shard its part of the stock
+    seeded: bool = Field(True, example=True)
+    # Set when a fold takes the shard, writers then go to the food instead
+    sealed: bool = Field(False, example=False)
+
+    class Settings:
+        name = "food_count_shards"
+        indexes = [
+            pymongo.IndexModel(
+                [("food_id", pymongo.ASCENDING), ("shard", pymongo.ASCENDING)],
+                unique=True,
+            ),
+            pymongo.IndexModel(
+                [
+                    ("food_id", pymongo.ASCENDING),
+                    ("collection_codes.code", pymongo.ASCENDING),
+                ]
+            ),
+            pymongo.IndexModel(
+                [("food_id", pymongo.ASCENDING)],
+                name="dirty_food_id",
+                partialFilterExpression={"dirty": True},
+            ),
+            pymongo.IndexModel([("collection_codes.expiration", pymongo.ASCENDING)]),
+        ]
+
+
+class FoodListItem(BaseModel):
+    """Projection used by the vendor food listing"""
+
+    id: PydanticObjectId = Field(..., alias="_id")
+    food_type: str = Field(..., example="Pizza")
+    count: int = Field(0, example=10)
 
 
 class CreateFood(BaseModel):
@@ -23,11 +146,27 @@ class CreateFood(BaseModel):
     count: int = Form(..., example=10)
 
 
+class ImportFood(BaseModel):
+    """One row of an admin food import"""
+
+    vendor_id: PydanticObjectId = Field(..., example="66f1c0b2e4b0a1a2b3c4d5e7")
+    food_type: str = Field(..., example="Pizza")
+    count: int = Field(0, ge=0, example=10)
+
+
 class UpdateFood(BaseModel):
     food_name: Optional[str] = Body(None, example="Pizza")
     count: Optional[int] = Body(None, example=10)
 
 
+class AdjustFood(BaseModel):
+    delta: int = Body(..., example=5)
+
+
+class ShardFood(BaseModel):
+    shards: int = Body(..., ge=0, le=64, example=8)
+
+
 class CollectFoodData(BaseModel):
     food_type: str = Form(..., example="Pizza")
     vendor_id: str = Form(..., example="1234")
@@ -0,0 +1,35 @@
+from enum import Enum
+from datetime import datetime
+from beanie import Document, Indexed
+from pydantic import Field
+from typing import Any, Optional
+
+import pymongo
+
+
+class IdempotencyStatus(str, Enum):
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+
+
+class IdempotencyRecord(Document):
+    # Route scope and client supplied Idempotency-Key
+    key: Indexed(str, unique=True) = Field(..., example="POST /foods/collect:1234")
+    request_hash: str = Field(..., example="9f86d081884c7d659a2feaa0c55ad015")
+    status: IdempotencyStatus = Field(
+        IdempotencyStatus.IN_PROGRESS, example=IdempotencyStatus.IN_PROGRESS
+    )
+    status_code: Optional[int] = Field(None, example=200)
+    response: Optional[Any] = Field(None, example={"message": "Food created"})
+    created_at: datetime = Field(default_factory=datetime.now)
+    expires_at: datetime = Field(..., example=datetime.now())
+    # An in-progress record whose lease ran out (client gone, worker crashed)
+    # may be taken over by a retry, the lease id tells the holders apart
+    lease_id: Optional[str] = Field(None, example="3f2b6c1e9a7d4e0f")
+    locked_until: Optional[datetime] = Field(None, example=datetime.now())
+
+    class Settings:
+        name = "idempotency_keys"
+        indexes = [
+            pymongo.IndexModel([("expires_at", pymongo.ASCENDING)], expireAfterSeconds=0),
+        ]
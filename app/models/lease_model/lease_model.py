@@ -0,0 +1,14 @@
+from beanie import Document, Indexed
+from datetime import datetime
+from pydantic import Field
+
+
+class WorkerLease(Document):
+    """Lets one worker process of the deployment run a periodic job"""
+
+    name: Indexed(str, unique=True) = Field(..., example="count_shard_compaction")
+    holder: str = Field(..., example="web-1:4242")
+    expires_at: datetime = Field(..., example="2026-10-19T12:00:00")
+
+    class Settings:
+        name = "worker_leases"
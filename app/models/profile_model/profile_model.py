@@ -0,0 +1,38 @@
+from datetime import datetime
+from beanie import Document, PydanticObjectId
+from pydantic import BaseModel, Field
+from typing import Optional
+
+import pymongo
+
+
+class RequestProfile(Document):
+    """Sampled profile of one request, in speedscope format"""
+
+    method: str = Field(..., example="GET")
+    path: str = Field(..., example="/users/vendors")
+    status_code: Optional[int] = Field(None, example=200)
+    duration_ms: float = Field(..., example=42.0)
+    created_at: datetime = Field(default_factory=datetime.now)
+    speedscope: str = Field(..., example="{}")
+
+    class Settings:
+        name = "request_profiles"
+        indexes = [
+            # Profiles are kept for a week
+            pymongo.IndexModel(
+                [("created_at", pymongo.ASCENDING)],
+                expireAfterSeconds=7 * 24 * 60 * 60,
+            ),
+        ]
+
+
+class RequestProfileSummary(BaseModel):
+    """Projection used to list profiles without their data"""
+
+    id: PydanticObjectId = Field(..., alias="_id")
+    method: str = Field(..., example="GET")
+    path: str = Field(..., example="/users/vendors")
+    status_code: Optional[int] = Field(None, example=200)
+    duration_ms: float = Field(..., example=42.0)
+    created_at: datetime = Field(..., example=datetime.now())
@@ -1,11 +1,13 @@
 from enum import Enum
-from beanie import Document
+from beanie import Document, PydanticObjectId, Indexed
 from datetime import datetime, timedelta
 from pydantic import Field, EmailStr, BaseModel
 from fastapi import Form, UploadFile, HTTPException, File
 
 from typing import Optional
 
+import pymongo
+
 
 class UserType(str, Enum):
     DEFAULT = "default"
@@ -20,7 +22,8 @@ class Status(str, Enum):
 
 class User(Document):
     full_name: str = Field(..., example="John Doe")
-    email: EmailStr = Field(..., example="johndoe@example.com")
+    # Unique so that registration can rely on the insert to detect duplicates
+    email: Indexed(EmailStr, unique=True) = Field(..., example="johndoe@example.com")
     hashed_password: str = Field(
         ..., example="$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW"
     )
@@ -29,25 +32,54 @@ class User(Document):
     updated_at: datetime = Field(default_factory=datetime.now)
     user_type: UserType = Field(UserType.DEFAULT.value, example=UserType.DEFAULT.value)
     status: Status = Field(Status.OPEN, example=Status.OPEN)
-    verification_code: Optional[int] = Field(None, example=123456)
-    verification_code_expiration: Optional[datetime] = Field(
-        None, example=datetime.now()
-    )
-    reset_password_code: Optional[int] = Field(None, example=123456)
-    reset_password_code_expiration: Optional[datetime] = Field(
-        None, example=datetime.now()
-    )
+    # Bumped to revoke every access token issued to the user
+    token_version: int = Field(0, example=0)
+    # Vendor onboarding data lives in VendorProfile and pending codes and
+    # tokens in AuthChallenge, so authenticating only loads the fields above
+
+    class Settings:
+        # Read-modify-write updates are guarded by the revision id
+        use_revision = True
+        indexes = [
+            # Serves the vendor listing and exports
+            pymongo.IndexModel([("user_type", pymongo.ASCENDING)]),
+        ]
 
-    # vendor registration request
+
+class VendorProfile(Document):
+    """Vendor onboarding data, loaded only by the endpoints that show it"""
+
+    user_id: Indexed(PydanticObjectId, unique=True) = Field(
+        ..., example="66f1c0b2e4b0a1a2b3c4d5e7"
+    )
     vendor_address: Optional[str] = Field(
         None, example="Informatics Institute Building, 7th Floor, Room 705"
     )
     facility_name: Optional[str] = Field(None, example="Kumpir Cafe")
     vendor_phone: Optional[str] = Field(None, example="03122223344")
     vendor_identity_no: Optional[str] = Field(None, example="12345678910")
-    image: Optional[bytes] = Field(None, example="image")
-    reset_token: Optional[str] = Field(None, example="reset_token")
-    reset_token_expiration: Optional[datetime] = Field(None, example=datetime.now())
+    # Image file in the vendor_images GridFS bucket
+    image_id: Optional[PydanticObjectId] = Field(
+        None, example="66f1c0b2e4b0a1a2b3c4d5e8"
+    )
+
+    class Settings:
+        name = "vendor_profiles"
+
+
+# Profile fields returned together with the user, the image has its own route
+VENDOR_PROFILE_FIELDS = {
+    "vendor_address",
+    "facility_name",
+    "vendor_phone",
+    "vendor_identity_no",
+}
+
+
+class UserTypeView(BaseModel):
+    """Projection used to check a user's role without loading the document"""
+
+    user_type: UserType = Field(UserType.DEFAULT.value, example=UserType.DEFAULT.value)
 
 
 class CreateUser(BaseModel):
@@ -75,7 +107,9 @@ class RegisterVendor(BaseModel):
     facility_name: str = Form(..., example="Kumpir Cafe")
     vendor_phone: str = Form(..., example="03122223344")
     vendor_identity_no: str = Form(..., example="12345678910")
-    image: bytes = Form(..., example="image", media_type="image/jpeg")
+    image_id: Optional[PydanticObjectId] = Field(
+        None, example="66f1c0b2e4b0a1a2b3c4d5e8"
+    )
 
 
 class RegisterVendorByAdmin(BaseModel):
@@ -0,0 +1,11 @@
+from beanie import Document, Indexed
+from pydantic import Field
+
+
+class ResourceVersion(Document):
+    # "global" or "vendor:<vendor_id>"
+    key: Indexed(str, unique=True) = Field(..., example="global")
+    version: int = Field(0, example=1)
+
+    class Settings:
+        name = "resource_versions"
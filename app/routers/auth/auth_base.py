@@ -3,6 +3,7 @@ from fastapi.security import OAuth2PasswordRequestForm
 from services.auth.auth_services import (
     authenticate_user,
     create_access_token,
+    token_claims,
     verify_user,
     verify_reset_password_code as verify_reset_password_code_service,
     send_verification_email as send_verification_email_service,
@@ -35,7 +36,7 @@ async def login_for_access_token(
     user = await authenticate_user(form_data.username, form_data.password)
     access_token_expires = timedelta(minutes=Settings().ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email},
+        data=token_claims(user),
         expires_delta=access_token_expires,
     )
     return Token(access_token=access_token, token_type="bearer")
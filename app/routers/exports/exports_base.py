@@ -0,0 +1,39 @@
+from models.auth_model.auth_model import Principal
+from services.users.user_services import get_current_principal
+from services.exports.export_services import (
+    ExportFormat,
+    export_users as export_users_service,
+    export_vendors as export_vendors_service,
+    export_foods as export_foods_service,
+)
+from fastapi import APIRouter, Depends
+
+
+router = APIRouter(
+    prefix="/exports",
+    tags=["Exports"],
+)
+
+
+@router.get("/users")
+async def export_users(
+    format: ExportFormat = ExportFormat.NDJSON,
+    current_user: Principal = Depends(get_current_principal),
+):
+    return await export_users_service(format, current_user)
+
+
+@router.get("/vendors")
+async def export_vendors(
+    format: ExportFormat = ExportFormat.NDJSON,
+    current_user: Principal = Depends(get_current_principal),
+):
+    return await export_vendors_service(format, current_user)
+
+
+@router.get("/foods")
+async def export_foods(
+    format: ExportFormat = ExportFormat.NDJSON,
+    current_user: Principal = Depends(get_current_principal),
+):
+    return await export_foods_service(format, current_user)
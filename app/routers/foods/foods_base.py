@@ -1,8 +1,10 @@
 from typing import Annotated, Optional
-from models.user_model.user_model import User
+from models.auth_model.auth_model import Principal
 from models.food_model.food_model import (
     UpdateFood,
     CreateFood,
+    AdjustFood,
+    ShardFood,
     CollectFoodData,
     ValidateCollectionCode,
 )
@@ -14,13 +16,21 @@ from services.foods.food_services import (
     create_food_collection_request as create_food_collection_request_service,
     validate_collection_code as validate_collection_code_service,
     update_food as update_food_service,
+    adjust_food_count as adjust_food_count_service,
+    set_food_shards as set_food_shards_service,
     create_food_admin as create_food_admin_service,
     update_food_admin as update_food_admin_service,
     delete_food_admin as delete_food_admin_service,
+    get_food_changes as get_food_changes_service,
+    FOODS_MAX_PAGE_SIZE,
+    FOOD_CHANGES_PAGE_SIZE,
 )
 
-from services.users.user_services import get_current_user
-from fastapi import Depends, APIRouter, Body
+from services.users.user_services import get_current_principal, check_vendor
+from services.idempotency.idempotency_services import run_idempotent
+from services.versions.version_services import conditional_response, vendor_key
+from fastapi import Depends, APIRouter, Body, Header, Request, Query
+from fastapi.responses import JSONResponse
 
 router = APIRouter(
     prefix="/foods",
@@ -31,11 +41,17 @@ router = APIRouter(
 @router.post("/create")
 async def create_food(
     food_data: Annotated[CreateFood, Body()],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
+    idempotency_key: Annotated[Optional[str], Header()] = None,
 ):
-    return await create_food_service(
-        food_data=food_data,
-        current_user=current_user,
+    return await run_idempotent(
+        idempotency_key,
+        scope=f"POST /foods/create:{current_user.id}",
+        payload=food_data,
+        operation=lambda: create_food_service(
+            food_data=food_data,
+            current_user=current_user,
+        ),
     )
 
 
@@ -43,7 +59,7 @@ async def create_food(
 async def update_food(
     food_type: str,
     food_data: Annotated[UpdateFood, Body()],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
     return await update_food_service(
         food_data=food_data,
@@ -52,15 +68,91 @@ async def update_food(
     )
 
 
+@router.patch("/{food_type}/adjust")
+async def adjust_food_count(
+    food_type: str,
+    adjust_data: Annotated[AdjustFood, Body()],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
+):
+    """Add a signed delta to the stock, never going below zero
+
+    For a sharded food the returned count is exact, but /foods/changes and
+    the listing ETags only pick the change up at the next shard compaction.
+    """
+    return await adjust_food_count_service(
+        food_type=food_type,
+        delta=adjust_data.delta,
+        current_user=current_user,
+    )
+
+
+@router.put("/{food_type}/shards")
+async def set_food_shards(
+    food_type: str,
+    shard_data: Annotated[ShardFood, Body()],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
+):
+    return await set_food_shards_service(
+        food_type=food_type,
+        shards=shard_data.shards,
+        current_user=current_user,
+    )
+
+
 @router.get("/list/{vendor_id}")
-async def get_foods_by_vendor(vendor_id: str):
-    return await get_foods_by_vendor_service(vendor_id)
+async def get_foods_by_vendor(
+    vendor_id: str,
+    request: Request,
+    limit: Annotated[Optional[int], Query(ge=1, le=FOODS_MAX_PAGE_SIZE)] = None,
+    cursor: Optional[str] = None,
+):
+    """Foods of a vendor by descending count
+
+    Pages are opt-in. Given a `limit` or a `cursor` taken from the
+    X-Next-Cursor header of the previous page, the cursor of the next page
+    is sent in X-Next-Cursor. Without either, every food is returned.
+    """
+    # Versions are bumped under the canonical id, any other spelling of it
+    # would keep its ETag forever
+    vendor_id = str(await check_vendor(vendor_id))
+
+    async def produce():
+        foods, next_cursor = await get_foods_by_vendor_service(
+            vendor_id,
+            limit=limit,
+            cursor=cursor,
+        )
+        # The body stays a plain list, the next page is announced in a header
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return JSONResponse(content=foods, headers=headers)
+
+    return await conditional_response(
+        request,
+        keys=[vendor_key(vendor_id)],
+        producer=produce,
+        variant=f"{limit or ''}:{cursor or ''}",
+    )
+
+
+@router.get("/changes")
+async def get_food_changes(
+    since: Annotated[int, Query(ge=0)] = 0,
+    vendor_id: Optional[str] = None,
+    limit: Annotated[
+        int, Query(ge=1, le=FOOD_CHANGES_PAGE_SIZE)
+    ] = FOOD_CHANGES_PAGE_SIZE,
+):
+    return await get_food_changes_service(
+        since=since,
+        vendor_id=vendor_id,
+        limit=limit,
+    )
 
 
 @router.delete("/delete/{food_type}")
 async def delete_food(
     food_type: str,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     return await delete_food_service(food_type, current_user)
 
@@ -68,19 +160,25 @@ async def delete_food(
 @router.post("/collect")
 async def create_food_collection_request(
     collect_food_data: Annotated[CollectFoodData, Body()],
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
+    idempotency_key: Annotated[Optional[str], Header()] = None,
 ):
-    return await create_food_collection_request_service(
-        food_type=collect_food_data.food_type,
-        vendor_id=collect_food_data.vendor_id,
-        current_user=current_user,
+    return await run_idempotent(
+        idempotency_key,
+        scope=f"POST /foods/collect:{current_user.id}",
+        payload=collect_food_data,
+        operation=lambda: create_food_collection_request_service(
+            food_type=collect_food_data.food_type,
+            vendor_id=collect_food_data.vendor_id,
+            current_user=current_user,
+        ),
     )
 
 
 @router.post("/validate_collection_code")
 async def validate_collection_code(
     validate_collection_code_data: Annotated[ValidateCollectionCode, Body()],
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     return await validate_collection_code_service(
         food_type=validate_collection_code_data.food_type,
@@ -93,7 +191,7 @@ async def validate_collection_code(
 async def create_food_admin(
     food_data: Annotated[CreateFood, Body()],
     vendor_id: str,
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
     return await create_food_admin_service(
         food_data=food_data,
@@ -107,7 +205,7 @@ async def update_food_admin(
     food_type: str,
     food_data: Annotated[UpdateFood, Body()],
     vendor_id: str,
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
     return await update_food_admin_service(
         food_data=food_data,
@@ -121,7 +219,7 @@ async def update_food_admin(
 async def delete_food_admin(
     food_type: str,
     vendor_id: str,
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
     return await delete_food_admin_service(
         food_type=food_type,
@@ -0,0 +1,12 @@
+from services.health.health_services import health_report
+from fastapi import APIRouter, Request
+
+
+router = APIRouter(
+    tags=["Health"],
+)
+
+
+@router.get("/health")
+async def health(request: Request):
+    return await health_report(request)
@@ -0,0 +1,42 @@
+from models.auth_model.auth_model import Principal
+from services.users.user_services import get_current_principal
+from services.exports.export_services import ExportFormat
+from services.imports.import_services import (
+    import_users as import_users_service,
+    import_vendors as import_vendors_service,
+    import_foods as import_foods_service,
+)
+from fastapi import APIRouter, Depends, File, UploadFile
+
+
+router = APIRouter(
+    prefix="/imports",
+    tags=["Imports"],
+)
+
+
+@router.post("/users")
+async def import_users(
+    file: UploadFile = File(...),
+    format: ExportFormat = ExportFormat.CSV,
+    current_user: Principal = Depends(get_current_principal),
+):
+    return await import_users_service(file, format, current_user)
+
+
+@router.post("/vendors")
+async def import_vendors(
+    file: UploadFile = File(...),
+    format: ExportFormat = ExportFormat.CSV,
+    current_user: Principal = Depends(get_current_principal),
+):
+    return await import_vendors_service(file, format, current_user)
+
+
+@router.post("/foods")
+async def import_foods(
+    file: UploadFile = File(...),
+    format: ExportFormat = ExportFormat.CSV,
+    current_user: Principal = Depends(get_current_principal),
+):
+    return await import_foods_service(file, format, current_user)
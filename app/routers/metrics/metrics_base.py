@@ -0,0 +1,16 @@
+from services.monitoring.loop_monitor import loop_metrics
+from services.shared.concurrency_limits import concurrency_metrics
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+
+router = APIRouter(
+    tags=["Metrics"],
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        loop_metrics() + concurrency_metrics(), media_type="text/plain; version=0.0.4"
+    )
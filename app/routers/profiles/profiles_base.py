@@ -0,0 +1,26 @@
+from models.auth_model.auth_model import Principal
+from services.users.user_services import get_current_principal
+from services.profiling.profile_services import (
+    list_profiles as list_profiles_service,
+    download_profile as download_profile_service,
+)
+from fastapi import APIRouter, Depends
+
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["Profiles"],
+)
+
+
+@router.get("/")
+async def list_profiles(current_user: Principal = Depends(get_current_principal)):
+    return await list_profiles_service(current_user)
+
+
+@router.get("/{profile_id}")
+async def download_profile(
+    profile_id: str,
+    current_user: Principal = Depends(get_current_principal),
+):
+    return await download_profile_service(profile_id, current_user)
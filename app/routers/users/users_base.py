@@ -1,7 +1,7 @@
 from typing import Annotated, Optional
-from pydantic import EmailStr
 from models.user_model.user_model import (
     User,
+    VendorProfile,
     CreateUser,
     UpdateUser,
     RegisterVendor,
@@ -10,8 +10,10 @@ from models.user_model.user_model import (
     UpdateVendorByAdmin,
     RegisterVendorByAdmin,
 )
+from models.auth_model.auth_model import Principal
 from services.users.user_services import (
     get_current_active_user,
+    get_current_principal,
     create_user as create_user_service,
     list_vendors as list_vendors_service,
     get_user_by_id,
@@ -21,17 +23,29 @@ from services.users.user_services import (
     approve_vendor as approve_vendor_service,
     reject_vendor as reject_vendor_service,
     get_user_type_by_email as get_user_type_by_email_service,
-    get_image_content,
     delete_user_as_admin as delete_user_as_admin_service,
     update_user_as_admin as update_user_as_admin_service,
     update_vendor_as_admin as update_vendor_as_admin_service,
     create_user_by_admin as create_user_by_admin_service,
     create_vendor_by_admin as create_vendor_by_admin_service,
+    with_vendor_profiles,
 )
-from fastapi import File, UploadFile, HTTPException
+from services.idempotency.idempotency_services import (
+    run_idempotent,
+    precheck_idempotent,
+    IdempotentReplay,
+)
+from services.images.image_services import (
+    receive_image_form,
+    open_image,
+    delete_images,
+)
+from services.versions.version_services import conditional_response, GLOBAL_KEY
+from fastapi import HTTPException, Header, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from bson import ObjectId
-from io import BytesIO
 
 from fastapi import (
     APIRouter,
@@ -49,13 +63,14 @@ router = APIRouter(
 
 @router.get("/")
 async def list_users():
-    return await User.find().sort([("updated_at", -1)]).to_list()
+    users = await User.find().sort([("updated_at", -1)]).to_list()
+    return await with_vendor_profiles(users)
 
 
 @router.post("/create/user")
 async def create_user_as_admin(
     user_data: Annotated[CreateUser, Body()],
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     return await create_user_by_admin_service(
         user_data,
@@ -66,7 +81,7 @@ async def create_user_as_admin(
 @router.post("/create/vendor")
 async def create_vendor_as_admin(
     vendor_data: Annotated[RegisterVendorByAdmin, Body()],
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     return await create_vendor_by_admin_service(
         vendor_data,
@@ -78,7 +93,7 @@ async def create_vendor_as_admin(
 async def update_user_as_admin(
     user_id: str,
     user_data: Annotated[UpdateUserByAdmin, Body()],
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     return await update_user_as_admin_service(
         user_id,
@@ -91,7 +106,7 @@ async def update_user_as_admin(
 async def update_vendor_as_admin(
     user_id: str,
     vendor_data: Annotated[UpdateVendorByAdmin, Body()],
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     return await update_vendor_as_admin_service(
         user_id,
@@ -103,7 +118,7 @@ async def update_vendor_as_admin(
 @router.delete("/{user_id}")
 async def delete_user_as_admin(
     user_id: str,
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     return await delete_user_as_admin_service(
         user_id,
@@ -115,7 +130,7 @@ async def delete_user_as_admin(
 async def get_user_me(
     current_user: Annotated[User, Depends(get_current_active_user)],
 ):
-    return current_user
+    return (await with_vendor_profiles([current_user]))[0]
 
 
 @router.get("/type/{email}")
@@ -126,39 +141,86 @@ async def get_user_type_by_email(email: str):
 @router.post("/create")
 async def create_user(
     form_data: Annotated[CreateUser, Form()],
+    idempotency_key: Annotated[Optional[str], Header()] = None,
 ):
-    return await create_user_service(form_data)
+    return await run_idempotent(
+        idempotency_key,
+        scope="POST /users/create",
+        payload=form_data,
+        operation=lambda: create_user_service(form_data),
+    )
 
 
-@router.post("/register_vendor")
-async def register_vendor(
-    full_name: str = Form(...),
-    email: EmailStr = Form(...),
-    password: str = Form(...),
-    vendor_address: str = Form(...),
-    facility_name: str = Form(...),
-    vendor_phone: str = Form(...),
-    vendor_identity_no: str = Form(...),
-    image: UploadFile = File(..., media_type="image/jpeg"),
-):
-    image_data = await get_image_content(image)
-    form_data_dict = {
-        "full_name": full_name,
-        "email": email,
-        "password": password,
-        "user_type": UserType.VENDOR.value,
-        "vendor_address": vendor_address,
-        "facility_name": facility_name,
-        "vendor_phone": vendor_phone,
-        "vendor_identity_no": vendor_identity_no,
-        "image": image_data,
+def _register_vendor_form() -> dict:
+    """OpenAPI body of the vendor registration, its form is parsed by hand"""
+    schema = RegisterVendorByAdmin.model_json_schema()
+    schema.pop("$defs", None)
+    schema["properties"].pop("user_type")
+    schema["properties"]["image"] = {"type": "string", "format": "binary"}
+    schema["required"].append("image")
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"multipart/form-data": {"schema": schema}},
+        }
     }
 
-    form_data = RegisterVendor(
-        **form_data_dict,
-    )
 
-    return await register_vendor_service(form_data)
+@router.post("/register_vendor", openapi_extra=_register_vendor_form())
+async def register_vendor(
+    request: Request,
+    idempotency_key: Annotated[Optional[str], Header()] = None,
+):
+    # Multipart form with full_name, email, password, vendor_address,
+    # facility_name, vendor_phone, vendor_identity_no and an image file. It is
+    # parsed here so that the image streams into storage instead of memory.
+    scope = "POST /users/register_vendor"
+
+    async def before_image(fields: dict):
+        # Fields sent ahead of the image are checked before it is stored
+        form_data_dict = {**fields, "user_type": UserType.VENDOR.value}
+        try:
+            RegisterVendor(**form_data_dict)
+        except ValidationError as e:
+            errors = [
+                error
+                for error in e.errors()
+                if error["type"] != "missing"
+                and error["loc"]
+                and error["loc"][0] in fields
+            ]
+            if errors:
+                raise RequestValidationError(errors)
+            # The rest of the form follows the image
+            return
+        await precheck_idempotent(idempotency_key, scope, form_data_dict)
+
+    try:
+        fields, image_id = await receive_image_form(request, before_image=before_image)
+    except IdempotentReplay as replay:
+        return replay.response
+    form_data_dict = {**fields, "user_type": UserType.VENDOR.value}
+    registered = False
+
+    async def register():
+        nonlocal registered
+        form_data = RegisterVendor(**form_data_dict, image_id=image_id)
+        result = await register_vendor_service(form_data)
+        registered = True
+        return result
+
+    try:
+        return await run_idempotent(
+            idempotency_key,
+            scope=scope,
+            payload=form_data_dict,
+            operation=register,
+        )
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    finally:
+        if not registered:
+            await delete_images([image_id])
 
 
 @router.get("/approve_vendor/{user_id}")
@@ -172,13 +234,20 @@ async def reject_vendor(user_id: str):
 
 
 @router.get("/vendors")
-async def list_vendors():
-    return await list_vendors_service()
+async def list_vendors(request: Request):
+    return await conditional_response(
+        request,
+        keys=[GLOBAL_KEY],
+        producer=list_vendors_service,
+    )
 
 
 @router.get("/{user_id}")
 async def get_user_id(user_id: str):
-    return await get_user_by_id(user_id)
+    user = await get_user_by_id(user_id)
+    if not isinstance(user, User):
+        return user
+    return (await with_vendor_profiles([user]))[0]
 
 
 @router.put("/me")
@@ -196,22 +265,23 @@ async def delete_user(current_user: User = Depends(get_current_active_user)):
 
 @router.get("/{user_id}/image")
 async def get_user_image(
-    user_id: str, current_user: User = Depends(get_current_active_user)
+    user_id: str, current_user: Principal = Depends(get_current_principal)
 ):
     if current_user.user_type != UserType.ADMIN.value:
         raise HTTPException(
             status_code=403,
             detail="You are not authorized to access this resource",
         )
-    user = await User.find_one(User.id == ObjectId(user_id))
-    if not user or not user.image:
+    profile = await VendorProfile.find_one(VendorProfile.user_id == ObjectId(user_id))
+    image = await open_image(profile.image_id) if profile and profile.image_id else None
+    if image is None:
         raise HTTPException(
             status_code=404,
             detail="User or image not found",
         )
 
-    image_stream = BytesIO(user.image)
+    media_type, chunks = image
     return StreamingResponse(
-        image_stream,
-        media_type="image/jpeg",
+        chunks,
+        media_type=media_type,
     )
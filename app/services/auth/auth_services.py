@@ -1,6 +1,7 @@
 from models.user_model.user_model import User
-from models.auth_model.auth_model import VerificationData
+from models.auth_model.auth_model import VerificationData, AuthChallenge
 from services.shared.shared_services import get_user_from_db, verify_password
+from services.email.email_services import enqueue_email
 from config.config import Settings
 
 from datetime import datetime, timedelta, timezone
@@ -9,12 +10,13 @@ import jwt
 
 from fastapi import HTTPException, status
 
-import smtplib
 import random
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 import uuid
+import logging
+
+
+logger = logging.getLogger(__name__)
 
 
 async def authenticate_user(email: str, password: str) -> User:
@@ -38,6 +40,16 @@ async def authenticate_user(email: str, password: str) -> User:
     return user
 
 
+def token_claims(user: User) -> dict:
+    """Claims that let role-only routes authorize without loading the user"""
+    return {
+        "sub": user.email,
+        "uid": str(user.id),
+        "role": user.user_type.value,
+        "ver": user.token_version,
+    }
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -53,35 +65,71 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+async def get_auth_challenge(user_id) -> AuthChallenge:
+    challenge = await AuthChallenge.find_one(AuthChallenge.user_id == user_id)
+    return challenge or AuthChallenge(user_id=user_id)
+
+
+async def set_auth_challenge(user_id, fields: dict):
+    await AuthChallenge.get_motor_collection().update_one(
+        {"user_id": user_id}, {"$set": fields}, upsert=True
+    )
+
+
+async def delete_auth_challenges(user_ids: list):
+    await AuthChallenge.get_motor_collection().delete_many(
+        {"user_id": {"$in": user_ids}}
+    )
+
+
+def warm_up_jwt():
+    """Exercise token encoding and decoding once before taking traffic"""
+    token = create_access_token(data={"sub": "warm-up"})
+    jwt.decode(token, Settings().SECRET_KEY, algorithms=[Settings().ALGORITHM])
+
+
 async def verify_user(
     verification_data: VerificationData,
 ):
     try:
         user = await get_user_from_db(verification_data.email)
+        challenge = await get_auth_challenge(user.id)
 
-        if user.verification_code != verification_data.code:
+        if challenge.verification_code != verification_data.code:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid verification code",
             )
 
-        if datetime.now() > user.verification_code_expiration:
+        if datetime.now() > challenge.verification_code_expiration:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Verification code has expired",
             )
 
-        user.verification_code = None
-        user.verification_code_expiration = None
-        user.disabled = False
-
-        await user.save()
+        # Only clear the code that was checked, a resend may have replaced it
+        result = await AuthChallenge.find_one(
+            AuthChallenge.user_id == user.id,
+            AuthChallenge.verification_code == verification_data.code,
+        ).update(
+            {
+                "$set": {
+                    "verification_code": None,
+                    "verification_code_expiration": None,
+                }
+            }
+        )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid verification code",
+            )
+        await User.find_one(User.id == user.id).update({"$set": {"disabled": False}})
         return {"message": "User verified"}
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        # Log unexpected errors here if needed
-        print(f"Unexpected error: {e}")
+    except Exception:
+        logger.exception("Unexpected error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to verify user",
@@ -93,110 +141,93 @@ async def verify_reset_password_code(
 ):
     try:
         user = await get_user_from_db(verification_data.email)
+        challenge = await get_auth_challenge(user.id)
 
-        if user.reset_password_code != verification_data.code:
+        if challenge.reset_password_code != verification_data.code:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid reset password code",
             )
 
-        if datetime.now() > user.reset_password_code_expiration:
+        if datetime.now() > challenge.reset_password_code_expiration:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Reset password code has expired",
             )
 
-        user.reset_password_code = None
-        user.reset_password_code_expiration = None
-
-        await user.save()
+        result = await AuthChallenge.find_one(
+            AuthChallenge.user_id == user.id,
+            AuthChallenge.reset_password_code == verification_data.code,
+        ).update(
+            {
+                "$set": {
+                    "reset_password_code": None,
+                    "reset_password_code_expiration": None,
+                }
+            }
+        )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid reset password code",
+            )
         return {"message": "Reset password code verified"}
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        # Log unexpected errors here if needed
-        print(f"Unexpected error: {e}")
+    except Exception:
+        logger.exception("Unexpected error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to verify reset password code",
         )
 
 
-async def send_code(email: str, message: str):
-    # Generate a 6-digit numeric verification code
-    verification_code = random.randint(100000, 999999)
-
-    mailUsername = Settings().MAIL_USERNAME
-    mailPassword = Settings().MAIL_PASSWORD
-
-    print("Sending email to: ", email)
-    from_addr = Settings().MAIL_USERNAME
+def new_verification_challenge(user_id) -> AuthChallenge:
+    """A fresh 6-digit verification code that expires in 10 minutes"""
+    return AuthChallenge(
+        user_id=user_id,
+        verification_code=random.randint(100000, 999999),
+        verification_code_expiration=datetime.now() + timedelta(minutes=10),
+    )
 
-    # Create the email message
-    msg = MIMEMultipart()
-    msg["From"] = from_addr
-    msg["To"] = email
-    msg["Subject"] = "Verification Code"
-    body = f"{message}{verification_code}"
-    msg.attach(MIMEText(body, "plain"))
 
-    # Send the email
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(mailUsername, mailPassword)
-        server.sendmail(from_addr, email, msg.as_string())
-        server.quit()
-        print("Email sent successfully")
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to send verification email: {str(e)}"
-        )
-    return verification_code
+async def enqueue_verification_email(email: str, verification_code: int):
+    await enqueue_email(
+        email,
+        "Verification Code",
+        f"To verify your account, please enter the code: {verification_code}",
+        dedupe_key=f"verification:{email}:{verification_code}",
+    )
 
 
 async def send_verification_email(email: str):
-    # Set expiration time to 10 minutes from now
-    expiration_time = datetime.now() + timedelta(minutes=10)
-
-    verification_code = await send_code(
-        email, "To verify your account, please enter the code: "
-    )
+    user = await get_user_from_db(email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    # Store the verification code and its expiration time in the user's record
+    # Store the verification code and its expiration time in the user's challenge
+    challenge = new_verification_challenge(user.id)
     try:
-        user = await get_user_from_db(email)
-        user.verification_code = verification_code
-        user.verification_code_expiration = expiration_time
-        await user.save()
+        await set_auth_challenge(
+            user.id,
+            {
+                "verification_code": challenge.verification_code,
+                "verification_code_expiration": challenge.verification_code_expiration,
+            },
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to save verification code: {str(e)}"
         )
 
-    return {"message": "Verification email sent"}
-
+    await enqueue_verification_email(email, challenge.verification_code)
 
-async def send_email(email: str, subject: str, body: str):
-    mail_username = Settings().MAIL_USERNAME
-    mail_password = Settings().MAIL_PASSWORD
-    from_addr = mail_username
+    return {"message": "Verification email sent"}
 
-    # Create the email message
-    msg = MIMEMultipart()
-    msg["From"] = from_addr
-    msg["To"] = email
-    msg["Subject"] = subject
-    msg.attach(MIMEText(body, "plain"))
 
-    # Send the email
+async def send_email(email: str, subject: str, body: str, dedupe_key: str = None):
     try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(mail_username, mail_password)
-        server.sendmail(from_addr, email, msg.as_string())
-        server.quit()
-        print("Email sent successfully")
+        await enqueue_email(email, subject, body, dedupe_key=dedupe_key)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
     return {"message": "Email sent"}
@@ -222,14 +253,22 @@ async def send_reset_email(email: str):
                 status_code=status.HTTP_406_NOT_ACCEPTABLE,
                 detail="Inactive user, please verify your email!",
             )
-        if user.reset_token_expiration and datetime.now() < user.reset_token_expiration:
+        challenge = await get_auth_challenge(user.id)
+        if (
+            challenge.reset_token_expiration
+            and datetime.now() < challenge.reset_token_expiration
+        ):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Reset token already sent. Please check your email!",
             )
-        user.reset_token = reset_token
-        user.reset_token_expiration = expiration_time
-        await user.save()
+        await set_auth_challenge(
+            user.id,
+            {
+                "reset_token": reset_token,
+                "reset_token_expiration": expiration_time,
+            },
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -243,61 +282,25 @@ async def send_reset_email(email: str):
     base_url = "https://shareodtu.vercel.app/auth/reset-password"
     reset_link = f"{base_url}/{reset_token}?email={email}"
 
-    # Send the email with the reset password link
-    try:
-        await send_email(
-            email,
-            "Password Reset Request",
-            f"To reset your password, please click the following link: {reset_link}\n\n"
-            "This link will expire in 10 minutes.",
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to send reset email: {str(e)}"
-        )
+    # Queue the email with the reset password link
+    await send_email(
+        email,
+        "Password Reset Request",
+        f"To reset your password, please click the following link: {reset_link}\n\n"
+        "This link will expire in 10 minutes.",
+        dedupe_key=f"reset:{reset_token}",
+    )
 
     return {"message": "Reset password email sent"}
 
 
 async def send_approval_waiting_email(email: str):
-    mailUsername = Settings().MAIL_USERNAME
-    mailPassword = Settings().MAIL_PASSWORD
-
-    from_addr = Settings().MAIL_USERNAME
-
-    # Create the email message
-    msg = MIMEMultipart()
-    msg["From"] = from_addr
-    msg["To"] = email
-    msg["Subject"] = "Approval Waiting"
     body = "Your account is awaiting approval. You will receive an email once your account is approved."
-    msg.attach(MIMEText(body, "plain"))
-
-    # Send the email
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(mailUsername, mailPassword)
-        server.sendmail(from_addr, email, msg.as_string())
-        server.quit()
-        print("Email sent successfully")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
+    await send_email(email, "Approval Waiting", body)
     return {"message": "Approval waiting email sent"}
 
 
 async def send_approval_email(email: str):
-    mailUsername = Settings().MAIL_USERNAME
-    mailPassword = Settings().MAIL_PASSWORD
-
-    from_addr = Settings().MAIL_USERNAME
-
-    # Create the email message
-    msg = MIMEMultipart()
-    msg["From"] = from_addr
-    msg["To"] = email
-    msg["Subject"] = "Account Approved"
-
     # Construct the login link (change this to the production URL)
     # # Localhost URL
     # login_link = "http://localhost:3000/auth/login"
@@ -309,43 +312,11 @@ async def send_approval_email(email: str):
         "Your account has been approved. You can now log in.\n\n"
         f"Click here to log in: {login_link}"
     )
-    msg.attach(MIMEText(body, "plain"))
-
-    # Send the email
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(mailUsername, mailPassword)
-        server.sendmail(from_addr, email, msg.as_string())
-        server.quit()
-        print("Email sent successfully")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
+    await send_email(email, "Account Approved", body)
     return {"message": "Approval email sent"}
 
 
 async def send_rejection_email(email: str):
-    mailUsername = Settings().MAIL_USERNAME
-    mailPassword = Settings().MAIL_PASSWORD
-
-    from_addr = Settings().MAIL_USERNAME
-
-    # Create the email message
-    msg = MIMEMultipart()
-    msg["From"] = from_addr
-    msg["To"] = email
-    msg["Subject"] = "Account Rejected"
     body = "Your account has been rejected. Please contact the administrator for more information."
-    msg.attach(MIMEText(body, "plain"))
-
-    # Send the email
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(mailUsername, mailPassword)
-        server.sendmail(from_addr, email, msg.as_string())
-        server.quit()
-        print("Email sent successfully")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
+    await send_email(email, "Account Rejected", body)
     return {"message": "Rejection email sent"}
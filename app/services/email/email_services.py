@@ -0,0 +1,224 @@
+from models.email_model.email_model import OutboxEmail, EmailStatus
+from services.shared.circuit_breaker import CircuitBreaker
+from config.config import Settings
+
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from pymongo.errors import DuplicateKeyError
+from pymongo import UpdateOne
+
+import asyncio
+import smtplib
+import uuid
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+smtp_breaker = CircuitBreaker("smtp")
+
+_worker_task: asyncio.Task | None = None
+_wake_up = asyncio.Event()
+
+
+async def enqueue_email(
+    email: str,
+    subject: str,
+    body: str,
+    dedupe_key: str | None = None,
+):
+    """Store an email in the outbox, the worker delivers it in the background"""
+    try:
+        await OutboxEmail(
+            recipient=email,
+            subject=subject,
+            body=body,
+            dedupe_key=dedupe_key or str(uuid.uuid4()),
+        ).insert()
+    except DuplicateKeyError:
+        # The same logical message is already queued
+        pass
+    _wake_up.set()
+
+
+def _build_message(email: OutboxEmail, from_addr: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg["From"] = from_addr
+    msg["To"] = email.recipient
+    msg["Subject"] = email.subject
+    msg["Message-ID"] = f"<{email.dedupe_key}@shareodtu>"
+    msg.attach(MIMEText(email.body, "plain"))
+    return msg
+
+
+def _deliver_batch(emails: list[OutboxEmail]) -> tuple[dict, str | None]:
+    """Send a batch over a single SMTP session
+
+    Returns the errors keyed by email id, and the error that broke the
+    session, if any, which counts against the SMTP breaker.
+    """
+    settings = Settings()
+    from_addr = settings.MAIL_USERNAME
+    errors = {}
+
+    try:
+        server = smtplib.SMTP(
+            settings.MAIL_SMTP_HOST,
+            settings.MAIL_SMTP_PORT,
+            timeout=settings.SMTP_CONNECT_TIMEOUT_SECONDS,
+        )
+        server.starttls()
+        server.login(settings.MAIL_USERNAME, settings.MAIL_PASSWORD)
+        server.sock.settimeout(settings.SMTP_SEND_TIMEOUT_SECONDS)
+    except Exception as e:
+        return {email.id: str(e) for email in emails}, str(e)
+
+    session_error = None
+    try:
+        for email in emails:
+            try:
+                msg = _build_message(email, from_addr)
+                server.sendmail(from_addr, email.recipient, msg.as_string())
+            except (smtplib.SMTPServerDisconnected, TimeoutError) as e:
+                # The session is gone, the rest of the batch is retried later
+                session_error = str(e) or e.__class__.__name__
+                for remaining in emails[emails.index(email) :]:
+                    errors[remaining.id] = session_error
+                break
+            except Exception as e:
+                errors[email.id] = str(e)
+    finally:
+        try:
+            server.quit()
+        except Exception:
+            pass
+    return errors, session_error
+
+
+async def _claim_batch() -> list[OutboxEmail]:
+    settings = Settings()
+    now = datetime.now()
+    due = {
+        "$or": [
+            {"status": EmailStatus.PENDING.value, "next_attempt_at": {"$lte": now}},
+            # Messages whose worker died mid-delivery
+            {"status": EmailStatus.SENDING.value, "locked_until": {"$lte": now}},
+        ]
+    }
+    candidates = (
+        await OutboxEmail.find(due)
+        .sort([("next_attempt_at", 1)])
+        .limit(settings.EMAIL_OUTBOX_BATCH_SIZE)
+        .to_list()
+    )
+    if not candidates:
+        return []
+
+    claim_id = str(uuid.uuid4())
+    await OutboxEmail.get_motor_collection().update_many(
+        {"_id": {"$in": [email.id for email in candidates]}, **due},
+        {
+            "$set": {
+                "status": EmailStatus.SENDING.value,
+                "claim_id": claim_id,
+                "locked_until": now
+                + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS),
+            }
+        },
+    )
+    return await OutboxEmail.find(OutboxEmail.claim_id == claim_id).to_list()
+
+
+def _backoff(attempts: int) -> timedelta:
+    settings = Settings()
+    delay = settings.EMAIL_OUTBOX_BACKOFF_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=min(delay, settings.EMAIL_OUTBOX_MAX_BACKOFF_SECONDS))
+
+
+async def deliver_pending_emails() -> int:
+    """Deliver one batch of due emails, returns the number of claimed emails"""
+    if not smtp_breaker.allow():
+        # Messages stay pending until the SMTP server is probed again
+        return 0
+    emails = await _claim_batch()
+    if not emails:
+        return 0
+
+    errors, session_error = await asyncio.to_thread(_deliver_batch, emails)
+    if session_error is None:
+        smtp_breaker.record_success()
+    else:
+        smtp_breaker.record_failure(session_error)
+
+    now = datetime.now()
+    operations = []
+    for email in emails:
+        if email.id not in errors:
+            update = {
+                "$set": {
+                    "status": EmailStatus.SENT.value,
+                    "sent_at": now,
+                    "locked_until": None,
+                }
+            }
+        else:
+            attempts = email.attempts + 1
+            if attempts >= Settings().EMAIL_OUTBOX_MAX_ATTEMPTS:
+                next_status = EmailStatus.FAILED.value
+            else:
+                next_status = EmailStatus.PENDING.value
+            update = {
+                "$set": {
+                    "status": next_status,
+                    "attempts": attempts,
+                    "next_attempt_at": now + _backoff(attempts),
+                    "last_error": errors[email.id],
+                    "locked_until": None,
+                }
+            }
+        # Only the holder of the claim may settle the message
+        operations.append(UpdateOne({"_id": email.id, "claim_id": email.claim_id}, update))
+
+    await OutboxEmail.get_motor_collection().bulk_write(operations, ordered=False)
+    return len(emails)
+
+
+async def _run_worker():
+    while True:
+        try:
+            delivered = await deliver_pending_emails()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Email outbox worker error")
+            delivered = 0
+
+        if delivered:
+            # There may be more due messages, keep draining
+            continue
+
+        _wake_up.clear()
+        try:
+            await asyncio.wait_for(
+                _wake_up.wait(), timeout=Settings().EMAIL_OUTBOX_POLL_SECONDS
+            )
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start_email_outbox_worker():
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_run_worker())
+
+
+async def stop_email_outbox_worker():
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
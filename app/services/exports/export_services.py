@@ -0,0 +1,173 @@
+from models.user_model.user_model import (
+    User,
+    UserType,
+    VendorProfile,
+    VENDOR_PROFILE_FIELDS,
+)
+from models.food_model.food_model import Food
+from models.auth_model.auth_model import Principal
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+from datetime import datetime
+from enum import Enum
+
+import csv
+import io
+import json
+
+
+# Documents read per cursor batch, which bounds the memory of an export
+EXPORT_BATCH_SIZE = 500
+# Leading characters that make a spreadsheet treat a CSV cell as a formula
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+USER_EXPORT_FIELDS = [
+    "_id",
+    "full_name",
+    "email",
+    "user_type",
+    "status",
+    "disabled",
+    "created_at",
+    "updated_at",
+]
+VENDOR_EXPORT_FIELDS = USER_EXPORT_FIELDS + sorted(VENDOR_PROFILE_FIELDS)
+FOOD_EXPORT_FIELDS = ["_id", "vendor_id", "food_type", "count", "change_seq"]
+
+_MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+def check_admin(current_user: Principal):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(
+            status_code=403,
+            detail="You are not authorized to access this resource",
+        )
+
+
+def _plain(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_value(value):
+    value = _plain(value)
+    if value is None:
+        return ""
+    # Spreadsheets run cells starting with these as formulas, the quote
+    # makes them plain text. Quotes already in front get one more, so the
+    # import strips exactly the one added here.
+    if isinstance(value, str) and value.lstrip("'").startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def unescape_csv_value(value: str) -> str:
+    """Undo the formula escaping of _csv_value, so exports import back"""
+    if value.startswith("'") and value.lstrip("'").startswith(CSV_FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+
+async def _batches(collection, query: dict, fields: list[str]):
+    """Read a collection in bounded batches of projected documents"""
+    cursor = collection.find(
+        query, {field: 1 for field in fields}, batch_size=EXPORT_BATCH_SIZE
+    ).sort("_id", 1)
+    try:
+        while True:
+            batch = await cursor.to_list(EXPORT_BATCH_SIZE)
+            if not batch:
+                return
+            yield batch
+    finally:
+        await cursor.close()
+
+
+async def _with_profiles(batches):
+    async for batch in batches:
+        profiles = {
+            profile["user_id"]: profile
+            async for profile in VendorProfile.get_motor_collection().find(
+                {"user_id": {"$in": [user["_id"] for user in batch]}},
+                {"user_id": 1, **{field: 1 for field in VENDOR_PROFILE_FIELDS}},
+            )
+        }
+        for user in batch:
+            user.update(
+                {
+                    field: profiles.get(user["_id"], {}).get(field)
+                    for field in VENDOR_PROFILE_FIELDS
+                }
+            )
+        yield batch
+
+
+async def _encode(batches, fields: list[str], export_format: ExportFormat):
+    """One chunk of NDJSON lines or CSV rows per batch"""
+    if export_format == ExportFormat.CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        yield buffer.getvalue()
+        async for batch in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(
+                [_csv_value(row.get(field)) for field in fields] for row in batch
+            )
+            yield buffer.getvalue()
+    else:
+        async for batch in batches:
+            yield "".join(
+                json.dumps({field: _plain(row.get(field)) for field in fields}) + "\n"
+                for row in batch
+            )
+
+
+def _stream(name: str, batches, fields: list[str], export_format: ExportFormat):
+    return StreamingResponse(
+        _encode(batches, fields, export_format),
+        media_type=_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{name}.{export_format.value}"'
+        },
+    )
+
+
+async def export_users(export_format: ExportFormat, current_user: Principal):
+    check_admin(current_user)
+    batches = _batches(User.get_motor_collection(), {}, USER_EXPORT_FIELDS)
+    return _stream("users", batches, USER_EXPORT_FIELDS, export_format)
+
+
+async def export_vendors(export_format: ExportFormat, current_user: Principal):
+    check_admin(current_user)
+    batches = _with_profiles(
+        _batches(
+            User.get_motor_collection(),
+            {"user_type": UserType.VENDOR.value},
+            USER_EXPORT_FIELDS,
+        )
+    )
+    return _stream("vendors", batches, VENDOR_EXPORT_FIELDS, export_format)
+
+
+async def export_foods(export_format: ExportFormat, current_user: Principal):
+    check_admin(current_user)
+    batches = _batches(Food.get_motor_collection(), {}, FOOD_EXPORT_FIELDS)
+    return _stream("foods", batches, FOOD_EXPORT_FIELDS, export_format)
@@ -0,0 +1,130 @@
+from models.food_model.food_model import Food, FoodTombstone
+from models.version_model.version_model import ResourceVersion
+from services.versions.version_services import (
+    track_version_history,
+    version_seen_before,
+)
+from config.config import Settings
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from bson import ObjectId
+
+
+FOOD_CHANGES_KEY = "food_changes"
+FOOD_CHANGES_PAGE_SIZE = 500
+
+track_version_history(FOOD_CHANGES_KEY)
+
+
+async def next_change_seq(count: int = 1) -> int:
+    """Reserve `count` sequence numbers, returns the last one"""
+    document = await ResourceVersion.get_motor_collection().find_one_and_update(
+        {"key": FOOD_CHANGES_KEY},
+        {"$inc": {"version": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return document["version"]
+
+
+async def record_food_deletions(foods: list[Food]):
+    """Leave a tombstone in the change feed for every deleted food"""
+    if not foods:
+        return
+    last_seq = await next_change_seq(len(foods))
+    first_seq = last_seq - len(foods) + 1
+    await FoodTombstone.insert_many(
+        [
+            FoodTombstone(
+                food_id=food.id,
+                vendor_id=food.vendor_id,
+                food_type=food.food_type,
+                change_seq=first_seq + index,
+            )
+            for index, food in enumerate(foods)
+        ]
+    )
+
+
+async def list_food_changes(
+    since: int,
+    vendor_id: str | None = None,
+    limit: int = FOOD_CHANGES_PAGE_SIZE,
+):
+    """Foods created, updated or deleted after `since`, in sequence order
+
+    Sequence numbers are reserved before the write they belong to, so a
+    slow write can land after a later one. Only sequences reserved at least
+    FOOD_CHANGES_SAFETY_LAG_SECONDS ago are served, by then their writes
+    have landed, so polling from the returned `last_seq` misses nothing.
+    """
+    safe_seq = version_seen_before(
+        FOOD_CHANGES_KEY, Settings().FOOD_CHANGES_SAFETY_LAG_SECONDS
+    )
+    if safe_seq is None or safe_seq <= since:
+        return {"changed": [], "deleted": [], "last_seq": since, "has_more": False}
+
+    food_query = {"change_seq": {"$gt": since, "$lte": safe_seq}}
+    tombstone_query = {"change_seq": {"$gt": since, "$lte": safe_seq}}
+    if vendor_id:
+        try:
+            vendor_object_id = ObjectId(vendor_id)
+        except Exception:
+            raise HTTPException(status_code=404, detail="Vendor not found")
+        food_query["vendor_id"] = vendor_object_id
+        tombstone_query["vendor_id"] = vendor_object_id
+
+    # Read one extra entry from each side to know whether more remain
+    foods = (
+        await Food.get_motor_collection()
+        .find(food_query, {"food_type": 1, "count": 1, "vendor_id": 1, "change_seq": 1})
+        .sort("change_seq", 1)
+        .limit(limit + 1)
+        .to_list(None)
+    )
+    tombstones = (
+        await FoodTombstone.get_motor_collection()
+        .find(tombstone_query, {"food_id": 1, "vendor_id": 1, "food_type": 1, "change_seq": 1})
+        .sort("change_seq", 1)
+        .limit(limit + 1)
+        .to_list(None)
+    )
+
+    entries = sorted(
+        [("changed", food) for food in foods]
+        + [("deleted", tombstone) for tombstone in tombstones],
+        key=lambda entry: entry[1]["change_seq"],
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    changed = []
+    deleted = []
+    for kind, document in entries:
+        if kind == "changed":
+            changed.append(
+                {
+                    "id": str(document["_id"]),
+                    "vendor_id": str(document["vendor_id"]),
+                    "food_type": document["food_type"],
+                    "count": document["count"],
+                    "change_seq": document["change_seq"],
+                }
+            )
+        else:
+            deleted.append(
+                {
+                    "id": str(document["food_id"]),
+                    "vendor_id": str(document["vendor_id"]),
+                    "food_type": document["food_type"],
+                    "change_seq": document["change_seq"],
+                }
+            )
+
+    return {
+        "changed": changed,
+        "deleted": deleted,
+        "last_seq": entries[-1][1]["change_seq"] if entries else since,
+        "has_more": has_more,
+    }
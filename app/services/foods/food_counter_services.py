@@ -0,0 +1,475 @@
+from models.food_model.food_model import Food, FoodCountShard, CollectionCode
+from services.foods.food_change_services import next_change_seq
+from services.versions.version_services import bump_versions
+from services.shared.lease import acquire_lease
+from config.config import Settings
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument, UpdateOne
+from datetime import datetime
+
+import asyncio
+import random
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_compaction_task: asyncio.Task | None = None
+
+NOT_SHARDED = {"count_shards": {"$not": {"$gt": 0}}}
+# Shards taken by a fold are left alone
+UNSEALED = {"sealed": {"$ne": True}}
+
+COMPACTION_LEASE = "count_shard_compaction"
+# Compaction rounds a lease covers, another worker takes over after a crash
+COMPACTION_LEASE_ROUNDS = 5
+
+
+class ShardsMoved(Exception):
+    """The food was split or folded while a shard write was in flight
+
+    Callers finish the move and retry. `delta` is the part of a stock
+    change that was not applied.
+    """
+
+    def __init__(self, delta: int = 0):
+        super().__init__(delta)
+        self.delta = delta
+
+
+def _shards():
+    return FoodCountShard.get_motor_collection()
+
+
+async def _moved(food_id) -> bool:
+    """Whether the food is no longer plainly sharded"""
+    food = await Food.get_motor_collection().find_one(
+        {"_id": food_id}, {"count_shards": 1, "shard_move": 1}
+    )
+    return not food or not food.get("count_shards") or bool(food.get("shard_move"))
+
+
+async def sharded_count(food_id) -> int:
+    """Exact stock of a sharded food, summed over its shards"""
+    result = await _shards().aggregate(
+        [
+            {"$match": {"food_id": food_id}},
+            {"$group": {"_id": None, "total": {"$sum": "$count"}}},
+        ]
+    ).to_list(1)
+    return result[0]["total"] if result else 0
+
+
+def _even_share(count: int, shards: int, shard: int) -> int:
+    """Stock of one shard when `count` is split evenly over `shards`"""
+    return count // shards + (1 if shard < count % shards else 0)
+
+
+async def enable_count_shards(food: Food, shards: int):
+    """Spread the stock and pending codes of a food over `shards` sub-counters"""
+    # Created empty first, so a writer that sees the flag finds its shard
+    await _shards().bulk_write(
+        [
+            UpdateOne(
+                {"food_id": food.id, "shard": shard},
+                {
+                    "$setOnInsert": {
+                        "count": 0,
+                        "collection_codes": [],
+                        "dirty": False,
+                        "seeded": False,
+                        "sealed": False,
+                    }
+                },
+                upsert=True,
+            )
+            for shard in range(shards)
+        ],
+        ordered=False,
+    )
+    # The flag and the codes switch over in one write, so in-flight unsharded
+    # validations find nothing left to consume and retry on the shards. The
+    # stock and codes stay in shard_move until every shard has its part.
+    after = await Food.get_motor_collection().find_one_and_update(
+        {"_id": food.id, **NOT_SHARDED, "shard_move": None},
+        [
+            {
+                "$set": {
+                    "count_shards": shards,
+                    "collection_codes": [],
+                    "shard_move": {
+                        "split": True,
+                        "count": "$count",
+                        "collection_codes": "$collection_codes",
+                        "folded": [],
+                    },
+                }
+            }
+        ],
+        projection={"count_shards": 1, "shard_move": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not after:
+        raise HTTPException(status_code=400, detail="Food item is already sharded")
+    await _finish_split(food.id, after["count_shards"], after["shard_move"])
+
+
+async def _finish_split(food_id, shards: int, move: dict):
+    # Each shard takes its part once, however many workers finish the split
+    codes = [code for code in move.get("collection_codes", []) if code]
+    await _shards().bulk_write(
+        [
+            UpdateOne(
+                {"food_id": food_id, "shard": shard, "seeded": False},
+                {
+                    "$inc": {"count": _even_share(move["count"], shards, shard)},
+                    "$push": {"collection_codes": {"$each": codes[shard::shards]}},
+                    "$set": {"seeded": True, "dirty": True},
+                },
+            )
+            for shard in range(shards)
+        ],
+        ordered=False,
+    )
+    await Food.get_motor_collection().update_one(
+        {"_id": food_id, "shard_move.split": True}, {"$unset": {"shard_move": ""}}
+    )
+
+
+async def disable_count_shards(food: Food):
+    """Fold the sub-counters and their codes back into the food document"""
+    switched = await Food.get_motor_collection().find_one_and_update(
+        {"_id": food.id, "count_shards": {"$gt": 0}, "shard_move": None},
+        {
+            "$set": {
+                "count_shards": 0,
+                "shard_move": {
+                    "split": False,
+                    "count": 0,
+                    "collection_codes": [],
+                    "folded": [],
+                },
+            }
+        },
+    )
+    if not switched:
+        raise HTTPException(status_code=400, detail="Food item is not sharded")
+    await _finish_fold(food.id)
+
+
+async def _finish_fold(food_id):
+    shards = await _shards().find({"food_id": food_id}, {"_id": 1}).to_list(None)
+    for shard in shards:
+        # Writers skip a sealed shard, so what is read here is final
+        sealed = await _shards().find_one_and_update(
+            {"_id": shard["_id"]},
+            {"$set": {"sealed": True}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not sealed:
+            continue
+        # Added to the stock changed meanwhile rather than overwriting it, and
+        # only once however many workers finish the fold
+        await Food.get_motor_collection().update_one(
+            {
+                "_id": food_id,
+                "shard_move.split": False,
+                "shard_move.folded": {"$ne": sealed["_id"]},
+            },
+            {
+                "$inc": {"count": sealed["count"]},
+                "$push": {
+                    "collection_codes": {
+                        "$each": [code for code in sealed["collection_codes"] if code]
+                    },
+                    "shard_move.folded": sealed["_id"],
+                },
+            },
+        )
+        await _shards().delete_one({"_id": sealed["_id"]})
+
+    change_seq = await next_change_seq()
+    food = await Food.get_motor_collection().find_one_and_update(
+        {"_id": food_id, "shard_move.split": False},
+        {"$unset": {"shard_move": ""}, "$set": {"change_seq": change_seq}},
+        projection={"vendor_id": 1},
+    )
+    if food:
+        await bump_versions(food["vendor_id"])
+
+
+async def finish_shard_move(food_id) -> bool:
+    """Complete a split or fold of the food if one is under way"""
+    food = await Food.get_motor_collection().find_one(
+        {"_id": food_id}, {"count_shards": 1, "shard_move": 1}
+    )
+    move = food and food.get("shard_move")
+    if not move:
+        return False
+    if move["split"]:
+        await _finish_split(food_id, food["count_shards"], move)
+    else:
+        await _finish_fold(food_id)
+    return True
+
+
+async def finish_shard_moves() -> int:
+    """Complete the moves left by crashed workers, returns how many there were"""
+    pending = await Food.get_motor_collection().find(
+        {"shard_move.split": {"$exists": True}}, {"_id": 1}
+    ).to_list(None)
+    for food in pending:
+        await finish_shard_move(food["_id"])
+    return len(pending)
+
+
+async def delete_count_shards(food_ids: list):
+    await _shards().delete_many({"food_id": {"$in": food_ids}})
+
+
+async def reserve_sharded_code(food: Food, code: CollectionCode):
+    """Store a collection code on a random shard"""
+    reserved = await _shards().update_one(
+        {"food_id": food.id, "shard": random.randrange(food.count_shards), **UNSEALED},
+        {"$push": {"collection_codes": code.model_dump()}},
+    )
+    if reserved.matched_count == 0:
+        raise ShardsMoved()
+
+
+async def consume_sharded_code(food: Food, collection_code: int):
+    """Validate a collection code and take one item from the shards"""
+    now = datetime.now()
+    holder = {
+        "food_id": food.id,
+        "collection_codes": {
+            "$elemMatch": {"code": collection_code, "expiration": {"$gte": now}}
+        },
+        **UNSEALED,
+    }
+    pull_code = {"$pull": {"collection_codes": {"code": collection_code}}}
+
+    # Common case: the shard holding the code still has stock
+    consumed = await _shards().find_one_and_update(
+        {**holder, "count": {"$gt": 0}},
+        {**pull_code, "$inc": {"count": -1}, "$set": {"dirty": True}},
+        projection={"_id": 1},
+    )
+    if consumed:
+        return
+
+    shard = await _shards().find_one(
+        {"food_id": food.id, "collection_codes.code": collection_code, **UNSEALED},
+        {"collection_codes.$": 1},
+    )
+    if not shard:
+        if await _moved(food.id):
+            raise ShardsMoved()
+        raise HTTPException(status_code=400, detail="Invalid collection code")
+    if shard["collection_codes"][0]["expiration"] < now:
+        await _shards().update_one({"_id": shard["_id"]}, pull_code)
+        raise HTTPException(status_code=400, detail="Collection code has expired")
+
+    # The holding shard ran dry, take the item from another one
+    taken = None
+    for shard_number in random.sample(range(food.count_shards), food.count_shards):
+        taken = await _shards().find_one_and_update(
+            {
+                "food_id": food.id,
+                "shard": shard_number,
+                "count": {"$gt": 0},
+                **UNSEALED,
+            },
+            {"$inc": {"count": -1}, "$set": {"dirty": True}},
+            projection={"_id": 1},
+        )
+        if taken:
+            break
+    if not taken:
+        if await _moved(food.id):
+            raise ShardsMoved()
+        raise HTTPException(status_code=400, detail="Food count is already 0")
+
+    pulled = await _shards().update_one(holder, pull_code)
+    if pulled.modified_count == 0:
+        # The code was used or folded in the meantime, give the item back. A
+        # sealed shard was already counted by the fold, so it goes to the food.
+        returned = await _shards().update_one(
+            {"_id": taken["_id"], **UNSEALED},
+            {"$inc": {"count": 1}, "$set": {"dirty": True}},
+        )
+        if returned.matched_count == 0:
+            await Food.get_motor_collection().update_one(
+                {"_id": food.id}, {"$inc": {"count": 1}}
+            )
+        if await _moved(food.id):
+            raise ShardsMoved()
+        raise HTTPException(
+            status_code=409, detail="Collection code was already used or food ran out"
+        )
+
+
+async def adjust_sharded_count(food: Food, delta: int) -> int:
+    """Apply a signed delta to a sharded food, never going below zero"""
+    shard_numbers = random.sample(range(food.count_shards), food.count_shards)
+    if delta >= 0:
+        for shard_number in shard_numbers:
+            added = await _shards().update_one(
+                {"food_id": food.id, "shard": shard_number, **UNSEALED},
+                {"$inc": {"count": delta}, "$set": {"dirty": True}},
+            )
+            if added.matched_count:
+                break
+        else:
+            raise ShardsMoved(delta)
+    else:
+        needed = -delta
+        for shard_number in shard_numbers:
+            before = await _shards().find_one_and_update(
+                {
+                    "food_id": food.id,
+                    "shard": shard_number,
+                    "count": {"$gt": 0},
+                    **UNSEALED,
+                },
+                [
+                    {
+                        "$set": {
+                            "count": {"$max": [0, {"$subtract": ["$count", needed]}]},
+                            "dirty": True,
+                        }
+                    }
+                ],
+                projection={"count": 1},
+            )
+            if before:
+                needed -= min(needed, before["count"])
+            if needed == 0:
+                break
+        # Stock still in a split or already folded is out of reach here
+        if needed and await _moved(food.id):
+            raise ShardsMoved(-needed)
+    return await sharded_count(food.id)
+
+
+async def set_sharded_count(food: Food, count: int):
+    """Overwrite the stock of a sharded food with an absolute value"""
+    shares = food.count_shards
+    await _shards().update_many(
+        {"food_id": food.id, **UNSEALED},
+        [
+            {
+                "$set": {
+                    "count": {
+                        "$add": [
+                            count // shares,
+                            {"$cond": [{"$lt": ["$shard", count % shares]}, 1, 0]},
+                        ]
+                    },
+                    "dirty": True,
+                }
+            }
+        ],
+    )
+
+
+async def compact_count_shards() -> int:
+    """Refresh Food.count of foods whose shards changed and drop expired codes
+
+    Splits and folds left unfinished by a crashed worker are completed first.
+
+    Returns the number of foods whose snapshot changed.
+    """
+    await finish_shard_moves()
+    now = datetime.now()
+    await _shards().update_many(
+        {"collection_codes.expiration": {"$lt": now}},
+        {"$pull": {"collection_codes": {"expiration": {"$lt": now}}}},
+    )
+
+    food_ids = await _shards().distinct("food_id", {"dirty": True})
+    if not food_ids:
+        return 0
+    # Cleared before summing, a change landing meanwhile marks its shard again
+    await _shards().update_many(
+        {"food_id": {"$in": food_ids}, "dirty": True}, {"$set": {"dirty": False}}
+    )
+    totals = {
+        entry["_id"]: entry["total"]
+        async for entry in _shards().aggregate(
+            [
+                {"$match": {"food_id": {"$in": food_ids}}},
+                {"$group": {"_id": "$food_id", "total": {"$sum": "$count"}}},
+            ]
+        )
+    }
+    if not totals:
+        return 0
+
+    foods = await Food.get_motor_collection().find(
+        {
+            "_id": {"$in": list(totals)},
+            "count_shards": {"$gt": 0},
+            # Mid-split shards do not hold the whole stock yet
+            "shard_move": None,
+        },
+        {"count": 1, "vendor_id": 1},
+    ).to_list(None)
+    changed = [food for food in foods if food["count"] != totals[food["_id"]]]
+    if not changed:
+        return 0
+
+    # Sharded foods enter the change feed and listing versions here rather
+    # than on every collection, which would make those counters hot instead
+    last_seq = await next_change_seq(len(changed))
+    first_seq = last_seq - len(changed) + 1
+    await Food.get_motor_collection().bulk_write(
+        [
+            UpdateOne(
+                {"_id": food["_id"]},
+                {
+                    "$set": {
+                        "count": totals[food["_id"]],
+                        "change_seq": first_seq + index,
+                    }
+                },
+            )
+            for index, food in enumerate(changed)
+        ],
+        ordered=False,
+    )
+    for vendor_id in {food["vendor_id"] for food in changed}:
+        await bump_versions(vendor_id)
+    return len(changed)
+
+
+async def _run_compaction():
+    interval = Settings().COUNT_SHARD_COMPACTION_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # One worker of the deployment compacts, the others stand by
+            if await acquire_lease(COMPACTION_LEASE, interval * COMPACTION_LEASE_ROUNDS):
+                await compact_count_shards()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Food counter compaction error")
+
+
+async def start_count_shard_compaction():
+    global _compaction_task
+    if _compaction_task is None or _compaction_task.done():
+        _compaction_task = asyncio.create_task(_run_compaction())
+
+
+async def stop_count_shard_compaction():
+    global _compaction_task
+    if _compaction_task is not None:
+        _compaction_task.cancel()
+        try:
+            await _compaction_task
+        except asyncio.CancelledError:
+            pass
+        _compaction_task = None
@@ -1,16 +1,52 @@
 from models.food_model.food_model import Food, UpdateFood, CreateFood
-from services.users.user_services import get_current_user, get_user_by_id
+from services.users.user_services import (
+    get_current_principal,
+    find_user_by_id,
+    check_vendor,
+)
+from services.shared.shared_services import update_with_revision
+from services.shared.single_flight import single_flight
+from services.versions.version_services import bump_versions, get_version, vendor_key
+from services.foods.food_counter_services import (
+    NOT_SHARDED,
+    adjust_sharded_count,
+    consume_sharded_code,
+    delete_count_shards,
+    disable_count_shards,
+    enable_count_shards,
+    finish_shard_move,
+    reserve_sharded_code,
+    set_sharded_count,
+    ShardsMoved,
+)
+from services.foods.food_change_services import (
+    next_change_seq,
+    record_food_deletions,
+    list_food_changes,
+    FOOD_CHANGES_PAGE_SIZE,
+)
 from fastapi import Depends, HTTPException, Body
 from models.user_model.user_model import UserType, User
+from models.auth_model.auth_model import Principal
 import random
 from datetime import datetime, timedelta
-from models.food_model.food_model import CollectionCode
+from models.food_model.food_model import CollectionCode, FoodListItem
 from typing import Annotated, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+import base64
+
+
+FOODS_PAGE_SIZE = 100
+FOODS_MAX_PAGE_SIZE = 500
+# Attempts of a stock change racing with the food being (un)sharded
+RESHARD_RETRIES = 3
 
 
 async def create_food(
     food_data: Annotated[CreateFood, Body()],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
     if current_user.user_type.value != UserType.VENDOR.value:
         raise HTTPException(
@@ -21,7 +57,7 @@ async def create_food(
     existing_food = await Food.find_one(
         {
             "food_type": food_data.food_type,
-            "vendor.$id": current_user.id,
+            "vendor_id": current_user.id,
         }
     )
     if existing_food:
@@ -30,11 +66,13 @@ async def create_food(
     food = Food(
         food_type=food_data.food_type,
         count=food_data.count,
-        vendor=current_user,
+        vendor_id=current_user.id,
     )
 
     try:
+        food.change_seq = await next_change_seq()
         await food.insert()
+        await bump_versions(current_user.id)
         return {"message": "Food created"}
     except Exception as e:
         return {"message": "Food not created", "error": str(e)}
@@ -43,9 +81,9 @@ async def create_food(
 async def create_food_admin(
     food_data: Annotated[CreateFood, Body()],
     vendor_id: str,                                            # selected_user: Annotated[User, Depends(get_user_by_id)],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
-    selected_user = await get_user_by_id(vendor_id)
+    selected_user = await find_user_by_id(vendor_id)
     if current_user.user_type.value != UserType.ADMIN.value:
         raise HTTPException(
             status_code=403, detail="Only admins can create food items"
@@ -60,7 +98,7 @@ async def create_food_admin(
     existing_food = await Food.find_one(
         {
             "food_type": food_data.food_type,
-            "vendor.$id": selected_user.id,
+            "vendor_id": selected_user.id,
         }
     )
     if existing_food:
@@ -69,11 +107,13 @@ async def create_food_admin(
     food = Food(
         food_type=food_data.food_type,
         count=food_data.count,
-        vendor=selected_user,
+        vendor_id=selected_user.id,
     )
 
     try:
+        food.change_seq = await next_change_seq()
         await food.insert()
+        await bump_versions(selected_user.id)
         return {"message": "Food created"}
     except Exception as e:
         return {"message": "Food not created", "error": str(e)}
@@ -82,7 +122,7 @@ async def create_food_admin(
 async def update_food(
     food_type: str,
     food_data: Annotated[UpdateFood, Body()],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
     try:
         if current_user.user_type.value != UserType.VENDOR.value:
@@ -94,28 +134,39 @@ async def update_food(
         food = await Food.find_one(
             {
                 "food_type": food_type,
-                "vendor.$id": current_user.id,
+                "vendor_id": current_user.id,
             }
         )
         if not food:
             raise HTTPException(status_code=404, detail="Food item not found")
 
+        update = {}
         if food_data.food_name:
             existing_food = await Food.find_one(
                 {
                     "food_type": food_data.food_name,
-                    "vendor.$id": current_user.id,
+                    "vendor_id": current_user.id,
                 }
             )
             if existing_food:
                 raise HTTPException(status_code=400, detail="Food item already exists")
 
-            food.food_type = food_data.food_name
+            update["food_type"] = food_data.food_name
         if food_data.count is not None:
-            food.count = food_data.count
-
-        await food.save()
+            update["count"] = food_data.count
+
+        if update:
+            update["change_seq"] = await next_change_seq()
+            # The name check above relies on the document read earlier
+            await update_with_revision(food, {"$set": update})
+            if food.count_shards and "count" in update:
+                if await finish_shard_move(food.id):
+                    food = await Food.get(food.id)
+                await set_sharded_count(food, update["count"])
+            await bump_versions(current_user.id)
         return {"message": "Food updated"}
+    except HTTPException:
+        raise
     except Exception as e:
         return {"message": "Food not updated", "error": str(e)}
 
@@ -124,7 +175,7 @@ async def update_food_admin(
     food_type: str,
     food_data: Annotated[UpdateFood, Body()],
     vendor_id: str,                                            # selected_user: Annotated[User, Depends(get_user_by_id)],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_principal)],
 ):
     try:
         if current_user.user_type.value != UserType.ADMIN.value:
@@ -132,7 +183,7 @@ async def update_food_admin(
                 status_code=403, detail="Only admins can update food items"
             )
         
-        selected_user = await get_user_by_id(vendor_id)
+        selected_user = await find_user_by_id(vendor_id)
 
         if selected_user.user_type.value != UserType.VENDOR.value:
             raise HTTPException(
@@ -143,35 +194,46 @@ async def update_food_admin(
         food = await Food.find_one(
             {
                 "food_type": food_type,
-                "vendor.$id": selected_user.id,
+                "vendor_id": selected_user.id,
             }
         )
         if not food:
             raise HTTPException(status_code=404, detail="Food item not found")
 
+        update = {}
         if food_data.food_name:
             existing_food = await Food.find_one(
                 {
                     "food_type": food_data.food_name,
-                    "vendor.$id": selected_user.id,
+                    "vendor_id": selected_user.id,
                 }
             )
             if existing_food:
                 raise HTTPException(status_code=400, detail="Food item already exists")
 
-            food.food_type = food_data.food_name
+            update["food_type"] = food_data.food_name
         if food_data.count is not None:
-            food.count = food_data.count
-
-        await food.save()
+            update["count"] = food_data.count
+
+        if update:
+            update["change_seq"] = await next_change_seq()
+            # The name check above relies on the document read earlier
+            await update_with_revision(food, {"$set": update})
+            if food.count_shards and "count" in update:
+                if await finish_shard_move(food.id):
+                    food = await Food.get(food.id)
+                await set_sharded_count(food, update["count"])
+            await bump_versions(selected_user.id)
         return {"message": "Food updated"}
+    except HTTPException:
+        raise
     except Exception as e:
         return {"message": "Food not updated", "error": str(e)}
 
 
 async def delete_food(
     food_type: str,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type.value != UserType.VENDOR.value:
         raise HTTPException(
@@ -179,12 +241,16 @@ async def delete_food(
         )
 
     # Check if the food exists
-    food = await Food.find_one({"food_type": food_type, "vendor.$id": current_user.id})
+    food = await Food.find_one({"food_type": food_type, "vendor_id": current_user.id})
     if not food:
         raise HTTPException(status_code=404, detail="Food item not found")
 
     try:
         await food.delete()
+        await record_food_deletions([food])
+        if food.count_shards or food.shard_move:
+            await delete_count_shards([food.id])
+        await bump_versions(current_user.id)
         return {"message": "Food deleted"}
     except Exception as e:
         return {"message": "Food not deleted", "error": str(e)}
@@ -193,42 +259,163 @@ async def delete_food(
 async def delete_food_admin(
     food_type: str,
     vendor_id: str,                                            # selected_user: Annotated[User, Depends(get_user_by_id)],
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type.value != UserType.ADMIN.value:
         raise HTTPException(
             status_code=403, detail="Only admins can delete food items"
         )
     
-    selected_user = await get_user_by_id(vendor_id)
+    selected_user = await find_user_by_id(vendor_id)
     if selected_user.user_type.value != UserType.VENDOR.value:
         raise HTTPException(
             status_code=403, detail="You can only delete food for vendors"
         )
 
     # Check if the food exists
-    food = await Food.find_one({"food_type": food_type, "vendor.$id": selected_user.id})
+    food = await Food.find_one({"food_type": food_type, "vendor_id": selected_user.id})
     if not food:
         raise HTTPException(status_code=404, detail="Food item not found")
 
     try:
         await food.delete()
+        await record_food_deletions([food])
+        if food.count_shards or food.shard_move:
+            await delete_count_shards([food.id])
+        await bump_versions(selected_user.id)
         return {"message": "Food deleted"}
     except Exception as e:
         return {"message": "Food not deleted", "error": str(e)}
 
 
-async def get_foods_by_vendor(vendor_id: str):
-    vendor = await User.get(vendor_id)
-    if not vendor:
-        raise HTTPException(status_code=404, detail="Vendor not found")
-    if vendor.user_type.value != UserType.VENDOR.value:
-        raise HTTPException(status_code=403, detail="The given user is not a vendor")
+async def adjust_food_count(
+    food_type: str,
+    delta: int,
+    current_user: Principal = Depends(get_current_principal),
+):
+    if current_user.user_type.value != UserType.VENDOR.value:
+        raise HTTPException(
+            status_code=403, detail="Only vendors can update food items"
+        )
+
+    for _ in range(RESHARD_RETRIES):
+        change_seq = await next_change_seq()
+        # Apply the delta on the server so concurrent collections are not
+        # overwritten, clamping at zero and returning the result in one round
+        # trip
+        food = await Food.get_motor_collection().find_one_and_update(
+            {"food_type": food_type, "vendor_id": current_user.id, **NOT_SHARDED},
+            [
+                {
+                    "$set": {
+                        "count": {"$max": [0, {"$add": ["$count", delta]}]},
+                        "change_seq": change_seq,
+                    }
+                }
+            ],
+            projection={"count": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if food:
+            await bump_versions(current_user.id)
+            return {"message": "Food count adjusted", "count": food["count"]}
+
+        food = await Food.find_one(
+            {"food_type": food_type, "vendor_id": current_user.id}
+        )
+        if not food:
+            raise HTTPException(status_code=404, detail="Food item not found")
+        if food.count_shards:
+            # The change feed and listing versions follow at the next
+            # compaction, like collections of sharded foods
+            try:
+                count = await adjust_sharded_count(food, delta)
+                return {"message": "Food count adjusted", "count": count}
+            except ShardsMoved as moved:
+                await finish_shard_move(food.id)
+                delta = moved.delta
+        # Unsharded since the update above, apply the rest to the food again
+    raise HTTPException(
+        status_code=409, detail="Food item is being resharded, try again"
+    )
+
+
+async def set_food_shards(
+    food_type: str,
+    shards: int,
+    current_user: Principal = Depends(get_current_principal),
+):
+    if current_user.user_type.value != UserType.VENDOR.value:
+        raise HTTPException(
+            status_code=403, detail="Only vendors can update food items"
+        )
+
+    food = await Food.find_one({"food_type": food_type, "vendor_id": current_user.id})
+    if not food:
+        raise HTTPException(status_code=404, detail="Food item not found")
+
+    # A move a crashed worker left is completed before the next one
+    if await finish_shard_move(food.id):
+        food = await Food.get(food.id)
+    if shards == food.count_shards:
+        return {"message": "Food shards unchanged"}
+    if food.count_shards:
+        await disable_count_shards(food)
+    if shards:
+        await enable_count_shards(food, shards)
+    return {"message": "Food shards updated", "shards": shards}
+
+
+def _encode_cursor(food: FoodListItem) -> str:
+    return base64.urlsafe_b64encode(f"{food.count}:{food.id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        count, food_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        count, food_id = int(count), ObjectId(food_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Continue after the last item in (count desc, _id asc) order
+    return {
+        "$or": [
+            {"count": {"$lt": count}},
+            {"count": count, "_id": {"$gt": food_id}},
+        ]
+    }
+
+
+@single_flight(
+    "foods_by_vendor",
+    generation=lambda vendor_id, *args, **kwargs: get_version(vendor_key(vendor_id)),
+)
+async def get_foods_by_vendor(
+    vendor_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+):
+    """One page of a vendor's foods and the cursor of the next page, if any
+
+    Without a limit or cursor all foods are returned, as before paging.
+    """
+    vendor_object_id = await check_vendor(vendor_id)
+    if limit is None and cursor:
+        limit = FOODS_PAGE_SIZE
+
+    query = {"vendor_id": vendor_object_id}
+    if cursor:
+        query.update(_decode_cursor(cursor))
+
+    foods = Food.find(query).sort([("count", -1), ("_id", 1)])
+    if limit:
+        # One extra item tells whether another page exists
+        foods = foods.limit(limit + 1)
+    foods = await foods.project(FoodListItem).to_list()
 
-    foods = await Food.find(
-        Food.vendor.id == vendor.id,
-        sort=[("count", -1)],
-    ).to_list()
+    next_cursor = None
+    if limit and len(foods) > limit:
+        foods = foods[:limit]
+        next_cursor = _encode_cursor(foods[-1])
 
     return [
         {
@@ -236,26 +423,22 @@ async def get_foods_by_vendor(vendor_id: str):
             "count": food.count,
         }
         for food in foods
-    ]
+    ], next_cursor
 
 
 async def create_food_collection_request(
     food_type: str,
     vendor_id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type.value != UserType.DEFAULT.value:
         raise HTTPException(
             status_code=403, detail="Only default users can collect food items"
         )
 
-    vendor = await User.get(vendor_id)
-    if not vendor:
-        raise HTTPException(status_code=404, detail="Vendor not found")
-    if vendor.user_type.value != UserType.VENDOR.value:
-        raise HTTPException(status_code=403, detail="The given user is not a vendor")
+    vendor_object_id = await check_vendor(vendor_id)
     # Find the food item
-    food = await Food.find_one({"food_type": food_type, "vendor.$id": vendor.id})
+    food = await Food.find_one({"food_type": food_type, "vendor_id": vendor_object_id})
     if not food:
         raise HTTPException(status_code=404, detail="Food item not found")
 
@@ -266,24 +449,42 @@ async def create_food_collection_request(
     )  # Set expiration time to 10 minutes from now
 
     # Store the collection code and its expiration time in the food item
-    food.collection_codes.append(
-        CollectionCode(
-            user_id=current_user.id, code=collection_code, expiration=expiration_time
-        )
-    )
+    code = CollectionCode(code=collection_code, expiration=expiration_time)
 
     try:
-        await food.save()
+        for _ in range(RESHARD_RETRIES):
+            if food.count_shards:
+                try:
+                    await reserve_sharded_code(food, code)
+                    break
+                except ShardsMoved:
+                    await finish_shard_move(food.id)
+            else:
+                pushed = await Food.find_one({"_id": food.id, **NOT_SHARDED}).update(
+                    {"$push": {"collection_codes": code.model_dump()}}
+                )
+                if pushed.matched_count:
+                    break
+            # The food was sharded or unsharded since it was read
+            food = await Food.get(food.id)
+            if not food:
+                raise HTTPException(status_code=404, detail="Food item not found")
+        else:
+            raise HTTPException(
+                status_code=409, detail="Food item is being resharded, try again"
+            )
         return {
             "message": "Collection code generated",
             "collection_code": collection_code,
         }
+    except HTTPException:
+        raise
     except Exception as e:
         return {"message": "Collection code not generated", "error": str(e)}
 
 
 async def validate_collection_code(
-    food_type: str, collection_code: int, current_user: User = Depends(get_current_user)
+    food_type: str, collection_code: int, current_user: Principal = Depends(get_current_principal)
 ):
     if current_user.user_type.value != UserType.VENDOR.value:
         raise HTTPException(
@@ -291,10 +492,34 @@ async def validate_collection_code(
         )
 
     # Find the food item
-    food = await Food.find_one({"food_type": food_type, "vendor.$id": current_user.id})
+    food = await Food.find_one({"food_type": food_type, "vendor_id": current_user.id})
     if not food:
         raise HTTPException(status_code=404, detail="Food item not found")
 
+    for _ in range(RESHARD_RETRIES):
+        if food.count_shards:
+            # Codes and stock of hot items live on the shards, the listing
+            # snapshot is refreshed by the compaction worker
+            try:
+                await consume_sharded_code(food, collection_code)
+                return {"message": "Food collected successfully"}
+            except ShardsMoved:
+                await finish_shard_move(food.id)
+        else:
+            collected = await _consume_code(food, collection_code)
+            if collected is not None:
+                return collected
+        # The food was sharded or unsharded since it was read
+        food = await Food.get(food.id)
+        if not food:
+            raise HTTPException(status_code=404, detail="Food item not found")
+    raise HTTPException(
+        status_code=409, detail="Food item is being resharded, try again"
+    )
+
+
+async def _consume_code(food: Food, collection_code: int):
+    """Collect from an unsharded food, None when it has to be read again"""
     # Validate the collection code
     valid_code = None
     for code in food.collection_codes:
@@ -302,22 +527,57 @@ async def validate_collection_code(
             valid_code = code
             break
 
+    if not valid_code or food.count == 0:
+        # A fold in progress may still hold the code or the stock
+        if await finish_shard_move(food.id):
+            return None
     if not valid_code:
         raise HTTPException(status_code=400, detail="Invalid collection code")
     if datetime.now() > valid_code.expiration:
-        food.collection_codes.remove(valid_code)
-        await food.save()
+        await Food.find_one(Food.id == food.id).update(
+            {"$pull": {"collection_codes": {"code": collection_code}}}
+        )
         raise HTTPException(status_code=400, detail="Collection code has expired")
 
     # Decrease the food count
     if food.count == 0:
         raise HTTPException(status_code=400, detail="Food count is already 0")
 
-    food.count -= 1
-    food.collection_codes.remove(valid_code)
-
     try:
-        await food.save()
-        return {"message": "Food collected successfully"}
+        change_seq = await next_change_seq()
+        # Consume the code and decrement in one write, so two validations of
+        # the same code or of the last item cannot both succeed
+        result = await Food.find_one(
+            {
+                "_id": food.id,
+                "collection_codes.code": collection_code,
+                "count": {"$gt": 0},
+                **NOT_SHARDED,
+            }
+        ).update(
+            {
+                "$pull": {"collection_codes": {"code": collection_code}},
+                "$inc": {"count": -1},
+                "$set": {"change_seq": change_seq},
+            }
+        )
     except Exception as e:
         return {"message": "Food not collected", "error": str(e)}
+    if result.matched_count == 0:
+        current = await Food.get(food.id)
+        if current and (current.count_shards or current.shard_move):
+            # Sharded since it was read, the code moved to a shard
+            return None
+        raise HTTPException(
+            status_code=409, detail="Collection code was already used or food ran out"
+        )
+    await bump_versions(food.vendor_id)
+    return {"message": "Food collected successfully"}
+
+
+async def get_food_changes(
+    since: int,
+    vendor_id: Optional[str] = None,
+    limit: int = FOOD_CHANGES_PAGE_SIZE,
+):
+    return await list_food_changes(since, vendor_id=vendor_id, limit=limit)
@@ -0,0 +1,41 @@
+from services.monitoring.mongo_health import mongo_breaker
+from services.email.email_services import smtp_breaker
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+import pymongo
+import time
+
+
+HEALTH_PING_TIMEOUT_SECONDS = 1
+
+
+async def health_report(request: Request) -> JSONResponse:
+    """Database reachability and breaker states, 503 when Mongo is down
+
+    An open SMTP breaker only delays emails, so it reports "degraded".
+    """
+    started = time.perf_counter()
+    mongo = {"ok": True}
+    try:
+        with pymongo.timeout(HEALTH_PING_TIMEOUT_SECONDS):
+            await request.app.state.mongo_client.admin.command("ping")
+        mongo["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    except Exception as e:
+        mongo = {"ok": False, "error": str(e)[:200]}
+
+    breakers = {
+        breaker.name: breaker.snapshot() for breaker in (mongo_breaker, smtp_breaker)
+    }
+    if not mongo["ok"] or breakers["mongo"]["state"] == "open":
+        status = "unavailable"
+    elif any(breaker["state"] != "closed" for breaker in breakers.values()):
+        status = "degraded"
+    else:
+        status = "ok"
+    return JSONResponse(
+        {"status": status, "mongo": mongo, "breakers": breakers},
+        status_code=503 if status == "unavailable" else 200,
+        headers={"Cache-Control": "no-store"},
+    )
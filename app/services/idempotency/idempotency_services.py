@@ -0,0 +1,179 @@
+from models.idempotency_model.idempotency_model import (
+    IdempotencyRecord,
+    IdempotencyStatus,
+)
+from services.shared.ttl_cache import TTLCache
+from config.config import Settings
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
+
+import hashlib
+import hmac
+import json
+import uuid
+
+
+_completed: TTLCache | None = None
+
+
+def _completed_cache() -> TTLCache:
+    global _completed
+    if _completed is None:
+        _completed = TTLCache(ttl=Settings().IDEMPOTENCY_TTL_SECONDS, maxsize=5_000)
+    return _completed
+
+
+def _fingerprint(payload) -> str:
+    # Payloads can carry passwords, a keyed hash keeps the stored fingerprint
+    # from being checked against guesses without the secret key
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, default=str)
+    return hmac.new(
+        Settings().SECRET_KEY.encode("utf-8"), encoded.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def _remember(key: str, record: IdempotencyRecord):
+    remaining = (record.expires_at - datetime.now()).total_seconds()
+    if remaining > 0:
+        _completed_cache().set(key, record, ttl=remaining)
+
+
+def _replay(record: IdempotencyRecord, request_hash: str) -> JSONResponse:
+    if record.request_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    return JSONResponse(
+        content=record.response,
+        status_code=record.status_code,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+class IdempotentReplay(Exception):
+    """Answers a retry with its stored response before the request is read"""
+
+    def __init__(self, response: JSONResponse):
+        super().__init__()
+        self.response = response
+
+
+async def precheck_idempotent(idempotency_key: str | None, scope: str, payload):
+    """Refuse or replay a retry early, for requests expensive to receive
+
+    Raises IdempotentReplay for a completed key and the usual 409 or 422 for
+    one still running or used for another request. run_idempotent still
+    makes the final decision.
+    """
+    if not idempotency_key:
+        return
+    key = f"{scope}:{idempotency_key}"
+    request_hash = _fingerprint(payload)
+
+    record = _completed_cache().get(key)
+    if record is None:
+        record = await IdempotencyRecord.find_one(IdempotencyRecord.key == key)
+    if record is None:
+        return
+    if record.status == IdempotencyStatus.COMPLETED:
+        _remember(key, record)
+        raise IdempotentReplay(_replay(record, request_hash))
+    if record.request_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    if record.locked_until is not None and record.locked_until > datetime.now():
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still being processed",
+        )
+
+
+async def run_idempotent(
+    idempotency_key: str | None,
+    scope: str,
+    payload,
+    operation,
+):
+    """Run `operation` once per key, replaying the stored response for retries"""
+    if not idempotency_key:
+        return await operation()
+
+    key = f"{scope}:{idempotency_key}"
+    request_hash = _fingerprint(payload)
+
+    cached = _completed_cache().get(key)
+    if cached is not None:
+        return _replay(cached, request_hash)
+
+    now = datetime.now()
+    lease_id = uuid.uuid4().hex
+    locked_until = now + timedelta(seconds=Settings().IDEMPOTENCY_LEASE_SECONDS)
+    record = IdempotencyRecord(
+        key=key,
+        request_hash=request_hash,
+        expires_at=now + timedelta(seconds=Settings().IDEMPOTENCY_TTL_SECONDS),
+        lease_id=lease_id,
+        locked_until=locked_until,
+    )
+    try:
+        await record.insert()
+    except DuplicateKeyError:
+        existing = await IdempotencyRecord.find_one(IdempotencyRecord.key == key)
+        if existing is not None and existing.status == IdempotencyStatus.COMPLETED:
+            _remember(key, existing)
+            return _replay(existing, request_hash)
+        if existing is not None and existing.request_hash != request_hash:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for a different request",
+            )
+        # Take over a record whose holder let its lease run out
+        taken = await IdempotencyRecord.get_motor_collection().find_one_and_update(
+            {
+                "key": key,
+                "status": IdempotencyStatus.IN_PROGRESS.value,
+                "locked_until": {"$not": {"$gt": now}},
+            },
+            {"$set": {"lease_id": lease_id, "locked_until": locked_until}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if taken is None:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still being processed",
+            )
+        record = IdempotencyRecord.model_validate(taken)
+
+    held = {"_id": record.id, "lease_id": lease_id}
+    try:
+        result = await operation()
+    except BaseException:
+        # Failed or abandoned requests are not remembered so that the client
+        # can retry them
+        await IdempotencyRecord.get_motor_collection().delete_one(held)
+        raise
+
+    record.status = IdempotencyStatus.COMPLETED
+    record.status_code = 200
+    record.response = jsonable_encoder(result)
+    await IdempotencyRecord.get_motor_collection().update_one(
+        held,
+        {
+            "$set": {
+                "status": record.status.value,
+                "status_code": record.status_code,
+                "response": record.response,
+                "locked_until": None,
+            }
+        },
+    )
+    _remember(key, record)
+    return result
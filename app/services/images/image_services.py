@@ -0,0 +1,194 @@
+from models.user_model.user_model import VendorProfile
+from config.config import Settings
+
+from fastapi import HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from gridfs.errors import NoFile
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+IMAGE_BUCKET = "vendor_images"
+# Text fields of an image form are short, anything longer is refused
+FORM_FIELD_MAX_BYTES = 64 * 1024
+# Room for the text fields and multipart framing on top of the image
+FORM_OVERHEAD_BYTES = 256 * 1024
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    """Content type from the leading bytes, the client's claim is ignored"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _bucket() -> AsyncIOMotorGridFSBucket:
+    database = VendorProfile.get_motor_collection().database
+    return AsyncIOMotorGridFSBucket(database, bucket_name=IMAGE_BUCKET)
+
+
+class _ImageForm:
+    """Collects the text fields of a multipart form and queues image chunks"""
+
+    def __init__(self, image_field: str, max_bytes: int):
+        self.image_field = image_field
+        self.max_bytes = max_bytes
+        self.fields: dict[str, str] = {}
+        self.filename = None
+        # Image bytes parsed but not yet written to storage
+        self.pending: list[bytes] = []
+        self.image_size = 0
+        self.image_seen = False
+        self.image_done = False
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = None
+        self._is_image = False
+        self._value = bytearray()
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._value = bytearray()
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("utf-8")
+        self._is_image = self._name == self.image_field
+        if self._is_image:
+            if self.image_seen:
+                raise HTTPException(status_code=400, detail="Only one image is accepted")
+            self.image_seen = True
+            self.filename = options.get(b"filename", b"").decode("utf-8") or None
+
+    def on_part_data(self, data, start, end):
+        if self._is_image:
+            self.image_size += end - start
+            if self.image_size > self.max_bytes:
+                raise HTTPException(status_code=413, detail="Image is too large")
+            self.pending.append(bytes(data[start:end]))
+        else:
+            self._value += data[start:end]
+            if len(self._value) > FORM_FIELD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Form field is too large")
+
+    def on_part_end(self):
+        if self._is_image:
+            self.image_done = True
+        elif self._name:
+            self.fields[self._name] = self._value.decode("utf-8")
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+
+async def receive_image_form(
+    request: Request, image_field: str = "image", before_image=None
+):
+    """Stream a multipart form, writing its image straight to GridFS
+
+    Returns the text fields and the id of the stored image. Oversized
+    uploads and files that are not images are refused from the first bytes,
+    so the body is never held in memory or spooled to disk. `before_image`
+    is awaited with the fields sent ahead of the image, before anything is
+    stored, and may raise to refuse the request.
+    """
+    max_bytes = Settings().VENDOR_IMAGE_MAX_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > max_bytes + FORM_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large")
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart form")
+
+    form = _ImageForm(image_field, max_bytes)
+    parser = MultipartParser(boundary, form.callbacks())
+    upload = None
+    head = b""
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if not form.pending:
+                continue
+            if upload is None:
+                if before_image is not None:
+                    await before_image(dict(form.fields))
+                    before_image = None
+                head += b"".join(form.pending)
+                form.pending.clear()
+                if len(head) < 12 and not form.image_done:
+                    continue
+                image_type = sniff_image_type(head)
+                if image_type is None:
+                    raise HTTPException(
+                        status_code=415, detail="Image must be a JPEG, PNG or WebP file"
+                    )
+                upload = _bucket().open_upload_stream(
+                    form.filename or "image", metadata={"contentType": image_type}
+                )
+                form.pending.append(head)
+            for data in form.pending:
+                await upload.write(data)
+            form.pending.clear()
+        parser.finalize()
+
+        if upload is None:
+            raise HTTPException(status_code=400, detail="An image is required")
+        await upload.close()
+    except BaseException:
+        if upload is not None:
+            await upload.abort()
+        raise
+    return form.fields, upload._id
+
+
+async def open_image(image_id: ObjectId):
+    """Content type and chunk iterator of a stored image, None if missing"""
+    try:
+        download = await _bucket().open_download_stream(image_id)
+    except NoFile:
+        return None
+    metadata = download.metadata or {}
+
+    async def chunks():
+        while data := await download.readchunk():
+            yield data
+
+    return metadata.get("contentType", "image/jpeg"), chunks()
+
+
+async def delete_images(image_ids: list):
+    for image_id in image_ids:
+        try:
+            await _bucket().delete(image_id)
+        except NoFile:
+            pass
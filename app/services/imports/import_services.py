@@ -0,0 +1,257 @@
+from models.user_model.user_model import (
+    User,
+    UserType,
+    CreateUser,
+    RegisterVendorByAdmin,
+    VendorProfile,
+    VENDOR_PROFILE_FIELDS,
+)
+from models.food_model.food_model import Food, ImportFood
+from models.auth_model.auth_model import Principal
+from services.exports.export_services import (
+    ExportFormat,
+    check_admin,
+    unescape_csv_value,
+)
+from services.foods.food_change_services import next_change_seq
+from services.versions.version_services import bump_versions
+from services.shared.shared_services import hash_passwords
+
+from fastapi import UploadFile
+from beanie import PydanticObjectId
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+import csv
+import json
+
+
+# Rows validated, hashed and written together
+IMPORT_BATCH_SIZE = 500
+IMPORT_CHUNK_SIZE = 64 * 1024
+
+
+async def _lines(file: UploadFile):
+    """Lines of an uploaded file, read in chunks rather than all at once"""
+    pending = b""
+    while chunk := await file.read(IMPORT_CHUNK_SIZE):
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def _rows(file: UploadFile, import_format: ExportFormat):
+    """(line number, row dict or parse error) for every non-empty line
+
+    CSV records must fit on one line, which holds for every column imported.
+    """
+    header = None
+    line_no = 0
+    async for raw in _lines(file):
+        line_no += 1
+        try:
+            line = raw.decode("utf-8").removeprefix("\ufeff").strip()
+        except UnicodeDecodeError as e:
+            yield line_no, e
+            continue
+        if not line:
+            continue
+        if import_format == ExportFormat.NDJSON:
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+        elif header is None:
+            header = next(csv.reader([line]))
+        else:
+            values = next(csv.reader([line]))
+            # Empty cells fall back to the field defaults
+            yield line_no, {
+                key: unescape_csv_value(value)
+                for key, value in zip(header, values)
+                if value != ""
+            }
+
+
+def _error(report: dict, line_no: int, error):
+    report["errors"].append({"line": line_no, "error": str(error)})
+
+
+def _validate(batch: list, model, report: dict) -> list:
+    valid = []
+    for line_no, row in batch:
+        if isinstance(row, Exception):
+            _error(report, line_no, row)
+            continue
+        try:
+            valid.append((line_no, model.model_validate(row)))
+        except ValidationError as e:
+            _error(
+                report,
+                line_no,
+                "; ".join(
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                    for error in e.errors()
+                ),
+            )
+    return valid
+
+
+async def _insert_many(
+    model, documents: list, line_nos: list, report: dict, counted: bool = True
+) -> set:
+    """Unordered insert, returns the positions of the rejected documents
+
+    Side documents of a row already counted pass `counted=False`.
+    """
+    if not documents:
+        return set()
+    try:
+        await model.insert_many(documents, ordered=False)
+        failed = set()
+    except BulkWriteError as e:
+        failed = set()
+        for write_error in e.details.get("writeErrors", []):
+            index = write_error["index"]
+            failed.add(index)
+            if write_error.get("code") == 11000:
+                _error(report, line_nos[index], "Duplicate of an existing record")
+            else:
+                _error(report, line_nos[index], write_error.get("errmsg"))
+    if counted:
+        report["inserted"] += len(documents) - len(failed)
+    return failed
+
+
+async def _import_users(batch: list, report: dict, with_profile: bool):
+    model = RegisterVendorByAdmin if with_profile else CreateUser
+    valid = _validate(batch, model, report)
+    if not valid:
+        return
+
+    hashes = await hash_passwords([data.password for _, data in valid])
+    users = [
+        User(
+            **data.model_dump(),
+            hashed_password=hashed_password,
+            id=PydanticObjectId(),
+        )
+        for (_, data), hashed_password in zip(valid, hashes)
+    ]
+    failed = await _insert_many(User, users, [line for line, _ in valid], report)
+
+    inserted = [
+        (line_no, user, data)
+        for index, (user, (line_no, data)) in enumerate(zip(users, valid))
+        if index not in failed
+    ]
+    if with_profile and inserted:
+        failed = await _insert_many(
+            VendorProfile,
+            [
+                VendorProfile(
+                    user_id=user.id,
+                    **data.model_dump(include=VENDOR_PROFILE_FIELDS),
+                )
+                for _, user, data in inserted
+            ],
+            [line_no for line_no, _, _ in inserted],
+            report,
+            counted=False,
+        )
+        if failed:
+            # A vendor without its profile is not imported, its line is
+            # already reported
+            rolled_back = [inserted[index][1].id for index in failed]
+            await User.get_motor_collection().delete_many({"_id": {"$in": rolled_back}})
+            report["inserted"] -= len(rolled_back)
+            inserted = [row for index, row in enumerate(inserted) if index not in failed]
+    if any(user.user_type == UserType.VENDOR for _, user, _ in inserted):
+        await bump_versions()
+
+
+async def _import_foods(batch: list, report: dict):
+    valid = _validate(batch, ImportFood, report)
+    if not valid:
+        return
+
+    vendor_ids = {
+        user["_id"]
+        async for user in User.get_motor_collection().find(
+            {
+                "_id": {"$in": list({data.vendor_id for _, data in valid})},
+                "user_type": UserType.VENDOR.value,
+            },
+            {"_id": 1},
+        )
+    }
+    rows = []
+    for line_no, data in valid:
+        if data.vendor_id in vendor_ids:
+            rows.append((line_no, data))
+        else:
+            _error(report, line_no, "Vendor not found")
+    if not rows:
+        return
+
+    first_seq = await next_change_seq(len(rows)) - len(rows) + 1
+    foods = [
+        Food(
+            vendor_id=data.vendor_id,
+            food_type=data.food_type,
+            count=data.count,
+            change_seq=first_seq + index,
+        )
+        for index, (_, data) in enumerate(rows)
+    ]
+    failed = await _insert_many(Food, foods, [line for line, _ in rows], report)
+    for vendor_id in {
+        food.vendor_id for index, food in enumerate(foods) if index not in failed
+    }:
+        await bump_versions(vendor_id)
+
+
+async def _run_import(file: UploadFile, import_format: ExportFormat, import_batch):
+    report = {"inserted": 0, "errors": []}
+    batch = []
+    async for row in _rows(file, import_format):
+        batch.append(row)
+        if len(batch) == IMPORT_BATCH_SIZE:
+            await import_batch(batch, report)
+            batch = []
+    if batch:
+        await import_batch(batch, report)
+    report["failed"] = len(report["errors"])
+    return report
+
+
+async def import_users(
+    file: UploadFile, import_format: ExportFormat, current_user: Principal
+):
+    check_admin(current_user)
+    return await _run_import(
+        file,
+        import_format,
+        lambda batch, report: _import_users(batch, report, with_profile=False),
+    )
+
+
+async def import_vendors(
+    file: UploadFile, import_format: ExportFormat, current_user: Principal
+):
+    check_admin(current_user)
+    return await _run_import(
+        file,
+        import_format,
+        lambda batch, report: _import_users(batch, report, with_profile=True),
+    )
+
+
+async def import_foods(
+    file: UploadFile, import_format: ExportFormat, current_user: Principal
+):
+    check_admin(current_user)
+    return await _run_import(file, import_format, _import_foods)
@@ -0,0 +1,144 @@
+from config.config import Settings
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the lag histogram, in seconds
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and reports blocking calls
+
+    A task asks to be woken every `interval` seconds and records how late it
+    was. A watchdog thread reads the task's heartbeat and, when the loop has
+    not come back for `threshold` seconds, logs the stack of the loop
+    thread, which shows the call that is blocking it.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.lag_sum = 0.0
+        self.lag_count = 0
+        self.bucket_counts = [0] * len(LAG_BUCKETS)
+        self.blocked_total = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    def _observe(self, lag: float):
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.lag_sum += lag
+        self.lag_count += 1
+        for index, bound in enumerate(LAG_BUCKETS):
+            if lag <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self._observe(max(0.0, now - expected))
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # One report per blocking episode
+            reported = True
+            self.blocked_total += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(f"Event loop blocked for {stalled:.3f}s at:\n{stack}")
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-lag-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> str:
+        """Prometheus text exposition of the lag measurements"""
+        lines = [
+            "# HELP event_loop_lag_seconds Delay of the event loop scheduler",
+            "# TYPE event_loop_lag_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(LAG_BUCKETS, self.bucket_counts):
+            cumulative += count
+            lines.append(f'event_loop_lag_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f'event_loop_lag_seconds_bucket{{le="+Inf"}} {self.lag_count}',
+            f"event_loop_lag_seconds_sum {self.lag_sum}",
+            f"event_loop_lag_seconds_count {self.lag_count}",
+            "# HELP event_loop_lag_last_seconds Most recent scheduler delay",
+            "# TYPE event_loop_lag_last_seconds gauge",
+            f"event_loop_lag_last_seconds {self.last_lag}",
+            "# HELP event_loop_lag_max_seconds Largest scheduler delay seen",
+            "# TYPE event_loop_lag_max_seconds gauge",
+            f"event_loop_lag_max_seconds {self.max_lag}",
+            "# HELP event_loop_blocked_total Times the loop was blocked past the threshold",
+            "# TYPE event_loop_blocked_total counter",
+            f"event_loop_blocked_total {self.blocked_total}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+_monitor: LoopLagMonitor | None = None
+
+
+async def start_loop_monitor():
+    global _monitor
+    if _monitor is None:
+        settings = Settings()
+        _monitor = LoopLagMonitor(
+            interval=settings.LOOP_LAG_INTERVAL_SECONDS,
+            threshold=settings.LOOP_BLOCK_THRESHOLD_SECONDS,
+        )
+        _monitor.start()
+
+
+async def stop_loop_monitor():
+    global _monitor
+    if _monitor is not None:
+        await _monitor.stop()
+        _monitor = None
+
+
+def loop_metrics() -> str:
+    return _monitor.metrics() if _monitor is not None else ""
@@ -0,0 +1,60 @@
+from services.shared.circuit_breaker import CircuitBreaker
+
+from pymongo import monitoring
+from pymongo.errors import ConnectionFailure
+
+
+mongo_breaker = CircuitBreaker("mongo")
+
+# Failed commands carry either the driver error as {"errtype": class name}
+# or the server's reply. Network errors surface as AutoReconnect; its
+# NetworkTimeout subclass is left out, with per-request deadlines a timeout
+# mostly means the request ran out of its own budget.
+_NETWORK_ERRORS = {"AutoReconnect"}
+# Server replies of a primary that stepped down or is shutting down
+_NOT_PRIMARY_CODES = {
+    91,  # ShutdownInProgress
+    189,  # PrimarySteppedDown
+    10107,  # NotWritablePrimary
+    11600,  # InterruptedAtShutdown
+    11602,  # InterruptedDueToReplStateChange
+    13435,  # NotPrimaryNoSecondaryOk
+    13436,  # NotPrimaryOrSecondary
+}
+
+
+def is_mongo_outage(error: BaseException) -> bool:
+    """Errors that say the database cannot be reached"""
+    return isinstance(error, ConnectionFailure)
+
+
+class MongoHealthListener(monitoring.CommandListener, monitoring.TopologyListener):
+    """Feeds command outcomes and primary availability into the Mongo breaker"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_breaker.record_success()
+
+    def failed(self, event):
+        failure = event.failure
+        if (
+            failure.get("errtype") in _NETWORK_ERRORS
+            or failure.get("code") in _NOT_PRIMARY_CODES
+        ):
+            mongo_breaker.record_failure(failure.get("errmsg"))
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        previous = event.previous_description.has_writable_server()
+        current = event.new_description.has_writable_server()
+        if previous and not current:
+            mongo_breaker.trip("No writable server")
+        elif current and not previous:
+            mongo_breaker.reset()
+
+    def closed(self, event):
+        pass
@@ -0,0 +1,114 @@
+from pymongo import monitoring
+
+import asyncio
+import contextvars
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# Task serving the current request, Motor copies it to its worker threads
+_current_task: contextvars.ContextVar = contextvars.ContextVar(
+    "query_origin_task", default=None
+)
+
+_SERVICES_DIR = os.sep + "services" + os.sep
+_MONITORED_COMMANDS = {
+    "find",
+    "aggregate",
+    "count",
+    "distinct",
+    "findAndModify",
+    "update",
+    "delete",
+    "insert",
+}
+# Guards against walking an endless chain
+_MAX_AWAIT_DEPTH = 200
+# Where the filter, pipeline or updates of each command are found
+_SHAPE_FIELDS = ("filter", "query", "pipeline", "updates", "deletes", "sort")
+
+
+def remember_query_origin():
+    """Let slow queries issued from the current task name their service"""
+    _current_task.set(asyncio.current_task())
+
+
+def query_shape(value):
+    """The keys and operators of a query with every value replaced by 1"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value[:3]]
+    return 1
+
+
+def _await_frames(coro) -> list:
+    """Frames of a suspended coroutine and everything it awaits, outermost first
+
+    Task.get_stack() only returns the outermost frame of a suspended task,
+    the await chain is followed through cr_await instead.
+    """
+    frames = []
+    while coro is not None and len(frames) < _MAX_AWAIT_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            frame = getattr(coro, "ag_frame", None)
+        if frame is not None:
+            frames.append(frame)
+        awaited = getattr(coro, "cr_await", None)
+        if awaited is None:
+            awaited = getattr(coro, "gi_yieldfrom", None)
+        if awaited is None:
+            awaited = getattr(coro, "ag_await", None)
+        coro = awaited
+    return frames
+
+
+def _query_origin() -> str:
+    task = _current_task.get()
+    if task is None or task.done():
+        return "unknown"
+    # The task is suspended on this command, so its await chain is stable
+    for frame in reversed(_await_frames(task.get_coro())):
+        filename = frame.f_code.co_filename
+        if _SERVICES_DIR in filename:
+            path = filename[filename.index(_SERVICES_DIR) + 1 :]
+            return f"{path}:{frame.f_code.co_name}:{frame.f_lineno}"
+    return "unknown"
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Log database commands slower than `threshold_ms` with their origin"""
+
+    def __init__(self, threshold_ms: float):
+        self.threshold_micros = threshold_ms * 1000
+        self._commands: dict = {}
+
+    def started(self, event):
+        if event.command_name in _MONITORED_COMMANDS:
+            key = (event.connection_id, event.request_id)
+            self._commands[key] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        started = self._commands.pop((event.connection_id, event.request_id), None)
+        if started is None or event.duration_micros < self.threshold_micros:
+            return
+        database, command = started
+        shape = {
+            field: query_shape(command[field])
+            for field in _SHAPE_FIELDS
+            if field in command
+        }
+        logger.warning(
+            f"Slow query: {event.duration_micros / 1000:.1f}ms "
+            f"{event.command_name} {database}.{command.get(event.command_name)} "
+            f"{shape} from {_query_origin()}"
+        )
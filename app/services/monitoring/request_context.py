@@ -0,0 +1,57 @@
+from pymongo import monitoring
+
+import contextvars
+
+
+class RequestContext:
+    """Per-request values collected for the access log"""
+
+    __slots__ = ("request_id", "user_id", "mongo_ops", "mongo_micros")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.user_id = None
+        self.mongo_ops = 0
+        self.mongo_micros = 0
+
+
+# Holds a mutable object, so values set deeper in the request (or in the
+# worker threads Motor copies the context to) are seen by the middleware
+_request_context: contextvars.ContextVar = contextvars.ContextVar(
+    "request_context", default=None
+)
+
+
+def begin_request_context(request_id: str) -> RequestContext:
+    context = RequestContext(request_id)
+    _request_context.set(context)
+    return context
+
+
+def get_request_context() -> RequestContext | None:
+    return _request_context.get()
+
+
+def set_request_user(user_id):
+    context = _request_context.get()
+    if context is not None:
+        context.user_id = str(user_id)
+
+
+class MongoTimingListener(monitoring.CommandListener):
+    """Adds the count and duration of database commands to the request"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        context = _request_context.get()
+        if context is not None:
+            context.mongo_ops += 1
+            context.mongo_micros += event.duration_micros
@@ -0,0 +1,102 @@
+from models.profile_model.profile_model import RequestProfile, RequestProfileSummary
+from models.user_model.user_model import UserType
+from models.auth_model.auth_model import Principal
+from services.users.user_services import get_current_principal
+from config.config import Settings
+
+from fastapi import HTTPException, Response
+from bson import ObjectId
+
+import asyncio
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # profiling is optional, requests are served unprofiled
+    Profiler = None
+
+
+PROFILES_PAGE_SIZE = 50
+
+
+def profiling_available() -> bool:
+    return Profiler is not None
+
+
+def start_profiler():
+    profiler = Profiler(
+        interval=Settings().PROFILE_INTERVAL_SECONDS, async_mode="enabled"
+    )
+    profiler.start()
+    return profiler
+
+
+async def is_admin_token(authorization: str | None) -> bool:
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        principal = await get_current_principal(token)
+    except HTTPException:
+        return False
+    return principal.user_type == UserType.ADMIN
+
+
+async def save_profile(
+    profile_id: ObjectId,
+    profiler,
+    method: str,
+    path: str,
+    status_code: int | None,
+):
+    session = profiler.last_session
+    # Rendering walks every sample, keep it off the event loop
+    speedscope = await asyncio.to_thread(
+        profiler.output, renderer=SpeedscopeRenderer()
+    )
+    await RequestProfile(
+        id=profile_id,
+        method=method,
+        path=path,
+        status_code=status_code,
+        duration_ms=session.duration * 1000 if session else 0,
+        speedscope=speedscope,
+    ).insert()
+
+
+def _check_admin(current_user: Principal):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(
+            status_code=403,
+            detail="You are not authorized to access this resource",
+        )
+
+
+async def list_profiles(current_user: Principal):
+    _check_admin(current_user)
+    return (
+        await RequestProfile.find()
+        .sort([("created_at", -1)])
+        .limit(PROFILES_PAGE_SIZE)
+        .project(RequestProfileSummary)
+        .to_list()
+    )
+
+
+async def download_profile(profile_id: str, current_user: Principal):
+    _check_admin(current_user)
+    try:
+        profile = await RequestProfile.get(ObjectId(profile_id))
+    except Exception:
+        profile = None
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        content=profile.speedscope,
+        media_type="application/json",
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="profile-{profile_id}.speedscope.json"'
+            )
+        },
+    )
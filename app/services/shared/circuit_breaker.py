@@ -0,0 +1,107 @@
+import threading
+import time
+
+
+# Consecutive failures that open a breaker, and how long it stays open
+# before requests are let through again to probe the dependency
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+# How long a half open breaker waits for its probe before letting another one
+# through, for probes that never reach the dependency
+BREAKER_PROBE_SECONDS = 10
+
+
+class CircuitBreaker:
+    """Fails fast while a dependency keeps failing
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    `allow()` is false for `reset_seconds`. It is then half open: a single
+    call is let through as a probe, its success closes the breaker and its
+    failure reopens it. Failures may be recorded from driver threads, hence
+    the lock.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS,
+        probe_seconds: float = BREAKER_PROBE_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.probe_seconds = probe_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.last_error: str | None = None
+        self.probe_started: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state != "half_open":
+                return state == "closed"
+            now = time.monotonic()
+            if (
+                self.probe_started is not None
+                and now - self.probe_started < self.probe_seconds
+            ):
+                return False
+            self.probe_started = now
+            return True
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 0
+        remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+        return max(1, int(remaining + 0.999))
+
+    def record_success(self):
+        with self._lock:
+            if self.state == "open":
+                # A call started before the breaker opened
+                return
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            if error is not None:
+                self.last_error = str(error)[:200]
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+    def trip(self, error=None):
+        """Open right away, when the dependency is known to be down"""
+        with self._lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.last_error = str(error)[:200] if error is not None else None
+            self.opened_at = time.monotonic()
+            self.probe_started = None
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": self.retry_after() if self.state == "open" else 0,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,85 @@
+from services.shared.ttl_cache import TTLCache
+from config.config import Settings
+
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "text/",
+)
+
+# (path, query, etag, encoding) -> compressed body of a snapshot response
+_precompressed = TTLCache(ttl=300, maxsize=512)
+
+
+def choose_encoding(accept_encoding: str | None) -> str | None:
+    """Best encoding the client accepts, brotli first"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type: str | None) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class StreamCompressor:
+    """Incremental compressor that flushes every chunk it is given"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=Settings().BROTLI_QUALITY)
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(Settings().GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=Settings().BROTLI_QUALITY)
+    compressor = zlib.compressobj(Settings().GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def get_precompressed(key) -> bytes | None:
+    return _precompressed.get(key)
+
+
+def set_precompressed(key, body: bytes):
+    _precompressed.set(key, body)
@@ -0,0 +1,182 @@
+from config.config import Settings
+
+from enum import IntEnum
+
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class Priority(IntEnum):
+    CRITICAL = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of queued"""
+
+
+# (method, path prefix, priority, route group), first match wins. Routes of
+# a group also share that group's own concurrency limit.
+ROUTE_CLASSES = [
+    ("POST", "/foods/validate_collection_code", Priority.CRITICAL, None),
+    ("POST", "/login", Priority.CRITICAL, None),
+    ("POST", "/foods/collect", Priority.NORMAL, None),
+    ("GET", "/foods/list/", Priority.LOW, None),
+    ("GET", "/foods/changes", Priority.LOW, None),
+    ("GET", "/users/vendors", Priority.LOW, None),
+    ("*", "/exports/", Priority.LOW, "exports"),
+    ("*", "/imports/", Priority.LOW, "imports"),
+    ("*", "/profiles", Priority.LOW, None),
+]
+# Served without a slot so the worker can still be observed under overload
+UNLIMITED_PATHS = {"/metrics", "/health"}
+
+
+def classify(method: str, path: str) -> tuple[Priority, str | None]:
+    for route_method, prefix, priority, group in ROUTE_CLASSES:
+        if route_method in ("*", method) and path.startswith(prefix):
+            return priority, group
+    if method == "GET" and path == "/users/":
+        return Priority.LOW, None
+    return Priority.NORMAL, None
+
+
+class PriorityLimiter:
+    """Concurrency limit whose waiters are admitted by priority
+
+    Waiting requests are woken most urgent first. The last `reserved` slots
+    are only given to critical requests, and each priority may only queue
+    `budgets[priority]` requests, anything beyond is shed straight away.
+    """
+
+    def __init__(self, limit: int, budgets: dict, reserved: int = 0):
+        self.limit = limit
+        self.budgets = budgets
+        self.reserved = min(reserved, limit - 1)
+        self.active = 0
+        self.shed = {priority: 0 for priority in Priority}
+        self._waiting = {priority: 0 for priority in Priority}
+        self._waiters: list = []
+        self._order = itertools.count()
+
+    def _capacity(self, priority: Priority) -> int:
+        return self.limit if priority == Priority.CRITICAL else self.limit - self.reserved
+
+    def _shed(self, priority: Priority):
+        self.shed[priority] += 1
+        raise Overloaded()
+
+    async def acquire(self, priority: Priority, timeout: float):
+        if not self._waiters and self.active < self._capacity(priority):
+            self.active += 1
+            return
+        if self._waiting[priority] >= self.budgets[priority]:
+            self._shed(priority)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._order), future)
+        heapq.heappush(self._waiters, entry)
+        self._waiting[priority] += 1
+        # A slot may be free for it already, if the queue held only stale entries
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._shed(priority)
+            # Admitted just as the timeout fired, keep the slot
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._waiting[priority] -= 1
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # Timed out or cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            if self.active >= self._capacity(priority):
+                return
+            heapq.heappop(self._waiters)
+            self.active += 1
+            future.set_result(None)
+
+
+class ConcurrencyLimits:
+    """The worker wide limiter and the limiters of the route groups"""
+
+    def __init__(self, settings):
+        budgets = {
+            Priority.CRITICAL: settings.CONCURRENCY_QUEUE_BUDGET,
+            Priority.NORMAL: settings.CONCURRENCY_QUEUE_BUDGET,
+            Priority.LOW: settings.CONCURRENCY_LOW_QUEUE_BUDGET,
+        }
+        self.queue_timeout = settings.CONCURRENCY_QUEUE_TIMEOUT_SECONDS
+        self.main = PriorityLimiter(
+            settings.CONCURRENCY_LIMIT, budgets, settings.CONCURRENCY_RESERVED
+        )
+        self.groups = {
+            "exports": PriorityLimiter(settings.EXPORT_CONCURRENCY, budgets),
+            "imports": PriorityLimiter(settings.IMPORT_CONCURRENCY, budgets),
+        }
+
+    async def acquire(self, priority: Priority, group: str | None) -> list:
+        """Take a slot in the group, then in the worker, return what to release"""
+        held = []
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            for limiter in ([self.groups[group]] if group else []) + [self.main]:
+                await limiter.acquire(priority, max(0.0, deadline - time.monotonic()))
+                held.append(limiter)
+        except BaseException:
+            release(held)
+            raise
+        return held
+
+    def metrics(self) -> str:
+        lines = [
+            "# HELP http_requests_active Requests holding a concurrency slot",
+            "# TYPE http_requests_active gauge",
+            f"http_requests_active {self.main.active}",
+            "# HELP http_requests_shed_total Requests refused with 503 under load",
+            "# TYPE http_requests_shed_total counter",
+        ]
+        for priority, count in self.main.shed.items():
+            shed = count + sum(group.shed[priority] for group in self.groups.values())
+            lines.append(
+                f'http_requests_shed_total{{priority="{priority.name.lower()}"}} {shed}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+def release(held: list):
+    for limiter in reversed(held):
+        limiter.release()
+
+
+_limits: ConcurrencyLimits | None = None
+
+
+def get_concurrency_limits() -> ConcurrencyLimits:
+    global _limits
+    if _limits is None:
+        _limits = ConcurrencyLimits(Settings())
+    return _limits
+
+
+def concurrency_metrics() -> str:
+    return _limits.metrics() if _limits is not None else ""
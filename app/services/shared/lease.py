@@ -0,0 +1,28 @@
+from models.lease_model.lease_model import WorkerLease
+
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+import os
+import socket
+
+
+def _holder() -> str:
+    # Read on every call, forked workers share the module but not the pid
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire_lease(name: str, seconds: float) -> bool:
+    """Take or renew the named lease, False while another worker holds it"""
+    holder = _holder()
+    now = datetime.now()
+    try:
+        await WorkerLease.get_motor_collection().update_one(
+            {"name": name, "$or": [{"holder": holder}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"holder": holder, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Held by another worker, the upsert collided with its document
+        return False
+    return True
@@ -1,6 +1,16 @@
 from models.user_model.user_model import User
+from models.auth_model.auth_model import TokenState
+from services.shared.ttl_cache import TTLCache
+from config.config import Settings
 from passlib.context import CryptContext
+from beanie import Document, PydanticObjectId
+from fastapi import HTTPException
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
 
+import asyncio
+
+# Single hashing context shared by every service
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 async def get_user_from_db(email: str) -> User | None:
@@ -12,4 +22,72 @@ async def get_user_from_db(email: str) -> User | None:
     
     
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+
+_hash_pool: ThreadPoolExecutor | None = None
+
+
+async def hash_passwords(passwords: list[str]) -> list[str]:
+    """Hash many passwords off the event loop, bcrypt releases the GIL"""
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(
+            max_workers=Settings().PASSWORD_HASH_WORKERS,
+            thread_name_prefix="password-hash",
+        )
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(loop.run_in_executor(_hash_pool, get_password_hash, p) for p in passwords)
+    )
+
+
+def warm_up_password_hashing():
+    """Load the bcrypt backend ahead of the first login"""
+    # Minimum cost keeps the warm-up cheap while exercising the same code path
+    pwd_context.handler().using(rounds=4).hash("warm-up")
+
+
+_token_states: TTLCache | None = None
+
+
+def _token_state_cache() -> TTLCache:
+    global _token_states
+    if _token_states is None:
+        _token_states = TTLCache(ttl=Settings().TOKEN_STATE_CACHE_SECONDS)
+    return _token_states
+
+
+async def get_token_state(user_id: PydanticObjectId) -> TokenState | None:
+    """Token version and disabled flag of a user, cached for a few seconds"""
+    cache = _token_state_cache()
+    state = cache.get(user_id)
+    if state is None:
+        state = await User.find_one(User.id == user_id).project(TokenState)
+        if state is None:
+            return None
+        cache.set(user_id, state)
+    return state
+
+
+def forget_token_state(user_id: PydanticObjectId):
+    """Drop the cached token state after the user's token version changed"""
+    _token_state_cache().pop(user_id)
+
+
+async def update_with_revision(document: Document, update: dict):
+    """Apply a partial update only if the document is unchanged since it was loaded"""
+    update = dict(update)
+    update["$set"] = {**update.get("$set", {}), "revision_id": uuid4()}
+    result = await type(document).find_one(
+        {"_id": document.id, "revision_id": document.revision_id}
+    ).update(update)
+    if result.matched_count == 0:
+        raise HTTPException(
+            status_code=409,
+            detail="The record was changed by another request, please retry",
+        )
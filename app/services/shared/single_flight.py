@@ -0,0 +1,41 @@
+import asyncio
+import functools
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight call"""
+
+    def __init__(self):
+        self._calls: dict = {}
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # A cancelled caller must not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+
+def single_flight(name: str, generation=None):
+    """Coalesce concurrent calls of the decorated coroutine with equal arguments
+
+    `generation(*args, **kwargs)` is read when a caller arrives and only calls
+    of the same generation are shared, so a caller that has seen a newer
+    listing version never joins a call that started before the write. The
+    shared result must be treated as read only.
+    """
+    group = SingleFlight()
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            if generation is not None:
+                key += (generation(*args, **kwargs),)
+            return await group.do(key, lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
@@ -7,18 +7,52 @@ from models.user_model.user_model import (
     UpdateUserByAdmin,
     UpdateVendorByAdmin,
     RegisterVendorByAdmin,
+    UserTypeView,
+    VendorProfile,
+    VENDOR_PROFILE_FIELDS,
+)
+from models.auth_model.auth_model import (
+    TokenData,
+    ResetPasswordData,
+    Principal,
+    AuthChallenge,
 )
-from models.auth_model.auth_model import TokenData, ResetPasswordData
 from models.food_model.food_model import Food
 from services.auth.auth_services import (
-    send_verification_email,
+    new_verification_challenge,
+    enqueue_verification_email,
     send_approval_waiting_email,
     send_approval_email,
     send_rejection_email,
+    get_auth_challenge,
+    delete_auth_challenges,
+)
+from services.foods.food_change_services import record_food_deletions
+from services.foods.food_counter_services import delete_count_shards
+from services.images.image_services import delete_images
+from services.versions.version_services import (
+    GLOBAL_KEY,
+    bump_versions,
+    get_version,
+    vendor_key,
+)
+from services.monitoring.request_context import set_request_user
+from services.shared.ttl_cache import TTLCache
+from services.shared.single_flight import single_flight
+from services.shared.shared_services import (
+    get_user_from_db,
+    verify_password,
+    get_password_hash,
+    hash_passwords,
+    get_token_state,
+    forget_token_state,
+    update_with_revision,
 )
-from services.shared.shared_services import get_user_from_db, verify_password
 
-from fastapi import Depends, HTTPException, status, Form, Body, UploadFile
+from fastapi import Depends, HTTPException, status, Form, Body
+from fastapi.encoders import jsonable_encoder
+from beanie import Document, PydanticObjectId
+from pymongo.errors import DuplicateKeyError
 from typing import Annotated
 from fastapi.security import OAuth2PasswordBearer
 
@@ -26,20 +60,17 @@ from config.config import Settings
 
 import jwt
 from jwt.exceptions import InvalidTokenError
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 
 from bson.objectid import ObjectId
-import base64
+from uuid import uuid4
+import asyncio
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# vendor id -> (vendor listing version, user type or None)
+_vendor_types = TTLCache(ttl=300)
 
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
@@ -61,9 +92,57 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     user = await get_user_from_db(email=token_data.email)
     if user is None:
         raise credentials_exception
+    if payload.get("ver", user.token_version) != user.token_version:
+        raise credentials_exception
+    set_request_user(user.id)
     return user
 
 
+async def get_current_principal(token: Annotated[str, Depends(oauth2_scheme)]):
+    """Authorize from the token claims, only checking the token version"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(
+            token, Settings().SECRET_KEY, algorithms=[Settings().ALGORITHM]
+        )
+    except InvalidTokenError:
+        raise credentials_exception
+
+    if not {"sub", "uid", "role", "ver"} <= payload.keys():
+        # Tokens issued before the claims were embedded
+        user = await get_current_user(token)
+        if user.disabled:
+            raise HTTPException(status_code=400, detail="Inactive user")
+        return Principal(
+            id=user.id,
+            email=user.email,
+            user_type=user.user_type,
+            token_version=user.token_version,
+        )
+
+    try:
+        principal = Principal(
+            id=payload["uid"],
+            email=payload["sub"],
+            user_type=payload["role"],
+            token_version=payload["ver"],
+        )
+    except ValueError:
+        raise credentials_exception
+
+    token_state = await get_token_state(principal.id)
+    if token_state is None or token_state.token_version != principal.token_version:
+        raise credentials_exception
+    if token_state.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    set_request_user(principal.id)
+    return principal
+
+
 async def get_user_type_by_email(email: str):
     user = await get_user_from_db(email)
     if user:
@@ -79,39 +158,116 @@ async def get_current_active_user(
     return current_user
 
 
-async def create_user(form_data: Annotated[CreateUser, Form()]):
-    existing_user = await get_user_from_db(form_data.email)
-    if existing_user:
+async def with_vendor_profiles(users: list[User]) -> list[dict]:
+    """Users as returned by the API, with the vendor profile fields merged in"""
+    vendor_ids = [user.id for user in users if user.user_type == UserType.VENDOR]
+    profiles = {}
+    if vendor_ids:
+        profiles = {
+            profile["user_id"]: profile
+            async for profile in VendorProfile.get_motor_collection().find(
+                {"user_id": {"$in": vendor_ids}},
+                {"user_id": 1, **{field: 1 for field in VENDOR_PROFILE_FIELDS}},
+            )
+        }
+    return [
+        {
+            **jsonable_encoder(user),
+            **{
+                field: profiles.get(user.id, {}).get(field)
+                for field in VENDOR_PROFILE_FIELDS
+            },
+        }
+        for user in users
+    ]
+
+
+async def delete_user_data(user_ids: list):
+    """Remove the profile, its image and pending codes kept next to the users"""
+    profiles = VendorProfile.get_motor_collection()
+    await delete_images(
+        [
+            profile["image_id"]
+            async for profile in profiles.find(
+                {"user_id": {"$in": user_ids}, "image_id": {"$ne": None}},
+                {"image_id": 1},
+            )
+        ]
+    )
+    await profiles.delete_many({"user_id": {"$in": user_ids}})
+    await delete_auth_challenges(user_ids)
+
+
+async def hash_new_user_password(email: str, password: str) -> str:
+    """Refuse a taken email before paying for bcrypt, then hash off the loop
+
+    The unique email index in insert_user still decides concurrent signups.
+    """
+    if await User.get_motor_collection().find_one({"email": email}, {"_id": 1}):
         raise HTTPException(status_code=409, detail="User already exists")
+    return (await hash_passwords([password]))[0]
 
-    hashed_password = get_password_hash(form_data.password)
+
+async def insert_user(user: User, *related: Document):
+    """Insert a new user together with its side documents
+
+    The unique email index detects existing users, nothing is left behind
+    when any of the inserts fails.
+    """
+    if user.id is None:
+        user.id = PydanticObjectId()
+    results = await asyncio.gather(
+        user.insert(),
+        *(document.insert() for document in related),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    if not errors:
+        return
+
+    if not isinstance(results[0], Exception):
+        await User.find_one(User.id == user.id).delete()
+    await delete_user_data([user.id])
+    if isinstance(results[0], DuplicateKeyError):
+        raise HTTPException(status_code=409, detail="User already exists")
+    raise errors[0]
+
+
+async def create_user(form_data: Annotated[CreateUser, Form()]):
+    user = User(
+        **form_data.model_dump(),
+        hashed_password=await hash_new_user_password(
+            form_data.email, form_data.password
+        ),
+        disabled=True,
+        id=PydanticObjectId(),
+    )
     try:
-        await User.insert_one(
-            User(
-                **form_data.model_dump(),
-                hashed_password=hashed_password,
-            )
-        )
-        newUser = await get_user_from_db(form_data.email)
-        newUser.disabled = True
-        await newUser.save()
-        await send_verification_email(newUser.email)
+        challenge = new_verification_challenge(user.id)
+        await insert_user(user, challenge)
+        if user.user_type == UserType.VENDOR:
+            await bump_versions(user.id)
+        await enqueue_verification_email(user.email, challenge.verification_code)
         return {"message": "User created"}
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"User not created: {str(e)}")
 
 
+@single_flight("list_vendors", generation=lambda: get_version(GLOBAL_KEY))
 async def list_vendors():
     vendors = await User.find(User.user_type == UserType.VENDOR.value).to_list()
 
     vendor_list = []
-    for vendor in vendors:
-        total_count = await Food.find(Food.vendor.id == vendor.id).sum("count")
+    profiles = await with_vendor_profiles(vendors)
+    for vendor, profile in zip(vendors, profiles):
+        total_count = await Food.find(Food.vendor_id == vendor.id).sum("count")
         if total_count is None:
             total_count = 0  # Set default value if total_count is None
         vendor_list.append(
             {
-                "vendor": vendor,
+                "vendor": profile,
                 "total_count": total_count,
             }
         )
@@ -122,14 +278,39 @@ async def list_vendors():
     )
 
     vendor_list.sort(
-        key=lambda x: x["vendor"].status,
+        key=lambda x: x["vendor"]["status"],
         reverse=True,
     )
 
     return vendor_list
 
 
-async def get_user_by_id(user_id: str):
+async def check_vendor(vendor_id: str) -> ObjectId:
+    """Make sure the id belongs to a vendor, answered from cache when unchanged"""
+    try:
+        vendor_object_id = ObjectId(vendor_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Vendor not found")
+
+    # Any vendor mutation bumps the vendor version, which invalidates the entry
+    version = get_version(vendor_key(vendor_object_id))
+    cached = _vendor_types.get(vendor_object_id)
+    if cached is not None and cached[0] == version:
+        user_type = cached[1]
+    else:
+        view = await User.find_one(User.id == vendor_object_id).project(UserTypeView)
+        user_type = view.user_type if view else None
+        _vendor_types.set(vendor_object_id, (version, user_type))
+
+    if user_type is None:
+        raise HTTPException(status_code=404, detail="Vendor not found")
+    if user_type != UserType.VENDOR:
+        raise HTTPException(status_code=403, detail="The given user is not a vendor")
+    return vendor_object_id
+
+
+async def find_user_by_id(user_id: str):
+    """A user document of the caller's own, safe to modify"""
     try:
         user = await User.find_one(User.id == ObjectId(user_id))
         return user
@@ -137,6 +318,12 @@ async def get_user_by_id(user_id: str):
         return {"message": "User not found", "error": str(e)}
 
 
+@single_flight("user_by_id")
+async def get_user_by_id(user_id: str):
+    """Shared between concurrent readers, use find_user_by_id to write"""
+    return await find_user_by_id(user_id)
+
+
 async def update_user(
     user_data: Annotated[UpdateUser, Body()],
     current_user: User = Depends(get_current_user),
@@ -167,18 +354,30 @@ async def update_user(
             update_data["hashed_password"] = get_password_hash(
                 update_data["new_password"]
             )
+            # Changing the password revokes the issued tokens
+            update_data["token_version"] = current_user.token_version + 1
             del update_data["current_password"]
             del update_data["new_password"]
 
-        for key, value in update_data.items():
-            if value is not None:
-                setattr(current_user, key, value)
-
-        current_user.updated_at = datetime.now()
-
-        await current_user.save()
+        update_fields = {
+            key: value for key, value in update_data.items() if value is not None
+        }
+        update_fields["updated_at"] = datetime.now()
+
+        if "hashed_password" in update_fields:
+            # The current password was checked against the loaded document
+            await update_with_revision(current_user, {"$set": update_fields})
+        else:
+            await User.find_one(User.id == current_user.id).update(
+                {"$set": update_fields}
+            )
+        forget_token_state(current_user.id)
+        if current_user.user_type == UserType.VENDOR:
+            await bump_versions(current_user.id)
 
         return {"message": "User updated"}
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"User not updated: {str(e)}")
 
@@ -186,6 +385,10 @@ async def update_user(
 async def delete_user(current_user: User = Depends(get_current_user)):
     try:
         await current_user.delete()
+        await delete_user_data([current_user.id])
+        forget_token_state(current_user.id)
+        if current_user.user_type == UserType.VENDOR:
+            await bump_versions(current_user.id)
         return {"message": "User deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"User not deleted: {str(e)}")
@@ -194,23 +397,25 @@ async def delete_user(current_user: User = Depends(get_current_user)):
 async def register_vendor(
     form_data: Annotated[RegisterVendor, Form()],
 ):
-    existing_user = await get_user_from_db(form_data.email)
-    if existing_user:
-        raise HTTPException(status_code=409, detail="User already exists")
-
-    hashed_password = get_password_hash(form_data.password)
+    user = User(
+        **form_data.model_dump(),
+        hashed_password=await hash_new_user_password(
+            form_data.email, form_data.password
+        ),
+        disabled=True,
+        id=PydanticObjectId(),
+    )
     try:
-        await User.insert_one(
-            User(
-                **form_data.model_dump(),
-                hashed_password=hashed_password,
-            )
+        profile = VendorProfile(
+            user_id=user.id,
+            **form_data.model_dump(include=VENDOR_PROFILE_FIELDS | {"image_id"}),
         )
-        newUser = await get_user_from_db(form_data.email)
-        newUser.disabled = True
-        await newUser.save()
-        await send_approval_waiting_email(newUser.email)
+        await insert_user(user, profile)
+        await bump_versions(user.id)
+        await send_approval_waiting_email(user.email)
         return {"message": "User created"}
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"User not created: {str(e)}")
 
@@ -218,8 +423,8 @@ async def register_vendor(
 async def approve_vendor(user_id: str):
     try:
         user = await User.find_one(User.id == ObjectId(user_id))
-        user.disabled = False
-        await user.save()
+        await User.find_one(User.id == user.id).update({"$set": {"disabled": False}})
+        await bump_versions(user.id)
         await send_approval_email(user.email)
         return {"message": "Vendor approved"}
     except Exception as e:
@@ -230,45 +435,59 @@ async def reject_vendor(user_id: str):
     try:
         user = await User.find_one(User.id == ObjectId(user_id))
         await user.delete()
+        await delete_user_data([user.id])
+        forget_token_state(user.id)
+        await bump_versions(user.id)
         await send_rejection_email(user.email)
         return {"message": "Vendor rejected"}
     except Exception as e:
         return {"message": "Vendor could not rejected", "error": str(e)}
 
 
-async def get_image_content(file: UploadFile) -> bytes:
-    try:
-        contents = await file.read()
-        encoded_content = base64.b64encode(contents).decode("utf-8")
-        return encoded_content
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to get image content: {str(e)}",
-        )
-
-
 async def reset_user_password(
     data: Annotated[ResetPasswordData, Body()],
 ):
     user = await get_user_from_db(data.email)
     if user:
-        if data.reset_token != user.reset_token:
+        challenge = await get_auth_challenge(user.id)
+        if data.reset_token != challenge.reset_token:
             raise HTTPException(
                 status_code=400,
                 detail="Invalid reset token",
             )
-        if user.reset_token_expiration < datetime.now():
+        if challenge.reset_token_expiration < datetime.now():
             raise HTTPException(
                 status_code=400,
                 detail="Reset token expired! Please request a new one",
             )
 
         hashed_password = get_password_hash(data.password)
-        user.hashed_password = hashed_password
-        user.reset_token = None
-        user.reset_token_expiration = None
-        await user.save()
+        # The token is consumed atomically so it cannot be used twice
+        result = await AuthChallenge.find_one(
+            AuthChallenge.user_id == user.id,
+            AuthChallenge.reset_token == data.reset_token,
+        ).update(
+            {
+                "$set": {
+                    "reset_token": None,
+                    "reset_token_expiration": None,
+                },
+            }
+        )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid reset token",
+            )
+        # A new revision id makes a concurrent password change of the
+        # loaded document fail instead of silently overwriting this one
+        await User.find_one(User.id == user.id).update(
+            {
+                "$set": {"hashed_password": hashed_password, "revision_id": uuid4()},
+                "$inc": {"token_version": 1},
+            }
+        )
+        forget_token_state(user.id)
         return {"message": "Password reset successfully"}
     raise HTTPException(
         status_code=404,
@@ -278,7 +497,7 @@ async def reset_user_password(
 
 async def delete_user_as_admin(
     user_id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(
@@ -301,10 +520,15 @@ async def delete_user_as_admin(
                 detail="You are not authorized to delete this user",
             )
         if user.user_type == UserType.VENDOR:
-            foods = await Food.find(Food.vendor.id == user.id).to_list()
-            for food in foods:
-                await food.delete()
+            foods = await Food.find(Food.vendor_id == user.id).to_list()
+            await Food.find(Food.vendor_id == user.id).delete()
+            await record_food_deletions(foods)
+            await delete_count_shards([food.id for food in foods])
         await user.delete()
+        await delete_user_data([user.id])
+        forget_token_state(user.id)
+        if user.user_type == UserType.VENDOR:
+            await bump_versions(user.id)
         return {"message": "User deleted"}
     except Exception as e:
         raise HTTPException(
@@ -316,7 +540,7 @@ async def delete_user_as_admin(
 async def update_user_as_admin(
     user_id: str,
     user_data: Annotated[UpdateUserByAdmin, Body()],
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(
@@ -343,16 +567,28 @@ async def update_user_as_admin(
             if value == "":
                 update_data[key] = None
 
-        for key, value in update_data.items():
-            if value is not None:
-                setattr(user, key, value)
-
-        user.updated_at = datetime.now()
+        update = {
+            "$set": {
+                key: value for key, value in update_data.items() if value is not None
+            }
+        }
+        update["$set"]["updated_at"] = datetime.now()
+        if update_data.get("user_type") not in (None, user.user_type):
+            # The role claim of issued tokens is no longer valid
+            update["$inc"] = {"token_version": 1}
 
-        await user.save()
+        await User.find_one(User.id == user.id).update(update)
+        forget_token_state(user.id)
+        if UserType.VENDOR in (user.user_type, update_data.get("user_type")):
+            await bump_versions(user.id)
 
         return {"message": "User updated"}
 
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=409,
+            detail="Another user already has this email",
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -363,7 +599,7 @@ async def update_user_as_admin(
 async def update_vendor_as_admin(
     user_id: str,
     vendor_data: Annotated[UpdateVendorByAdmin, Body()],
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(
@@ -390,16 +626,38 @@ async def update_vendor_as_admin(
             if value == "":
                 update_data[key] = None
 
-        for key, value in update_data.items():
-            if value is not None:
-                setattr(user, key, value)
-
-        user.updated_at = datetime.now()
-
-        await user.save()
+        update = {
+            "$set": {
+                key: value
+                for key, value in update_data.items()
+                if value is not None and key not in VENDOR_PROFILE_FIELDS
+            }
+        }
+        update["$set"]["updated_at"] = datetime.now()
+        if update_data.get("user_type") not in (None, user.user_type):
+            # The role claim of issued tokens is no longer valid
+            update["$inc"] = {"token_version": 1}
+        profile_update = {
+            key: value
+            for key, value in update_data.items()
+            if value is not None and key in VENDOR_PROFILE_FIELDS
+        }
+
+        await User.find_one(User.id == user.id).update(update)
+        if profile_update:
+            await VendorProfile.get_motor_collection().update_one(
+                {"user_id": user.id}, {"$set": profile_update}, upsert=True
+            )
+        forget_token_state(user.id)
+        await bump_versions(user.id)
 
         return {"message": "Vendor updated"}
 
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=409,
+            detail="Another user already has this email",
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -409,7 +667,7 @@ async def update_vendor_as_admin(
 
 async def create_user_by_admin(
     form_data: Annotated[CreateUser, Form()],
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(
@@ -417,22 +675,20 @@ async def create_user_by_admin(
             detail="You are not authorized to access this resource",
         )
 
-    existing_user = await get_user_from_db(form_data.email)
-    if existing_user:
-        raise HTTPException(
-            status_code=409,
-            detail="User already exists",
-        )
-
-    hashed_password = get_password_hash(form_data.password)
+    user = User(
+        **form_data.model_dump(),
+        hashed_password=await hash_new_user_password(
+            form_data.email, form_data.password
+        ),
+        id=PydanticObjectId(),
+    )
     try:
-        await User.insert_one(
-            User(
-                **form_data.model_dump(),
-                hashed_password=hashed_password,
-            )
-        )
+        await insert_user(user)
+        if user.user_type == UserType.VENDOR:
+            await bump_versions(user.id)
         return {"message": "User created"}
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -442,7 +698,7 @@ async def create_user_by_admin(
 
 async def create_vendor_by_admin(
     form_data: Annotated[RegisterVendorByAdmin, Form()],
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(
@@ -450,22 +706,25 @@ async def create_vendor_by_admin(
             detail="You are not authorized to access this resource",
         )
 
-    existing_user = await get_user_from_db(form_data.email)
-    if existing_user:
-        raise HTTPException(
-            status_code=409,
-            detail="User already exists",
-        )
-
-    hashed_password = get_password_hash(form_data.password)
+    user = User(
+        **form_data.model_dump(),
+        hashed_password=await hash_new_user_password(
+            form_data.email, form_data.password
+        ),
+        id=PydanticObjectId(),
+    )
     try:
-        await User.insert_one(
-            User(
-                **form_data.model_dump(),
-                hashed_password=hashed_password,
-            )
+        await insert_user(
+            user,
+            VendorProfile(
+                user_id=user.id,
+                **form_data.model_dump(include=VENDOR_PROFILE_FIELDS),
+            ),
         )
+        await bump_versions(user.id)
         return {"message": "User created"}
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(
             status_code=500,
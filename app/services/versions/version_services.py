@@ -0,0 +1,215 @@
+from models.version_model.version_model import ResourceVersion
+from services.shared.compression import (
+    choose_encoding,
+    compress,
+    get_precompressed,
+    is_compressible,
+    set_precompressed,
+)
+from config.config import Settings
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from collections import deque
+
+import asyncio
+import hashlib
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = "global"
+
+# Local mirror of the resource_versions collection, read without any query
+_versions: dict[str, int] = {}
+_sync_task: asyncio.Task | None = None
+# key -> (monotonic time, mirrored version) taken at every sync
+_history: dict[str, deque] = {}
+# key -> largest lag asked of version_seen_before, older samples are dropped
+_history_horizon: dict[str, float] = {}
+# Upper bound on samples of a key nobody has asked about yet
+HISTORY_MAX_SAMPLES = 3600
+
+
+def vendor_key(vendor_id) -> str:
+    return f"vendor:{vendor_id}"
+
+
+def _observe(key: str, version: int):
+    # Versions only move forward, a late sync must not roll one back
+    if version > _versions.get(key, 0):
+        _versions[key] = version
+
+
+async def _bump(key: str):
+    document = await ResourceVersion.get_motor_collection().find_one_and_update(
+        {"key": key},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    _observe(key, document["version"])
+
+
+async def bump_versions(vendor_id=None):
+    """Invalidate the global listing and, if given, the vendor's food listing"""
+    keys = [GLOBAL_KEY]
+    if vendor_id is not None:
+        keys.append(vendor_key(vendor_id))
+    try:
+        await asyncio.gather(*(_bump(key) for key in keys))
+    except Exception:
+        logger.exception("Failed to bump listing versions")
+
+
+def get_version(key: str) -> int:
+    return _versions.get(key, 0)
+
+
+def track_version_history(key: str):
+    """Keep samples of a version so callers can ask what it was a while ago"""
+    _history.setdefault(key, deque(maxlen=HISTORY_MAX_SAMPLES))
+
+
+def version_seen_before(key: str, seconds: float) -> int | None:
+    """Version mirrored at least `seconds` ago, None if no sample is that old
+
+    The mirror trails the database, so the real version was at least this
+    high at that time.
+    """
+    _history_horizon[key] = max(seconds, _history_horizon.get(key, 0))
+    samples = _history.get(key)
+    cutoff = time.monotonic() - seconds
+    if not samples or samples[0][0] > cutoff:
+        return None
+    for sampled_at, version in reversed(samples):
+        if sampled_at <= cutoff:
+            return version
+
+
+def _prune_history(key: str, samples: deque, now: float):
+    horizon = _history_horizon.get(key)
+    if horizon is None:
+        return
+    # The newest sample past the horizon still answers the largest lag
+    cutoff = now - horizon
+    while len(samples) > 1 and samples[1][0] <= cutoff:
+        samples.popleft()
+
+
+def current_etag(keys: list[str], variant: str = "") -> str:
+    versions = "-".join(str(_versions.get(key, 0)) for key in keys)
+    if variant:
+        versions += "-" + hashlib.sha1(variant.encode("utf-8")).hexdigest()[:12]
+    return f'"{versions}"'
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def conditional_response(
+    request: Request,
+    keys: list[str],
+    producer,
+    variant: str = "",
+):
+    """Answer 304 from the version mirror or run `producer` and tag the result
+
+    Compressed bodies are kept per ETag, so a snapshot is only produced and
+    compressed once per encoding until its version moves.
+    """
+    etag = current_etag(keys, variant)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    cache_key = (request.url.path, request.url.query, etag, encoding)
+    if encoding is not None:
+        cached = get_precompressed(cache_key)
+        if cached is not None:
+            body, media_type, extra_headers = cached
+            return Response(
+                content=body,
+                media_type=media_type,
+                headers={**extra_headers, **headers, "Content-Encoding": encoding},
+            )
+
+    result = await producer()
+    if not isinstance(result, Response):
+        result = JSONResponse(content=jsonable_encoder(result))
+    result.headers.update(headers)
+
+    body = getattr(result, "body", None)
+    if (
+        encoding is None
+        or body is None
+        or len(body) < Settings().COMPRESSION_MIN_SIZE
+        or not is_compressible(result.media_type)
+    ):
+        return result
+
+    extra_headers = {
+        key: value
+        for key, value in result.headers.items()
+        if key not in ("content-length", "content-type", "etag", "cache-control", "vary")
+    }
+    compressed = compress(body, encoding)
+    set_precompressed(cache_key, (compressed, result.media_type, extra_headers))
+    return Response(
+        content=compressed,
+        status_code=result.status_code,
+        media_type=result.media_type,
+        headers={**extra_headers, **headers, "Content-Encoding": encoding},
+    )
+
+
+async def sync_versions():
+    async for document in ResourceVersion.get_motor_collection().find(
+        {}, {"key": 1, "version": 1}
+    ):
+        _observe(document["key"], document["version"])
+    now = time.monotonic()
+    for key, samples in _history.items():
+        samples.append((now, _versions.get(key, 0)))
+        _prune_history(key, samples, now)
+
+
+async def _run_sync():
+    while True:
+        await asyncio.sleep(Settings().VERSION_SYNC_SECONDS)
+        try:
+            await sync_versions()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Listing version sync error")
+
+
+async def start_version_sync():
+    global _sync_task
+    await sync_versions()
+    if _sync_task is None or _sync_task.done():
+        _sync_task = asyncio.create_task(_run_sync())
+
+
+async def stop_version_sync():
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        try:
+            await _sync_task
+        except asyncio.CancelledError:
+            pass
+        _sync_task = None